@@ -4,62 +4,60 @@ Admin script to manage users in the chat application
 """
 
 import sys
-from app import create_app, db
+from app import create_app, db, user_admin
 from app.models import User
 
-def verify_all_users():
+def _print_progress(done, total):
+    print(f"  {done}/{total} verified ({done * 100 // total}%)")
+
+def verify_all_users(batch_size=None):
     """Verify all users in the database"""
     
     app = create_app()
     
     with app.app_context():
         try:
-            users = User.query.filter_by(email_verified=False).all()
+            total = user_admin.count_users(unverified=True)
             
-            if not users:
+            if not total:
                 print("All users are already verified.")
                 return True
             
-            print(f"Found {len(users)} unverified users. Verifying...")
-            
-            for user in users:
-                user.email_verified = True
-                user.email_verification_token = None
-                user.email_verification_token_expires = None
-                print(f"✓ Verified: {user.username} ({user.email})")
+            print(f"Found {total} unverified users. Verifying...")
             
-            db.session.commit()
+            verified = user_admin.verify_all(batch_size, progress=_print_progress)
             
-            print(f"\nSUCCESS: Verified {len(users)} users!")
+            print(f"\nSUCCESS: Verified {verified} users!")
             print("All users can now log in without email verification.")
             
             return True
             
         except Exception as e:
+            db.session.rollback()
             print(f"ERROR: Failed to verify users: {str(e)}")
             return False
 
-def list_all_users():
+def list_all_users(batch_size=None):
     """List all users with their status"""
     
     app = create_app()
     
     with app.app_context():
         try:
-            users = User.query.all()
+            total = user_admin.count_users()
             
-            if not users:
+            if not total:
                 print("No users found in the database.")
                 return
             
-            print("All Users in Database:")
+            print(f"All Users in Database ({total}):")
             print("=" * 80)
             
-            for i, user in enumerate(users, 1):
+            for i, user in enumerate(user_admin.stream_users(batch_size), 1):
                 status = "Verified" if user.email_verified else "Not Verified"
                 active = "Active" if user.is_active else "Inactive"
                 
-                print(f"{i}. Username: {user.username}")
+                print(f"{i}/{total}. Username: {user.username}")
                 print(f"   Email: {user.email}")
                 print(f"   Name: {user.first_name or 'N/A'} {user.last_name or 'N/A'}")
                 print(f"   Status: {status}")
@@ -72,7 +70,7 @@ def list_all_users():
             print(f"ERROR: Failed to list users: {str(e)}")
 
 def delete_user(username_or_email):
-    """Delete a user from the database"""
+    """Delete a user from the database (retired instead if they have messages)"""
     
     app = create_app()
     
@@ -89,10 +87,12 @@ def delete_user(username_or_email):
             username = user.username
             email = user.email
             
-            db.session.delete(user)
-            db.session.commit()
+            outcome = user_admin.delete_user(user)
             
-            print(f"SUCCESS: User '{username}' ({email}) has been deleted!")
+            if outcome == 'retired':
+                print(f"SUCCESS: User '{username}' ({email}) has been retired; their messages keep the username.")
+            else:
+                print(f"SUCCESS: User '{username}' ({email}) has been deleted!")
             
             return True
             
@@ -144,8 +144,8 @@ if __name__ == '__main__':
     
     if len(sys.argv) < 2:
         print("Usage:")
-        print("  python admin_users.py --list                    - List all users")
-        print("  python admin_users.py --verify-all              - Verify all users")
+        print("  python admin_users.py --list [batch_size]       - List all users")
+        print("  python admin_users.py --verify-all [batch_size] - Verify all users")
         print("  python admin_users.py --delete <username>       - Delete a user")
         print("  python admin_users.py --create-test             - Create test user")
         print("")
@@ -157,11 +157,12 @@ if __name__ == '__main__':
         sys.exit(1)
     
     command = sys.argv[1]
+    batch_size = int(sys.argv[2]) if command in ('--list', '--verify-all') and len(sys.argv) > 2 else None
     
     if command == '--list':
-        list_all_users()
+        list_all_users(batch_size)
     elif command == '--verify-all':
-        if verify_all_users():
+        if verify_all_users(batch_size):
             print("\nAll users can now log in at: http://127.0.0.1:5000/login")
     elif command == '--delete':
         if len(sys.argv) < 3:
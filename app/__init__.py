@@ -1,38 +1,66 @@
+import time
+_import_started = time.perf_counter()
+
 from flask import Flask, request, session
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_socketio import SocketIO
 from flask_login import LoginManager, current_user
-from flask_mail import Mail
-from authlib.integrations.flask_client import OAuth
 from config import config
+import click
 import os
+import sys
 from datetime import datetime
 
+# Flask-Mail (app/email_service.py) and Authlib (Google login in app/routes.py)
+# are imported and registered on first use, not at startup
 db = SQLAlchemy()
 socketio = SocketIO()
 login_manager = LoginManager()
-mail = Mail()
-oauth = OAuth()
 
 def create_app(config_name=None):
     if config_name is None:
         config_name = os.environ.get('FLASK_ENV', 'development')
     
+    started = time.perf_counter()
     app = Flask(__name__)
     app.config.from_object(config[config_name])
     
+    # Size the DB pool from worker concurrency before the engine is created
+    from app import green
+    green.configure_pool(app)
+    
     # Initialize extensions
     db.init_app(app)
-    migrate = Migrate(app, db)
-    socketio.init_app(app, cors_allowed_origins="*")
+    socketio.init_app(app, cors_allowed_origins="*",
+                      message_queue=app.config.get('SOCKETIO_MESSAGE_QUEUE'))
     login_manager.init_app(app)
-    mail.init_app(app)
-    oauth.init_app(app)
+    
+    # Session data is kept server-side; the cookie only carries its id
+    from app import sessions
+    sessions.init_app(app)
+    # Alembic is only needed by the `flask` CLI (which builds the app inside a
+    # click context) and by admin scripts that import flask_migrate themselves
+    if 'flask_migrate' in sys.modules or click.get_current_context(silent=True) is not None:
+        from flask_migrate import Migrate
+        Migrate(app, db)
     login_manager.login_view = 'main.login'
     login_manager.login_message = 'Please log in to access this page.'
     login_manager.login_message_category = 'info'
     
+    # Metrics: per-route latency and DB pool checkout waits
+    from app import metrics
+    metrics.init_app(app)
+    with app.app_context():
+        metrics.instrument_engine(db.engine)
+    
+    # Per-request/per-event SQL query accounting
+    from app import profiler
+    profiler.init_app(app)
+    
+    # Room ownership ring (heartbeat is started by run.py, not by scripts)
+    from app import sharding
+    sharding.init_app(app)
+    
     # Security headers middleware
     @app.after_request
     def add_security_headers(response):
@@ -40,14 +68,22 @@ def create_app(config_name=None):
             response.headers[header] = value
         return response
     
-    # User activity tracking
+    # User activity tracking (throttled so page loads don't each issue an UPDATE)
     @app.before_request
     def before_request():
         from flask_login import current_user
-        if current_user.is_authenticated:
+        if current_user.is_authenticated and current_user.last_seen_is_stale():
             current_user.update_last_seen()
             db.session.commit()
     
+    # Name the route running when the hub stalls (the watchdog starts in run.py)
+    from app import watchdog
+    watchdog.init_app(app)
+    
+    # Import, create_app and first-request timings
+    from app import startup
+    startup.init_app(app)
+    
     # Register Blueprints
     from app.routes import main
     app.register_blueprint(main)
@@ -60,6 +96,8 @@ def create_app(config_name=None):
     if upload_folder and not os.path.exists(upload_folder):
         os.makedirs(upload_folder)
     
+    startup.record('create_app', time.perf_counter() - started)
+    startup.report_ready()
     return app
 
 # User loader must be placed outside the create_app function
@@ -68,3 +106,6 @@ from app.models import User
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
+
+from app import startup
+startup.record('import', time.perf_counter() - _import_started)
@@ -0,0 +1,182 @@
+"""
+Admission control and load shedding for Socket.IO traffic
+
+Under overload the worker protects chat messages first:
+
+  * normal     everything is accepted
+  * shedding   typing indicators, read receipts and trace reports are dropped,
+               and presence lists are coalesced into one refresh per room per
+               ADMISSION_PRESENCE_INTERVAL seconds
+  * rejecting  new message writes are refused too
+
+The worker is shedding when the hub lags by ADMISSION_SHED_LAG_MS (measured
+by app/watchdog.py) or half of ADMISSION_MAX_PENDING_WRITES handlers are
+busy persisting messages. It rejects at ADMISSION_REJECT_LAG_MS or the full
+write limit. Connections beyond ADMISSION_MAX_SOCKETS and joins beyond
+ADMISSION_JOINS_PER_SECOND are refused regardless. Every refusal tells the
+client when to retry: connections fail with an "overloaded" connect_error,
+rejected events are answered with {'status': 'retry_later', 'retry_after': s}
+and a `retry_later` event.
+"""
+
+import random
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, request
+from flask_socketio import ConnectionRefusedError, emit
+
+from app import metrics, socketio, watchdog
+
+NORMAL, SHEDDING, REJECTING = 'normal', 'shedding', 'rejecting'
+
+SHED_EVENTS = metrics.registry.counter(
+    'socketio_shed_events_total',
+    'Non-essential Socket.IO events dropped while shedding load',
+    ('event',)
+)
+REJECTED = metrics.registry.counter(
+    'socketio_admission_rejected_total',
+    'Connections and events refused with a retry-later signal',
+    ('event', 'reason')
+)
+
+_state = {'sockets': 0, 'writes': 0}
+_join_bucket = {'tokens': None, 'updated': 0.0}
+_deferred_presence = set()  # rooms whose user_list refresh was coalesced
+_lock = threading.Lock()
+
+metrics.registry.gauge(
+    'socketio_pending_writes',
+    'Socket handlers currently persisting a message',
+    callback=lambda: [((), _state['writes'])]
+)
+
+
+def level():
+    """Current overload level: normal, shedding or rejecting"""
+    config = current_app.config
+    lag_ms = watchdog.recent_lag() * 1000
+    max_writes = config.get('ADMISSION_MAX_PENDING_WRITES', 200)
+    if lag_ms >= config.get('ADMISSION_REJECT_LAG_MS', 1000) or _state['writes'] >= max_writes:
+        return REJECTING
+    if lag_ms >= config.get('ADMISSION_SHED_LAG_MS', 100) or _state['writes'] >= max_writes // 2:
+        return SHEDDING
+    return NORMAL
+
+
+def shedding():
+    return level() != NORMAL
+
+
+def retry_after():
+    """Seconds a refused client should wait, jittered so retries don't arrive together"""
+    base = current_app.config.get('ADMISSION_RETRY_AFTER', 2)
+    return round(base * (1 + random.random()), 1)
+
+
+def _refuse(event, reason):
+    REJECTED.inc(labels=(event, reason))
+    signal = {'status': 'retry_later', 'event': event, 'reason': reason, 'retry_after': retry_after()}
+    emit('retry_later', signal)
+    return signal
+
+
+def connected():
+    """Admit a new socket or raise ConnectionRefusedError with a retry hint"""
+    limit = current_app.config.get('ADMISSION_MAX_SOCKETS', 5000)
+    reason = None
+    if limit and _state['sockets'] >= limit:
+        reason = 'max_sockets'
+    elif level() == REJECTING:
+        reason = 'overloaded'
+    if reason:
+        REJECTED.inc(labels=('connect', reason))
+        raise ConnectionRefusedError('overloaded', {'reason': reason, 'retry_after': retry_after()})
+    with _lock:
+        _state['sockets'] += 1
+
+
+def disconnected():
+    with _lock:
+        _state['sockets'] = max(_state['sockets'] - 1, 0)
+
+
+def _take_join_token():
+    rate = current_app.config.get('ADMISSION_JOINS_PER_SECOND', 50)
+    if not rate:
+        return True
+    now = time.monotonic()
+    with _lock:
+        tokens = _join_bucket['tokens']
+        tokens = rate * 2 if tokens is None else min(rate * 2, tokens + (now - _join_bucket['updated']) * rate)
+        _join_bucket['updated'] = now
+        if tokens < 1:
+            _join_bucket['tokens'] = tokens
+            return False
+        _join_bucket['tokens'] = tokens - 1
+        return True
+
+
+def join(f):
+    """Rate-limit joins, focus changes and subscriptions"""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if not _take_join_token():
+            return _refuse(request.event['message'], 'join_rate')
+        return f(*args, **kwargs)
+    return wrapper
+
+
+def persistence(f):
+    """Bound concurrent message writes; refused while rejecting"""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if level() == REJECTING:
+            return _refuse(request.event['message'], 'overloaded')
+        with _lock:
+            _state['writes'] += 1
+        try:
+            return f(*args, **kwargs)
+        finally:
+            with _lock:
+                _state['writes'] -= 1
+    return wrapper
+
+
+def nonessential(f):
+    """Drop the event while the worker is shedding load"""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if shedding():
+            SHED_EVENTS.inc(labels=(request.event['message'],))
+            return None
+        return f(*args, **kwargs)
+    return wrapper
+
+
+def defer_presence(room):
+    """Whether a presence refresh for `room` was coalesced instead of sent now"""
+    if not shedding():
+        return False
+    with _lock:
+        _deferred_presence.add(room)
+    return True
+
+
+def _presence_loop(app, refresh, interval):
+    while True:
+        socketio.sleep(interval)
+        with _lock:
+            rooms = list(_deferred_presence)
+            _deferred_presence.clear()
+        with app.app_context():
+            for room in rooms:
+                refresh(room)
+
+
+def start(app, refresh_presence):
+    """Send coalesced presence refreshes; `refresh_presence(room)` broadcasts one room's list"""
+    socketio.start_background_task(_presence_loop, app, refresh_presence,
+                                   app.config.get('ADMISSION_PRESENCE_INTERVAL', 2))
@@ -0,0 +1,97 @@
+"""
+Adaptive micro-batching of room broadcasts
+
+A quiet room gets one `receive_message` frame per message. Once a room sends
+BROADCAST_BATCH_THRESHOLD messages per second or more, its messages are held
+for up to BROADCAST_BATCH_WINDOW_MS and sent to every member as a single
+`receive_messages` frame ({'room': room, 'messages': [...]}), so a hot room
+costs one frame per client per window instead of one per message. The room
+goes back to single frames once its rate drops below the threshold.
+
+Messages in a batch keep their order, and a message sent while a batch is
+pending joins that batch, so no message overtakes another.
+"""
+
+import threading
+import time
+
+from flask import current_app
+
+from app import metrics, socketio, tracing
+
+BATCH_SIZE = metrics.registry.histogram(
+    'chat_broadcast_batch_size',
+    'Room messages per receive_messages frame',
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+BROADCAST_FRAMES = metrics.registry.counter(
+    'chat_broadcast_frames_total',
+    'Room broadcasts by frame type',
+    ('frame',)
+)
+
+_rates = {}    # room -> [period start, messages this period, rate of the last period]
+_pending = {}  # room -> [(payload, trace), ...] waiting for the batch window to end
+_lock = threading.Lock()
+
+
+def _rate(room, now):
+    """Note one message in `room`; returns its current message rate per second"""
+    state = _rates.get(room)
+    if state is None:
+        state = _rates[room] = [now, 0, 0.0]
+    elapsed = now - state[0]
+    if elapsed >= 1.0:
+        # A period with no messages at all counts as a quiet one
+        state[2] = state[1] / elapsed if elapsed < 2.0 else 0.0
+        state[0], state[1] = now, 0
+    state[1] += 1
+    return max(state[2], state[1])
+
+
+def publish(room, payload, trace=None):
+    """Broadcast a room message now, or add it to the room's pending batch"""
+    config = current_app.config
+    threshold = config.get('BROADCAST_BATCH_THRESHOLD', 20)
+    with _lock:
+        batching = threshold and (room in _pending or _rate(room, time.monotonic()) >= threshold)
+        if batching:
+            batch = _pending.get(room)
+            if batch is None:
+                batch = _pending[room] = []
+                window = config.get('BROADCAST_BATCH_WINDOW_MS', 20) / 1000
+                socketio.start_background_task(_flush_later, current_app._get_current_object(), room, window)
+            batch.append((payload, trace))
+    if batching:
+        return
+
+    BROADCAST_FRAMES.inc(labels=('single',))
+    socketio.emit('receive_message', payload, to=room)
+    tracing.broadcast(trace, room)
+
+
+def _flush_later(app, room, window):
+    socketio.sleep(window)
+    with app.app_context():
+        flush(room)
+
+
+def flush(room):
+    """Send the room's pending batch right away, if there is one"""
+    with _lock:
+        batch = _pending.pop(room, None)
+    if not batch:
+        return 0
+    BROADCAST_FRAMES.inc(labels=('batch',))
+    BATCH_SIZE.observe(len(batch))
+    socketio.emit('receive_messages', {'room': room, 'messages': [payload for payload, _ in batch]}, to=room)
+    for _, trace in batch:
+        tracing.broadcast(trace, room)
+    return len(batch)
+
+
+def forget(room):
+    """Flush and drop a room's state (the room moved to another worker)"""
+    flush(room)
+    with _lock:
+        _rates.pop(room, None)
@@ -0,0 +1,258 @@
+"""
+Bulk import of message history from NDJSON
+
+Each input line is one message, in the format app/export.py writes:
+
+    {"timestamp": "2019-05-01T12:00:00", "room": "general", "username": "alice", "content": "hi"}
+    {"timestamp": "...", "username": "alice", "recipient": "bob", "is_private": true, "content": "..."}
+
+Lines are loaded IMPORT_BATCH_SIZE at a time, with COPY on PostgreSQL and a
+batched executemany elsewhere. Every batch commits together with its
+import_checkpoints row, which records the byte offset of the next line, so an
+interrupted import resumes right after the last committed batch with no
+duplicates.
+
+Rooms and users that don't exist yet are created (users as placeholder
+accounts without a password). Imported room messages get no seq, private
+messages are marked delivered, and content_html is rendered from the content.
+
+With defer_indexes the secondary indexes on `message` are dropped for the load
+and rebuilt once the whole file is in, also when a deferred import is resumed
+later. Only use it before the app serves traffic: history queries need them.
+
+Run it through import_history.py, not inside the eventlet server: green
+psycopg2 connections don't support COPY.
+"""
+
+import gzip
+import io
+import json
+import os
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import insert, select, text, update
+
+from app import db, green, rendering
+from app.models import ImportCheckpoint, Message, Room, User
+
+PLACEHOLDER_EMAIL_DOMAIN = 'imported.invalid'
+COPY_COLUMNS = ('user_id', 'room_id', 'recipient_id', 'content', 'content_html',
+                'timestamp', 'is_private', 'delivered_at')
+
+
+class ImportLineError(ValueError):
+    pass
+
+
+def _open(path):
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+
+def _timestamp(value):
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ImportLineError(f"invalid timestamp {value!r}")
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def _parse(line):
+    """One input line as a dict of names and values, or ImportLineError"""
+    try:
+        item = json.loads(line)
+    except ValueError as e:
+        raise ImportLineError(f"invalid JSON ({e})")
+    if not isinstance(item, dict):
+        raise ImportLineError("not a JSON object")
+    is_private = bool(item.get('is_private'))
+    if is_private and not item.get('recipient'):
+        raise ImportLineError("private message without a recipient")
+    if not is_private and not item.get('room'):
+        raise ImportLineError("room message without a room")
+    for key, limit in (('username', 64), ('recipient', 64), ('room', 100)):
+        if item.get(key) is not None and len(str(item[key])) > limit:
+            raise ImportLineError(f"{key} longer than {limit} characters")
+    return {
+        'username': None if item.get('username') is None else str(item['username']),
+        'room': None if is_private else str(item['room']),
+        'recipient': str(item['recipient']) if is_private else None,
+        'is_private': is_private,
+        'content': '' if item.get('content') is None else str(item['content']),
+        'timestamp': _timestamp(item.get('timestamp')),
+    }
+
+
+def _resolve(names, cache, model, name_column, new_row):
+    """Fill `cache` with ids for `names`, creating the ones that don't exist"""
+    missing = {name for name in names if name is not None and name not in cache}
+    if not missing:
+        return
+    column = getattr(model, name_column)
+    for row_id, name in db.session.execute(select(model.id, column).where(column.in_(missing))):
+        cache[name] = row_id
+    new = missing - cache.keys()
+    if new:
+        db.session.execute(insert(model.__table__), [new_row(name) for name in sorted(new)])
+        for row_id, name in db.session.execute(select(model.id, column).where(column.in_(new))):
+            cache[name] = row_id
+
+
+def _placeholder_user(username):
+    return {'username': username, 'email': f"{username}@{PLACEHOLDER_EMAIL_DOMAIN}"}
+
+
+def _rows(items, user_ids, room_ids):
+    rows = []
+    for item in items:
+        rows.append({
+            'user_id': user_ids.get(item['username']),
+            'room_id': room_ids.get(item['room']),
+            'recipient_id': user_ids.get(item['recipient']),
+            'content': item['content'],
+            'content_html': rendering.render_text(item['content']),
+            'timestamp': item['timestamp'],
+            'is_private': item['is_private'],
+            # Imported history is never queued for delivery
+            'delivered_at': item['timestamp'] if item['is_private'] else None,
+        })
+    return rows
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def _copy_rows(rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_value(row[column]) for column in COPY_COLUMNS))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY message ({', '.join(COPY_COLUMNS)}) FROM STDIN", buffer)
+    finally:
+        cursor.close()
+
+
+def _touch_rooms(rows):
+    latest = {}
+    for row in rows:
+        room_id = row['room_id']
+        if room_id is not None and (room_id not in latest or row['timestamp'] > latest[room_id]):
+            latest[room_id] = row['timestamp']
+    for room_id, timestamp in latest.items():
+        db.session.execute(
+            update(Room)
+            .where(Room.id == room_id)
+            .where((Room.last_message_at.is_(None)) | (Room.last_message_at < timestamp))
+            .values(last_message_at=timestamp)
+        )
+
+
+def set_indexes(enabled):
+    """Drop (False) or rebuild (True) the secondary indexes on message"""
+    connection = db.session.connection()
+    for index in sorted(Message.__table__.indexes, key=lambda index: index.name):
+        if enabled:
+            index.create(connection, checkfirst=True)
+        else:
+            index.drop(connection, checkfirst=True)
+
+
+def _checkpoint(source, restart):
+    checkpoint = db.session.get(ImportCheckpoint, source)
+    if checkpoint is not None and restart:
+        if checkpoint.indexes_deferred:
+            set_indexes(True)
+        db.session.delete(checkpoint)
+        db.session.flush()
+        checkpoint = None
+    if checkpoint is None:
+        checkpoint = ImportCheckpoint(source=source, byte_offset=0, line_count=0, row_count=0,
+                                      skipped_count=0, indexes_deferred=False)
+        db.session.add(checkpoint)
+    db.session.commit()
+    return checkpoint
+
+
+def import_file(path, source=None, batch_size=None, defer_indexes=False, restart=False, progress=None):
+    """Load an NDJSON (optionally .gz) file into message; returns its ImportCheckpoint
+
+    `source` names the checkpoint (default: the absolute path). `progress(checkpoint)`
+    is called after every committed batch and `progress(checkpoint, error)`
+    for lines that were skipped.
+    """
+    is_postgres = db.engine.dialect.name == 'postgresql'
+    if is_postgres and green.is_patched():
+        raise RuntimeError("COPY is not available on green psycopg2 connections; run import_history.py")
+    batch_size = batch_size or current_app.config.get('IMPORT_BATCH_SIZE', 10000)
+    checkpoint = _checkpoint(source or os.path.abspath(path), restart)
+    if checkpoint.finished_at is not None:
+        return checkpoint
+
+    if defer_indexes and not checkpoint.indexes_deferred:
+        set_indexes(False)
+        checkpoint.indexes_deferred = True
+        db.session.commit()
+
+    user_ids, room_ids = {}, {}
+    with _open(path) as fh:
+        fh.seek(checkpoint.byte_offset)
+        while True:
+            items = []
+            lines = 0
+            while lines < batch_size:
+                line = fh.readline()
+                if not line:
+                    break
+                lines += 1
+                if not line.strip():
+                    continue
+                try:
+                    items.append(_parse(line))
+                except ImportLineError as e:
+                    checkpoint.skipped_count += 1
+                    if progress:
+                        progress(checkpoint, f"line {checkpoint.line_count + lines}: {e}")
+            if not lines:
+                break
+
+            if is_postgres:
+                # A crash can only lose whole batches along with their checkpoint
+                db.session.execute(text("SET LOCAL synchronous_commit TO OFF"))
+            _resolve({item['username'] for item in items} | {item['recipient'] for item in items},
+                     user_ids, User, 'username', _placeholder_user)
+            _resolve({item['room'] for item in items}, room_ids, Room, 'name', lambda name: {'name': name})
+            rows = _rows(items, user_ids, room_ids)
+            if rows:
+                if is_postgres:
+                    _copy_rows(rows)
+                else:
+                    db.session.execute(insert(Message.__table__), rows)
+                _touch_rooms(rows)
+
+            checkpoint.byte_offset = fh.tell()
+            checkpoint.line_count += lines
+            checkpoint.row_count += len(rows)
+            checkpoint.updated_at = datetime.utcnow()
+            db.session.commit()
+            if progress:
+                progress(checkpoint)
+
+    if checkpoint.indexes_deferred:
+        set_indexes(True)
+        checkpoint.indexes_deferred = False
+    checkpoint.finished_at = datetime.utcnow()
+    db.session.commit()
+    return checkpoint
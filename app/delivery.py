@@ -0,0 +1,77 @@
+"""
+Store-and-forward delivery of private messages
+
+A private message whose recipient has no live socket is stored with
+delivered_at NULL. When the recipient next joins, their queue is read with one
+indexed query (ix_message_pending_delivery only holds pending rows), pushed in
+one `receive_private_messages` emit, and marked delivered with one UPDATE.
+
+Live messages are emitted to the recipient's personal room on every worker.
+When the sender's worker doesn't have the recipient, the message is stored as
+pending and the recipient's client confirms it with mark_received(), so it is
+not pushed a second time on their next join.
+"""
+
+from datetime import datetime
+
+from flask import current_app
+
+from app import db, name_cache
+from app.models import Message
+
+
+def private_payload(message, timestamp=None):
+    """Event payload for one private message"""
+    timestamp = timestamp or message.timestamp
+    return {
+        'id': message.id,
+        'sender': message.username,
+        'message': message.content,
+        'html': str(message.html),
+        'timestamp': timestamp.strftime('%H:%M:%S'),
+        'sent_at': timestamp.isoformat(),
+    }
+
+
+def pending_messages(recipient_id, limit=None):
+    """Oldest undelivered private messages for a recipient"""
+    if limit is None:
+        limit = current_app.config.get('PENDING_DELIVERY_BATCH', 500)
+    messages = (Message.query
+                .filter(Message.recipient_id == recipient_id,
+                        Message.is_private.is_(True),
+                        Message.delivered_at.is_(None))
+                .order_by(Message.id)
+                .limit(limit)
+                .all())
+    name_cache.prime_users(msg.user_id for msg in messages)
+    return messages
+
+
+def mark_delivered(messages, delivered_at=None):
+    """Flag messages as delivered with a single UPDATE"""
+    if not messages:
+        return 0
+    delivered_at = delivered_at or datetime.utcnow()
+    ids = [msg.id for msg in messages]
+    # The timestamp bounds let PostgreSQL skip partitions that can't match
+    updated = (Message.query
+               .filter(Message.id.in_(ids),
+                       Message.timestamp >= min(msg.timestamp for msg in messages),
+                       Message.timestamp <= max(msg.timestamp for msg in messages),
+                       Message.delivered_at.is_(None))
+               .update({Message.delivered_at: delivered_at}, synchronize_session=False))
+    db.session.commit()
+    return updated
+
+
+def mark_received(recipient_id, message_id, delivered_at=None):
+    """Flag one of the recipient's private messages as delivered; returns 1 if it was pending"""
+    updated = (Message.query
+               .filter(Message.id == message_id,
+                       Message.recipient_id == recipient_id,
+                       Message.delivered_at.is_(None))
+               .update({Message.delivered_at: delivered_at or datetime.utcnow()},
+                       synchronize_session=False))
+    db.session.commit()
+    return updated
@@ -3,11 +3,16 @@ Email service module for sending verification and password reset emails
 """
 
 from flask import current_app, render_template_string
-from flask_mail import Mail, Message
 import logging
 
-# Initialize Flask-Mail (will be configured in app factory)
-mail = Mail()
+
+def get_mail():
+    """Flask-Mail state for the current app, set up on the first email sent"""
+    state = current_app.extensions.get('mail')
+    if state is None:
+        from flask_mail import Mail
+        state = Mail().init_app(current_app)
+    return state
 
 def send_email(to, subject, template, **kwargs):
     """
@@ -23,6 +28,7 @@ def send_email(to, subject, template, **kwargs):
         bool: True if email sent successfully, False otherwise
     """
     try:
+        from flask_mail import Message
         msg = Message(
             subject=subject,
             recipients=[to],
@@ -38,7 +44,7 @@ def send_email(to, subject, template, **kwargs):
             return True
         
         # In production, actually send the email
-        mail.send(msg)
+        get_mail().send(msg)
         current_app.logger.info(f"Email sent successfully to {to}")
         return True
         
@@ -0,0 +1,182 @@
+"""
+Streaming export of room and user message history
+
+A room export holds every public message in the room. A user export holds
+every message the user sent plus the private messages they received. Both
+cover archived months (read line by line from the archive files, see
+app/partitions.py) followed by live rows read through a server-side cursor,
+EXPORT_FETCH_SIZE rows at a time, oldest first. Output is encoded into
+chunks of about EXPORT_CHUNK_SIZE bytes, optionally gzip-compressed as it
+goes, so memory use doesn't depend on how much history there is.
+
+Used by the /api/export routes and export_history.py.
+"""
+
+import csv
+import gzip
+import io
+import json
+import os
+import zlib
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import aliased
+
+from app import db
+from app.models import Message, MessageArchive, Room, User
+
+FORMATS = ('ndjson', 'csv')
+COLUMNS = ('id', 'timestamp', 'room', 'username', 'recipient', 'is_private', 'seq', 'content')
+
+
+class ExportTarget:
+    """What to export: a room's public history or one user's messages"""
+
+    def __init__(self, room=None, room_id=None, username=None, user_id=None):
+        self.room = room
+        self.room_id = room_id
+        self.username = username
+        self.user_id = user_id
+
+    @property
+    def name(self):
+        return f"room-{self.room}" if self.room is not None else f"user-{self.username}"
+
+
+def room_target(room):
+    """Target for a room, or None if the room doesn't exist"""
+    room_id = db.session.execute(select(Room.id).where(Room.name == room)).scalar()
+    return ExportTarget(room=room, room_id=room_id) if room_id is not None else None
+
+
+def user_target(username):
+    """Target for a user, or None if the user doesn't exist"""
+    user_id = db.session.execute(select(User.id).where(User.username == username)).scalar()
+    return ExportTarget(username=username, user_id=user_id) if user_id is not None else None
+
+
+def _in_range(timestamp, since, until):
+    return (since is None or timestamp >= since) and (until is None or timestamp < until)
+
+
+def _archived_rows(target, since, until):
+    query = MessageArchive.query.order_by(MessageArchive.range_start)
+    if since is not None:
+        query = query.filter(MessageArchive.range_end > since)
+    if until is not None:
+        query = query.filter(MessageArchive.range_start < until)
+    paths = [archive.path for archive in query]
+    db.session.commit()  # don't sit in a transaction while reading files
+
+    for path in paths:
+        if not os.path.exists(path):
+            current_app.logger.error(f"Archive file missing: {path}")
+            continue
+        # Archive files are written in timestamp order
+        with gzip.open(path, 'rt', encoding='utf-8') as fh:
+            for line in fh:
+                row = json.loads(line)
+                if target.room_id is not None:
+                    if row.get('room_id') != target.room_id or row.get('is_private'):
+                        continue
+                elif row.get('user_id') != target.user_id and not (
+                        row.get('is_private') and row.get('recipient_id') == target.user_id):
+                    continue
+                if not _in_range(datetime.fromisoformat(row['timestamp']), since, until):
+                    continue
+                yield {column: row.get(column) for column in COLUMNS}
+
+
+def _live_query(target, since, until):
+    sender = aliased(User)
+    recipient = aliased(User)
+    query = (select(Message.id, Message.timestamp, Room.name.label('room'),
+                    sender.username.label('username'), recipient.username.label('recipient'),
+                    Message.is_private, Message.seq, Message.content)
+             .outerjoin(Room, Room.id == Message.room_id)
+             .outerjoin(sender, sender.id == Message.user_id)
+             .outerjoin(recipient, recipient.id == Message.recipient_id)
+             .order_by(Message.timestamp, Message.id))
+    if target.room_id is not None:
+        query = query.where(Message.room_id == target.room_id, Message.is_private.isnot(True))
+    else:
+        query = query.where(or_(Message.user_id == target.user_id,
+                                and_(Message.is_private.is_(True), Message.recipient_id == target.user_id)))
+    if since is not None:
+        query = query.where(Message.timestamp >= since)
+    if until is not None:
+        query = query.where(Message.timestamp < until)
+    return query
+
+
+def _live_rows(target, since, until):
+    fetch_size = current_app.config.get('EXPORT_FETCH_SIZE', 5000)
+    result = db.session.execute(_live_query(target, since, until).execution_options(yield_per=fetch_size))
+    try:
+        for row in result:
+            item = dict(zip(COLUMNS, row))
+            item['timestamp'] = item['timestamp'].isoformat()
+            item['is_private'] = bool(item['is_private'])
+            yield item
+    finally:
+        result.close()
+        db.session.commit()
+
+
+def rows(target, since=None, until=None):
+    """Yield the target's messages as dicts (see COLUMNS), oldest first"""
+    yield from _archived_rows(target, since, until)
+    yield from _live_rows(target, since, until)
+
+
+def _encoded(items, fmt):
+    if fmt == 'ndjson':
+        for item in items:
+            yield json.dumps(item) + '\n'
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for item in items:
+        writer.writerow([item[column] for column in COLUMNS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream(items, fmt='ndjson', compress=False, chunk_size=None):
+    """Encode rows as NDJSON or CSV and yield byte chunks, gzipped on the fly if asked"""
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown export format "{fmt}"')
+    chunk_size = chunk_size or current_app.config.get('EXPORT_CHUNK_SIZE', 65536)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits 31: gzip framing
+
+    pending = []
+    size = 0
+    for text in _encoded(items, fmt):
+        pending.append(text)
+        size += len(text)
+        if size >= chunk_size:
+            data = ''.join(pending).encode('utf-8')
+            pending, size = [], 0
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                yield data
+    data = ''.join(pending).encode('utf-8')
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+def filename(target, fmt, compress=False):
+    return f"{target.name}.{fmt}" + ('.gz' if compress else '')
+
+
+def parse_time(value):
+    """datetime from an ISO timestamp argument; None when empty, ValueError when invalid"""
+    return datetime.fromisoformat(value) if value else None
@@ -0,0 +1,86 @@
+"""
+Cooperative (green) PostgreSQL access under eventlet
+
+eventlet.monkey_patch() covers the Python socket module, but psycopg2 talks to
+the server from C, so without help every query blocks the whole hub and with it
+every connected socket. psycopg2 lets us install a wait callback: the driver
+then runs in non-blocking mode and calls us whenever it would block, and we park
+the current greenlet on the connection's file descriptor until it is ready.
+
+Limitations of green mode (psycopg2 docs): COPY and large objects are not
+supported, so bulk tools that need them should run outside the eventlet server.
+"""
+
+_patched = False
+
+
+def eventlet_wait_callback(conn, timeout=-1):
+    """psycopg2 wait callback that yields to the eventlet hub instead of blocking"""
+    from eventlet.hubs import trampoline
+    from psycopg2 import OperationalError, extensions
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            trampoline(conn.fileno(), read=True)
+        elif state == extensions.POLL_WRITE:
+            trampoline(conn.fileno(), write=True)
+        else:
+            raise OperationalError(f"Bad result from poll: {state!r}")
+
+
+def patch_psycopg():
+    """Make psycopg2 cooperative; call right after eventlet.monkey_patch()"""
+    global _patched
+    try:
+        from psycopg2 import extensions
+    except ImportError:
+        return False
+    extensions.set_wait_callback(eventlet_wait_callback)
+    _patched = True
+    return True
+
+
+def unpatch_psycopg():
+    """Restore blocking psycopg2 (used by the benchmark to compare modes)"""
+    global _patched
+    from psycopg2 import extensions
+    extensions.set_wait_callback(None)
+    _patched = False
+
+
+def is_patched():
+    return _patched
+
+
+def pool_options(config):
+    """Pool sizing for SQLALCHEMY_ENGINE_OPTIONS, derived from worker concurrency
+
+    With green queries many greenlets can be inside the database at once, so
+    the pool is what bounds concurrency. DB_MAX_CONNECTIONS is the connection
+    budget for the whole deployment; each of the WEB_CONCURRENCY worker
+    processes gets an equal share, with no overflow, so the total can never
+    exceed it. Greenlets beyond that wait in the pool (cooperatively, as the
+    pool's lock is monkey-patched) for up to DB_POOL_TIMEOUT seconds.
+    """
+    workers = max(int(config.get('WEB_CONCURRENCY') or 1), 1)
+    pool_size = config.get('DB_POOL_SIZE') or max(config['DB_MAX_CONNECTIONS'] // workers, 2)
+    return {
+        'pool_size': pool_size,
+        'max_overflow': config.get('DB_MAX_OVERFLOW') or 0,
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+    }
+
+
+def configure_pool(app):
+    """Fill in pool sizing for PostgreSQL unless set explicitly in SQLALCHEMY_ENGINE_OPTIONS"""
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+    if not uri.startswith('postgres'):
+        # SQLite uses its own pool classes, which take no sizing arguments
+        return
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    for key, value in pool_options(app.config).items():
+        options.setdefault(key, value)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
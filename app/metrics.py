@@ -0,0 +1,296 @@
+"""
+Lightweight Prometheus-style metrics registry for the chat application
+
+Metrics are kept in process memory and rendered in the Prometheus text
+exposition format by the /metrics route. Recording a sample is a dict lookup,
+a bisect and a couple of additions under a lock, so it is cheap enough to run
+on every socket event and HTTP request (see benchmarks/bench_metrics.py).
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+from flask import g, request
+from sqlalchemy import exc
+
+# Latency buckets in seconds, tuned for chat traffic (sub-millisecond emits up
+# to multi-second database stalls)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _format_labels(labelnames, labels, extra=None):
+    """Render a label set as {name="value",...}"""
+    pairs = list(zip(labelnames, labels))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    rendered = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return '{' + rendered + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class Metric:
+    """Base class for all metric types"""
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def samples(self):
+        """Yield (suffix, labels, extra_label, value) tuples"""
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield '', labels, None, value
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for suffix, labels, extra, value in self.samples():
+            lines.append(
+                f"{self.name}{suffix}{_format_labels(self.labelnames, labels, extra)} "
+                f"{_format_value(value)}"
+            )
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """Monotonically increasing counter"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """Value that can go up and down, optionally computed at scrape time"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value, labels=()):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, amount=1, labels=()):
+        self.inc(-amount, labels)
+
+    def samples(self):
+        if self.callback is None:
+            yield from super().samples()
+            return
+        # Callback gauges return an iterable of (labels, value) pairs
+        for labels, value in self.callback():
+            yield '', labels, None, value
+
+
+class Histogram(Metric):
+    """Bucketed distribution of observed values"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # [per-bucket counts (+Inf last), sum, count]
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, (list(state[0]), state[1], state[2]))
+                     for labels, state in self._values.items()]
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield '_bucket', labels, ('le', _format_value(bound)), cumulative
+            yield '_sum', labels, None, total
+            yield '_count', labels, None, count
+
+
+class Registry:
+    """Collection of named metrics rendered together"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+registry = Registry()
+
+# Socket.IO
+SOCKET_EVENT_LATENCY = registry.histogram(
+    'socketio_event_duration_seconds',
+    'Time spent in Socket.IO event handlers',
+    ('event',)
+)
+SOCKET_EVENT_ERRORS = registry.counter(
+    'socketio_event_exceptions_total',
+    'Socket.IO event handlers that raised an exception',
+    ('event',)
+)
+SOCKET_DUPLICATE_SENDS = registry.counter(
+    'socketio_duplicate_sends_total',
+    'Replayed sends dropped by client_id deduplication'
+)
+CONNECTED_SOCKETS = registry.gauge(
+    'socketio_connected_clients',
+    'Currently connected Socket.IO clients'
+)
+
+# HTTP
+HTTP_REQUEST_LATENCY = registry.histogram(
+    'http_request_duration_seconds',
+    'Time spent handling HTTP requests',
+    ('endpoint', 'method', 'status')
+)
+
+# Database
+DB_POOL_CHECKOUT_WAIT = registry.histogram(
+    'db_pool_checkout_wait_seconds',
+    'Time spent waiting for a connection from the SQLAlchemy pool'
+)
+DB_POOL_CHECKOUT_TIMEOUTS = registry.counter(
+    'db_pool_checkout_timeouts_total',
+    'Connection checkouts that gave up after pool_timeout'
+)
+
+
+def timed_event(event):
+    """Decorator recording handler latency and exceptions for a socket event"""
+    labels = (event,)
+
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            except Exception:
+                SOCKET_EVENT_ERRORS.inc(labels=labels)
+                raise
+            finally:
+                SOCKET_EVENT_LATENCY.observe(time.perf_counter() - start, labels)
+        return wrapper
+    return decorator
+
+
+def _pool_sizes(pool):
+    # Only QueuePool-style pools report these; StaticPool/NullPool (SQLite) don't
+    if not hasattr(pool, 'checkedout'):
+        return []
+    return [
+        (('size',), pool.size()),
+        (('checked_out',), pool.checkedout()),
+        (('idle',), pool.checkedin()),
+        (('overflow',), max(pool.overflow(), 0)),
+    ]
+
+
+def instrument_engine(engine):
+    """Time how long callers wait to check a connection out of the engine's pool"""
+    pool = engine.pool
+    if getattr(pool, '_chat_metrics_instrumented', False):
+        return
+    do_get = pool._do_get
+
+    def timed_do_get():
+        start = time.perf_counter()
+        try:
+            return do_get()
+        except exc.TimeoutError:
+            DB_POOL_CHECKOUT_TIMEOUTS.inc()
+            raise
+        finally:
+            DB_POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start)
+
+    pool._do_get = timed_do_get
+    pool._chat_metrics_instrumented = True
+    registry.gauge(
+        'db_pool_connections',
+        'SQLAlchemy pool connections by state',
+        ('state',),
+        callback=lambda: _pool_sizes(pool)
+    )
+
+
+def init_app(app):
+    """Register per-route latency hooks on the Flask app"""
+
+    @app.before_request
+    def start_request_timer():
+        g._metrics_request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request_latency(response):
+        start = g.pop('_metrics_request_start', None)
+        if start is not None:
+            HTTP_REQUEST_LATENCY.observe(
+                time.perf_counter() - start,
+                (request.endpoint or 'unknown', request.method, response.status_code)
+            )
+        return response
@@ -114,6 +114,10 @@ class User(UserMixin, db.Model):
         """Update last seen timestamp"""
         self.last_seen = datetime.utcnow()
     
+    def last_seen_is_stale(self, max_age=60):
+        """Check if last_seen is older than max_age seconds and worth writing again"""
+        return not self.last_seen or datetime.utcnow() - self.last_seen > timedelta(seconds=max_age)
+    
     def get_full_name(self):
         """Get user's full name"""
         if self.first_name and self.last_name:
@@ -142,20 +146,186 @@ from app import db
 
 # app/models.py
 
+class Room(db.Model):
+    __tablename__ = 'rooms'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_seq = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # see app/room_log.py
+    last_message_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<Room {self.name}>"
+
+
 class Message(db.Model):
+    # On PostgreSQL this table is range-partitioned by month on `timestamp`
+    # (see app/partitions.py); the physical primary key is (id, timestamp).
+    __table_args__ = (
+        db.Index('ix_message_room_id_timestamp', 'room_id', 'timestamp'),
+        db.Index('ix_message_recipient_id_timestamp', 'recipient_id', 'timestamp'),
+        db.Index('ix_message_user_id_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_message_room_id_seq', 'room_id', 'seq'),
+        # Only undelivered private messages, i.e. each recipient's pending queue
+        db.Index('ix_message_pending_delivery', 'recipient_id', 'id',
+                 postgresql_where=db.text('delivered_at IS NULL AND is_private'),
+                 sqlite_where=db.text('delivered_at IS NULL AND is_private')),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(100))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'))
     content = db.Column(db.Text)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    room = db.Column(db.String(100))
+    content_html = db.Column(db.Text, nullable=True)  # rendered and sanitized at write time, see app/rendering.py
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    room_id = db.Column(db.Integer, db.ForeignKey('rooms.id'))
+    seq = db.Column(db.Integer, nullable=True)  # per-room sequence number; NULL for private and older messages
 
-    # NEW FIELDS for private messaging
-    recipient = db.Column(db.String(100), nullable=True)  # recipient username
+    # Private messaging
+    recipient_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
     is_private = db.Column(db.Boolean, default=False)
+    delivered_at = db.Column(db.DateTime, nullable=True)  # NULL while a private message waits for its recipient
+
+    sender = db.relationship('User', foreign_keys=[user_id])
+    recipient_user = db.relationship('User', foreign_keys=[recipient_id])
+    room_ref = db.relationship('Room')
+
+    # Names are resolved through the process-wide cache in app/name_cache.py
+    # rather than joins, so rendering a page of messages doesn't touch users/rooms
+    @property
+    def username(self):
+        from app import name_cache
+        return name_cache.username_for(self.user_id)
+
+    @property
+    def room(self):
+        from app import name_cache
+        return name_cache.room_name_for(self.room_id)
+
+    @property
+    def recipient(self):
+        from app import name_cache
+        return name_cache.username_for(self.recipient_id)
+
+    @property
+    def html(self):
+        from app import rendering
+        return rendering.message_html(self)
+
+    def to_dict(self):
+        """Convert message to dictionary for JSON serialization"""
+        return {
+            'id': self.id,
+            'username': self.username,
+            'content': self.content,
+            'content_html': str(self.html),
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+            'room': self.room,
+            'seq': self.seq,
+            'recipient': self.recipient,
+            'is_private': bool(self.is_private),
+        }
 
     def __repr__(self):
         return f"<Message from {self.username} to {self.recipient or self.room}>"
 
 
+class RoomRead(db.Model):
+    """How far a user has read in a room (flushed periodically from app/unread.py)"""
+    __tablename__ = 'room_reads'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    room_id = db.Column(db.Integer, db.ForeignKey('rooms.id', ondelete='CASCADE'), primary_key=True)
+    last_read_seq = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<RoomRead user={self.user_id} room={self.room_id} seq={self.last_read_seq}>"
+
+
+class MessageReaction(db.Model):
+    """How many users reacted to a room message with an emoji (flushed from app/reactions.py)"""
+    __tablename__ = 'message_reactions'
+
+    room_id = db.Column(db.Integer, db.ForeignKey('rooms.id', ondelete='CASCADE'), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True)
+    emoji = db.Column(db.String(16), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<MessageReaction room={self.room_id} seq={self.seq} {self.emoji} x{self.count}>"
+
+
+class MessageReactor(db.Model):
+    """A user's reactions to a room message, one bit per emoji in app.reactions.EMOJIS"""
+    __tablename__ = 'message_reactors'
+
+    room_id = db.Column(db.Integer, db.ForeignKey('rooms.id', ondelete='CASCADE'), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    mask = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<MessageReactor room={self.room_id} seq={self.seq} user={self.user_id} mask={self.mask:b}>"
+
+
+class MessageArchive(db.Model):
+    """A month of message history moved out of the database into a compressed file"""
+    __tablename__ = 'message_archive'
+
+    id = db.Column(db.Integer, primary_key=True)
+    partition_name = db.Column(db.String(64), unique=True, nullable=False)
+    range_start = db.Column(db.DateTime, nullable=False, index=True)
+    range_end = db.Column(db.DateTime, nullable=False, index=True)
+    path = db.Column(db.String(255), nullable=False)
+    row_count = db.Column(db.Integer, default=0)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<MessageArchive {self.partition_name} ({self.row_count} rows)>"
+
+
+class ShardWorker(db.Model):
+    """A worker process taking part in room-affinity sharding (see app/sharding.py)"""
+    __tablename__ = 'shard_workers'
+
+    worker_id = db.Column(db.String(128), primary_key=True)
+    url = db.Column(db.String(255), nullable=False, default='')
+    heartbeat_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
 
+    def __repr__(self):
+        return f"<ShardWorker {self.worker_id} {self.url}>"
+
+
+
+
+
+
+class ImportCheckpoint(db.Model):
+    """Progress of a bulk message import, committed with each batch (see app/bulk_import.py)"""
+    __tablename__ = 'import_checkpoints'
 
+    source = db.Column(db.String(255), primary_key=True)
+    byte_offset = db.Column(db.BigInteger, nullable=False, default=0)  # where the next batch starts
+    line_count = db.Column(db.BigInteger, nullable=False, default=0)
+    row_count = db.Column(db.BigInteger, nullable=False, default=0)
+    skipped_count = db.Column(db.BigInteger, nullable=False, default=0)
+    indexes_deferred = db.Column(db.Boolean, nullable=False, default=False)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<ImportCheckpoint {self.source} ({self.row_count} rows)>"
+
+
+class StoredSession(db.Model):
+    """Server-side Flask session data, keyed by the id in the session cookie (see app/sessions.py)"""
+    __tablename__ = 'sessions'
+
+    id = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<StoredSession {self.id[:8]}... until {self.expires_at}>"
@@ -0,0 +1,125 @@
+"""
+Process-wide name <-> id caches for users and rooms
+
+Messages reference users and rooms by integer id. Socket handlers receive
+names from clients and templates display names, so both directions are cached
+here; after warm-up, resolving a name costs a dict lookup instead of a query.
+User and room ids are never reused, so entries only go stale when a user is
+renamed or deleted (call forget_user).
+"""
+
+import threading
+
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import Room, User
+
+MAX_ENTRIES = 100000
+
+_user_ids = {}   # username -> id
+_usernames = {}  # id -> username
+_room_ids = {}   # room name -> id
+_room_names = {}  # id -> room name
+_lock = threading.Lock()
+
+
+def _remember(by_name, by_id, name, id_):
+    with _lock:
+        if len(by_id) >= MAX_ENTRIES:
+            by_name.clear()
+            by_id.clear()
+        by_name[name] = id_
+        by_id[id_] = name
+
+
+def remember_user(user_id, username):
+    _remember(_user_ids, _usernames, username, user_id)
+
+
+def user_id_for(username):
+    """Return the id of the user with this username, or None if there is none"""
+    if not username:
+        return None
+    user_id = _user_ids.get(username)
+    if user_id is None:
+        user_id = db.session.query(User.id).filter_by(username=username).scalar()
+        if user_id is not None:
+            remember_user(user_id, username)
+    return user_id
+
+
+def username_for(user_id):
+    """Return the username for a user id, or None"""
+    if user_id is None:
+        return None
+    username = _usernames.get(user_id)
+    if username is None:
+        username = db.session.query(User.username).filter_by(id=user_id).scalar()
+        if username is not None:
+            remember_user(user_id, username)
+    return username
+
+
+def prime_users(user_ids):
+    """Load any uncached usernames for these ids in a single query"""
+    missing = {user_id for user_id in user_ids if user_id is not None and user_id not in _usernames}
+    if not missing:
+        return
+    for user_id, username in db.session.query(User.id, User.username).filter(User.id.in_(missing)):
+        remember_user(user_id, username)
+
+
+def forget_user(user_id=None, username=None):
+    """Drop a user from the cache after a rename or delete"""
+    with _lock:
+        if user_id is not None:
+            username = _usernames.pop(user_id, username)
+        if username is not None:
+            user_id = _user_ids.pop(username, user_id)
+            _usernames.pop(user_id, None)
+
+
+def room_id_for(name, create=False):
+    """Return the id of the named room, creating the room if `create` is set"""
+    if not name:
+        return None
+    room_id = _room_ids.get(name)
+    if room_id is not None:
+        return room_id
+
+    room_id = db.session.query(Room.id).filter_by(name=name).scalar()
+    if room_id is None and create:
+        try:
+            with db.session.begin_nested():
+                room = Room(name=name)
+                db.session.add(room)
+            room_id = room.id
+        except IntegrityError:
+            # Another worker created it first
+            room_id = db.session.query(Room.id).filter_by(name=name).scalar()
+    if room_id is not None:
+        _remember(_room_ids, _room_names, name, room_id)
+    return room_id
+
+
+def room_ids_for(names):
+    """Map room names to ids, loading uncached ones in a single query; unknown rooms are left out"""
+    names = [name for name in names if name]
+    missing = [name for name in names if name not in _room_ids]
+    if missing:
+        for room_id, name in db.session.query(Room.id, Room.name).filter(Room.name.in_(missing)):
+            _remember(_room_ids, _room_names, name, room_id)
+    return {name: _room_ids[name] for name in names if name in _room_ids}
+
+
+def room_name_for(room_id):
+    """Return the name of a room id, or None"""
+    if room_id is None:
+        return None
+    name = _room_names.get(room_id)
+    if name is None:
+        name = db.session.query(Room.name).filter_by(id=room_id).scalar()
+        if name is not None:
+            _remember(_room_ids, _room_names, name, room_id)
+    return name
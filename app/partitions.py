@@ -0,0 +1,267 @@
+"""
+Monthly partitioning and archival of message history (PostgreSQL only)
+
+Migration 3c9e1f7a2b64 turns `message` into a table range-partitioned by month
+on `timestamp`. Partitions are named message_yYYYYmMM; rows written before the
+cutover live in the `message_legacy` partition and anything outside the known
+ranges falls into `message_default`.
+
+    ensure_partitions()       create partitions for the current and coming months
+    archive_partitions()      move partitions older than the retention window into
+                              gzip-compressed NDJSON files under ARCHIVE_FOLDER
+    read_archived_messages()  read archived room history back on demand
+
+Run these periodically with archive_messages.py.
+"""
+
+import gzip
+import json
+import os
+import re
+from collections import deque
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import text
+
+from app import db, rendering
+from app.models import MessageArchive
+
+DEFAULT_PARTITION = 'message_default'
+# Archived rows are served in the shape of Message.to_dict()
+MESSAGE_KEYS = ('id', 'username', 'content', 'content_html', 'timestamp', 'room', 'seq',
+                'recipient', 'is_private')
+_BOUNDS_RE = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+class Partition:
+    """One partition of the message table and its [start, end) bounds"""
+
+    def __init__(self, name, start=None, end=None, is_default=False):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.is_default = is_default
+
+    def __repr__(self):
+        return f"<Partition {self.name} [{self.start}, {self.end})>"
+
+
+def month_start(dt):
+    return datetime(dt.year, dt.month, 1)
+
+
+def add_months(dt, months):
+    years, month_index = divmod(dt.month - 1 + months, 12)
+    return datetime(dt.year + years, month_index + 1, 1)
+
+
+def partition_name(start):
+    return f"message_y{start.year:04d}m{start.month:02d}"
+
+
+def is_partitioned():
+    """Check whether the message table is a partitioned table"""
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    return db.session.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('message')"
+    )).scalar() is not None
+
+
+def _parse_bound(value):
+    value = value.strip()
+    if value.upper() in ('MINVALUE', 'MAXVALUE'):
+        return None
+    return datetime.fromisoformat(value.strip("'"))
+
+
+def list_partitions():
+    """Return the partitions attached to the message table, oldest first"""
+    rows = db.session.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+        "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass('message')"
+    )).all()
+
+    partitions = []
+    for name, bound in rows:
+        if bound == 'DEFAULT':
+            partitions.append(Partition(name, is_default=True))
+            continue
+        match = _BOUNDS_RE.search(bound)
+        if match:
+            partitions.append(Partition(name, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+    return sorted(partitions, key=lambda p: (p.is_default, p.start or datetime.min))
+
+
+def _create_partition(name, lower, upper, has_default):
+    """Create and attach the partition for [lower, upper)"""
+    db.session.execute(text(
+        f"CREATE TABLE {name} (LIKE message INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+    ))
+    if has_default:
+        # Rows for this month may already have landed in the default partition;
+        # attaching would fail while they are there, so move them across first
+        db.session.execute(text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+            f"WHERE timestamp >= :lower AND timestamp < :upper RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ), {'lower': lower, 'upper': upper})
+    db.session.execute(text(
+        f"ALTER TABLE message ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{lower.isoformat(' ')}') TO ('{upper.isoformat(' ')}')"
+    ))
+
+
+def ensure_partitions(months_ahead=None, now=None):
+    """Create the partitions for the current month and the next `months_ahead` months
+
+    Returns the names of the partitions that were created.
+    """
+    if months_ahead is None:
+        months_ahead = current_app.config.get('MESSAGE_PARTITIONS_AHEAD', 3)
+    current = month_start(now or datetime.utcnow())
+
+    partitions = list_partitions()
+    existing = {p.name for p in partitions}
+    has_default = DEFAULT_PARTITION in existing
+    # Months below the highest upper bound of an open-ended partition (the
+    # legacy one) are already covered
+    covered_until = max((p.end for p in partitions if p.start is None and p.end), default=None)
+
+    created = []
+    for offset in range(months_ahead + 1):
+        lower = add_months(current, offset)
+        upper = add_months(current, offset + 1)
+        name = partition_name(lower)
+        if name in existing or (covered_until and lower < covered_until):
+            continue
+        _create_partition(name, lower, upper, has_default)
+        created.append(name)
+
+    db.session.commit()
+    return created
+
+
+def _serialize_row(row):
+    return {key: value.isoformat() if isinstance(value, datetime) else value
+            for key, value in row.items()}
+
+
+def archive_partition(partition, archive_dir):
+    """Export one partition to a compressed NDJSON file, then detach and drop it
+
+    Rows are streamed with a server-side cursor while the partition is still
+    attached, so writers are never blocked during the export. The detach,
+    archive bookkeeping and drop happen together in one short transaction.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{partition.name}.ndjson.gz")
+    tmp_path = path + '.tmp'
+
+    row_count = 0
+    first_timestamp = None
+    # Archives are self-describing: user and room names are stored next to
+    # the ids so they stay readable after users or rooms are gone
+    result = db.session.connection().execution_options(stream_results=True, yield_per=5000).execute(text(
+        f"SELECT m.*, u.username AS username, r.name AS room, ru.username AS recipient "
+        f"FROM {partition.name} m "
+        f"LEFT JOIN users u ON u.id = m.user_id "
+        f"LEFT JOIN rooms r ON r.id = m.room_id "
+        f"LEFT JOIN users ru ON ru.id = m.recipient_id "
+        f"ORDER BY m.timestamp, m.id"
+    ))
+    keys = list(result.keys())
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as fh:
+        for values in result:
+            row = dict(zip(keys, values))
+            if first_timestamp is None:
+                first_timestamp = row['timestamp']
+            fh.write(json.dumps(_serialize_row(row)) + '\n')
+            row_count += 1
+    os.replace(tmp_path, path)
+    db.session.commit()
+
+    archive = MessageArchive(
+        partition_name=partition.name,
+        range_start=partition.start or first_timestamp or partition.end,
+        range_end=partition.end,
+        path=path,
+        row_count=row_count,
+    )
+    db.session.execute(text(f"ALTER TABLE message DETACH PARTITION {partition.name}"))
+    db.session.add(archive)
+    db.session.execute(text(f"DROP TABLE {partition.name}"))
+    db.session.commit()
+    return archive
+
+
+def archive_partitions(retention_months=None, archive_dir=None, now=None):
+    """Archive every partition that ends before the retention window
+
+    Returns the MessageArchive records that were created.
+    """
+    config = current_app.config
+    if retention_months is None:
+        retention_months = config.get('MESSAGE_RETENTION_MONTHS', 12)
+    archive_dir = archive_dir or config.get('ARCHIVE_FOLDER')
+    cutoff = add_months(month_start(now or datetime.utcnow()), -retention_months)
+
+    archives = []
+    for partition in list_partitions():
+        if partition.is_default or partition.end is None or partition.end > cutoff:
+            continue
+        archives.append(archive_partition(partition, archive_dir))
+    return archives
+
+
+def _message_dict(row):
+    """An archived row (SELECT m.* plus names) as Message.to_dict() returns it"""
+    item = {key: row.get(key) for key in MESSAGE_KEYS}
+    if item['content_html'] is None:
+        item['content_html'] = rendering.render_text(item['content'] or '')
+    item['is_private'] = bool(item['is_private'])
+    return item
+
+
+def _rows_before(path, room, before, before_id, limit):
+    """The last `limit` messages in `room` from an archive file that sort before the cursor
+
+    Archive files are ordered by (timestamp, id), so the file is streamed until
+    the cursor is reached and only the newest `limit` matches are kept.
+    """
+    rows = deque(maxlen=limit)
+    with gzip.open(path, 'rt', encoding='utf-8') as fh:
+        for line in fh:
+            row = json.loads(line)
+            timestamp = datetime.fromisoformat(row['timestamp'])
+            if timestamp > before or (timestamp == before and (before_id is None or row['id'] >= before_id)):
+                break
+            if row.get('room') == room and not row.get('is_private'):
+                rows.append(row)
+    return [_message_dict(row) for row in rows]
+
+
+def read_archived_messages(room, before, limit, before_id=None):
+    """Return up to `limit` archived messages in `room` older than `before`, oldest first
+
+    Messages have the keys of Message.to_dict(), without reactions.
+
+    With `before_id`, messages at exactly `before` with a lower id count as
+    older too, so pages split between equal timestamps lose nothing.
+    """
+    archives = (MessageArchive.query
+                .filter(MessageArchive.range_start <= before)
+                .order_by(MessageArchive.range_end.desc())
+                .all())
+
+    collected = []
+    for archive in archives:
+        if not os.path.exists(archive.path):
+            current_app.logger.error(f"Archive file missing: {archive.path}")
+            continue
+        collected = _rows_before(archive.path, room, before, before_id, limit - len(collected)) + collected
+        if len(collected) >= limit:
+            break
+    return collected
@@ -0,0 +1,188 @@
+"""
+SQL query profiler
+
+Hooks SQLAlchemy cursor events to record the number of queries, the time spent
+in them and a normalized statement fingerprint for every HTTP request and every
+Socket.IO event (Flask-SocketIO runs each event in its own request context, so
+both are scoped through flask.g). At the end of the scope it:
+
+  * logs statements slower than SLOW_QUERY_THRESHOLD_MS
+  * flags fingerprints repeated N_PLUS_ONE_THRESHOLD times or more (N+1 loops)
+  * checks declared query budgets (see query_budget); with QUERY_BUDGET_STRICT
+    enabled an over-budget scope raises QueryBudgetExceeded, so test suites
+    fail instead of quietly regressing
+"""
+
+import logging
+import re
+import time
+from collections import Counter
+from functools import lru_cache, wraps
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = r"(?:\?|%s|%\(\w+\)s|:\w+)"
+_IN_LIST_RE = re.compile(r"IN\s*\(\s*" + _PLACEHOLDER + r"(?:\s*,\s*" + _PLACEHOLDER + r")*\s*\)",
+                         re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r"\s+")
+
+QUERIES_PER_SCOPE = metrics.registry.histogram(
+    'db_queries_per_scope',
+    'SQL statements executed per HTTP request or Socket.IO event',
+    ('scope',),
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100)
+)
+QUERY_DURATION = metrics.registry.histogram(
+    'db_query_duration_seconds',
+    'Time spent executing individual SQL statements'
+)
+BUDGET_EXCEEDED = metrics.registry.counter(
+    'db_query_budget_exceeded_total',
+    'Scopes that executed more queries than their declared budget',
+    ('scope',)
+)
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised in strict mode when a scope exceeds its declared query budget"""
+
+
+class QueryStats:
+    """Query accounting for a single request or socket event"""
+
+    __slots__ = ('count', 'total_time', 'fingerprints')
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.fingerprints = Counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.total_time += duration
+        self.fingerprints[fingerprint(statement)] += 1
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement):
+    """Normalize a SQL statement so that queries differing only in literals match"""
+    normalized = _STRING_RE.sub('?', statement)
+    normalized = _NUMBER_RE.sub('?', normalized)
+    normalized = _IN_LIST_RE.sub('IN (...)', normalized)
+    return _WHITESPACE_RE.sub(' ', normalized).strip()
+
+
+def current_stats():
+    """Return the QueryStats for the active scope, or None outside a context"""
+    if not has_app_context():
+        return None
+    stats = g.get('_query_stats')
+    if stats is None:
+        stats = g._query_stats = QueryStats()
+    return stats
+
+
+def scope_name():
+    """Name of the active scope: socket:<event>, the route endpoint, or 'background'"""
+    if has_request_context():
+        socket_event = getattr(request, 'event', None)
+        if socket_event:
+            return f"socket:{socket_event['message']}"
+        return request.endpoint or request.path
+    return 'background'
+
+
+def query_budget(max_queries):
+    """Declare the maximum number of SQL statements a route or socket handler may run
+
+    The count covers the whole scope, including before_request hooks and the
+    user loader. Place it directly above the function, below @main.route /
+    @login_required or the socket event decorator.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            result = f(*args, **kwargs)
+            stats = current_stats()
+            if stats is not None and stats.count > max_queries:
+                _budget_exceeded(stats, max_queries)
+            return result
+        wrapper._query_budget = max_queries
+        return wrapper
+    return decorator
+
+
+def _budget_exceeded(stats, max_queries):
+    scope = scope_name()
+    BUDGET_EXCEEDED.inc(labels=(scope,))
+    message = (f"{scope} executed {stats.count} queries (budget {max_queries}): "
+               + '; '.join(f"{n}x {fp}" for fp, n in stats.fingerprints.most_common(5)))
+    if current_app.config.get('QUERY_BUDGET_STRICT'):
+        raise QueryBudgetExceeded(message)
+    logger.warning("[Profiler] %s", message)
+
+
+def instrument_engine(engine, slow_query_threshold_ms=None):
+    """Attach the profiling hooks to an engine"""
+    if getattr(engine, '_chat_profiler_instrumented', False):
+        return
+    threshold = slow_query_threshold_ms / 1000.0 if slow_query_threshold_ms else None
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_query_start_time', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start_times = conn.info.get('_query_start_time')
+        if not start_times:
+            return
+        duration = time.perf_counter() - start_times.pop()
+        QUERY_DURATION.observe(duration)
+
+        stats = current_stats()
+        if stats is not None:
+            stats.record(statement, duration)
+
+        if threshold is not None and duration >= threshold:
+            logger.warning("[Profiler] Slow query (%.1f ms) in %s: %s",
+                           duration * 1000, scope_name(), fingerprint(statement))
+
+    engine._chat_profiler_instrumented = True
+
+
+def init_app(app):
+    """Enable the query profiler for the app's engine and request scopes"""
+    if not app.config.get('SQL_PROFILER_ENABLED', True):
+        return
+
+    from app import db
+    with app.app_context():
+        instrument_engine(db.engine, app.config.get('SLOW_QUERY_THRESHOLD_MS'))
+
+    n_plus_one_threshold = app.config.get('N_PLUS_ONE_THRESHOLD', 5)
+
+    @app.before_request
+    def reset_query_stats():
+        g._query_stats = QueryStats()
+
+    @app.teardown_request
+    def report_query_stats(exc):
+        stats = g.pop('_query_stats', None)
+        if stats is None or not stats.count:
+            return
+        scope = scope_name()
+        QUERIES_PER_SCOPE.observe(stats.count, (scope,))
+        for statement, occurrences in stats.fingerprints.items():
+            if occurrences >= n_plus_one_threshold:
+                logger.warning("[Profiler] Possible N+1 in %s: %d executions of %s",
+                               scope, occurrences, statement)
+        logger.debug("[Profiler] %s: %d queries in %.1f ms",
+                     scope, stats.count, stats.total_time * 1000)
@@ -0,0 +1,202 @@
+"""
+Emoji reactions on room messages
+
+Reactions are not stored one row per click. A message (room_id, seq) has one
+message_reactions row per emoji holding its count, and each user who reacted
+has one message_reactors row whose `mask` has bit i set for EMOJIS[i].
+
+Clicks only update an in-memory map of pending changes, where later clicks by
+the same user on the same message and emoji replace earlier ones. Every
+REACTION_FLUSH_INTERVAL seconds flush() applies all pending changes in one
+transaction: it reads the affected masks, works out which reactions really
+changed, writes the masks and adds the differences to the counters. Then each
+room gets a single `reaction_deltas` frame listing them:
+
+    {'room': room, 'deltas': [[seq, emoji, count change], ...]}
+
+Clients add the deltas to the counts they loaded with the page or history.
+"""
+
+import threading
+
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app import db, metrics, socketio
+from app.models import MessageReaction, MessageReactor
+
+# Bit order of message_reactors.mask: only ever append to this list
+EMOJIS = ('👍', '❤️', '😂', '😮', '😢', '🎉', '🔥', '👎')
+BITS = {emoji: 1 << i for i, emoji in enumerate(EMOJIS)}
+
+REACTION_TOGGLES = metrics.registry.counter(
+    'chat_reaction_toggles_total',
+    'Reaction clicks received'
+)
+REACTION_CHANGES = metrics.registry.counter(
+    'chat_reaction_changes_total',
+    'Per-user reaction rows changed by flushes'
+)
+
+_pending = {}     # (room_id, seq, user_id) -> [bits to set, bits to clear]
+_room_names = {}  # room_id -> name, for the delta frames
+_lock = threading.Lock()
+
+
+def react(room_id, room, seq, user_id, emoji, on):
+    """Queue adding (`on`) or removing a user's reaction; False for an unknown emoji"""
+    bit = BITS.get(emoji)
+    if bit is None or room_id is None:
+        return False
+    REACTION_TOGGLES.inc()
+    with _lock:
+        _room_names[room_id] = room
+        change = _pending.setdefault((room_id, seq, user_id), [0, 0])
+        if on:
+            change[0] |= bit
+            change[1] &= ~bit
+        else:
+            change[1] |= bit
+            change[0] &= ~bit
+    return True
+
+
+def emojis(mask):
+    return [emoji for emoji, bit in BITS.items() if mask & bit]
+
+
+def snapshot(room_id, user_id, first_seq=None, last_seq=None):
+    """Flushed reactions in a room's seq range: ({seq: {emoji: count}}, {seq: [the user's emojis]})"""
+    counts, mine = {}, {}
+    if room_id is None:
+        return counts, mine
+    conditions = [MessageReaction.room_id == room_id]
+    if first_seq is not None:
+        conditions.append(MessageReaction.seq >= first_seq)
+    if last_seq is not None:
+        conditions.append(MessageReaction.seq <= last_seq)
+    for seq, emoji, count in db.session.execute(
+            select(MessageReaction.seq, MessageReaction.emoji, MessageReaction.count)
+            .where(*conditions, MessageReaction.count > 0)):
+        counts.setdefault(seq, {})[emoji] = count
+    if not counts:
+        return counts, mine
+    for seq, mask in db.session.execute(
+            select(MessageReactor.seq, MessageReactor.mask)
+            .where(MessageReactor.room_id == room_id, MessageReactor.user_id == user_id,
+                   MessageReactor.seq >= min(counts), MessageReactor.seq <= max(counts))):
+        if mask:
+            mine[seq] = emojis(mask)
+    return counts, mine
+
+
+def _restore(changes):
+    """Put back changes whose flush failed, under any newer ones"""
+    with _lock:
+        for key, (add, remove) in changes.items():
+            change = _pending.get(key)
+            if change is None:
+                _pending[key] = [add, remove]
+            else:
+                change[0] |= add & ~change[1]
+                change[1] |= remove & ~change[0]
+
+
+def flush():
+    """Apply pending reaction changes and broadcast the deltas; returns the rows changed"""
+    with _lock:
+        if not _pending:
+            return 0
+        changes = dict(_pending)
+        _pending.clear()
+        room_names = dict(_room_names)
+
+    dialect = db.engine.dialect.name
+    insert = pg_insert if dialect == 'postgresql' else sqlite_insert
+    try:
+        query = (select(MessageReactor.room_id, MessageReactor.seq, MessageReactor.user_id, MessageReactor.mask)
+                 .where(tuple_(MessageReactor.room_id, MessageReactor.seq, MessageReactor.user_id)
+                        .in_(list(changes))))
+        if dialect == 'postgresql':
+            # Another worker flushing the same users' reactions waits for us
+            query = query.with_for_update()
+        masks = {(room_id, seq, user_id): mask for room_id, seq, user_id, mask in db.session.execute(query)}
+
+        deltas = {}   # (room_id, seq, emoji) -> count change
+        written, cleared = [], []
+        for key, (add, remove) in changes.items():
+            old = masks.get(key, 0)
+            new = (old | add) & ~remove
+            if new == old:
+                continue
+            room_id, seq, user_id = key
+            for emoji, bit in BITS.items():
+                if (old ^ new) & bit:
+                    delta = 1 if new & bit else -1
+                    deltas[(room_id, seq, emoji)] = deltas.get((room_id, seq, emoji), 0) + delta
+            if new:
+                written.append({'room_id': room_id, 'seq': seq, 'user_id': user_id, 'mask': new})
+            else:
+                cleared.append(key)
+
+        if written:
+            statement = insert(MessageReactor).values(written)
+            db.session.execute(statement.on_conflict_do_update(
+                index_elements=['room_id', 'seq', 'user_id'],
+                set_={'mask': statement.excluded.mask}
+            ))
+        if cleared:
+            db.session.execute(delete(MessageReactor).where(
+                tuple_(MessageReactor.room_id, MessageReactor.seq, MessageReactor.user_id).in_(cleared)))
+        counters = [{'room_id': room_id, 'seq': seq, 'emoji': emoji, 'count': delta}
+                    for (room_id, seq, emoji), delta in deltas.items() if delta]
+        if counters:
+            statement = insert(MessageReaction).values(counters)
+            db.session.execute(statement.on_conflict_do_update(
+                index_elements=['room_id', 'seq', 'emoji'],
+                set_={'count': MessageReaction.count + statement.excluded.count}
+            ))
+            db.session.execute(delete(MessageReaction).where(
+                MessageReaction.count <= 0,
+                tuple_(MessageReaction.room_id, MessageReaction.seq)
+                .in_(list({(row['room_id'], row['seq']) for row in counters}))))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        _restore(changes)
+        raise
+
+    REACTION_CHANGES.inc(len(written) + len(cleared))
+    frames = {}
+    for (room_id, seq, emoji), delta in deltas.items():
+        if delta and room_id in room_names:
+            frames.setdefault(room_names[room_id], []).append([seq, emoji, delta])
+    for room, room_deltas in frames.items():
+        socketio.emit('reaction_deltas', {'room': room, 'deltas': room_deltas}, to=room)
+    return len(written) + len(cleared)
+
+
+def _flush_loop(app, interval):
+    while True:
+        socketio.sleep(interval)
+        with app.app_context():
+            try:
+                flush()
+            except Exception as e:
+                print(f"[Reactions] Flushing reactions failed: {e}")
+
+
+def start(app):
+    """Flush reactions periodically and once more at exit"""
+    import atexit
+
+    def final_flush():
+        with app.app_context():
+            try:
+                flush()
+            except Exception:
+                pass
+
+    atexit.register(final_flush)
+    socketio.start_background_task(_flush_loop, app, app.config.get('REACTION_FLUSH_INTERVAL', 1))
@@ -0,0 +1,84 @@
+"""
+Message rendering and sanitization
+
+Message text is turned into HTML once, when the message is written, and stored
+in message.content_html; every client then inserts that HTML as-is instead of
+escaping and formatting on each render. Code spans and links are found in the
+raw text, then every piece of it is escaped and only the markup produced here
+is added around it, so the output can never contain tags or attributes a
+sender typed.
+
+Supported formatting: `code`, **bold**, *italic* / _italic_, http(s) links
+and line breaks.
+"""
+
+import re
+from functools import lru_cache
+
+from markupsafe import Markup, escape
+
+MAX_URL_DISPLAY = 60
+
+# Code spans and links match the raw text, emphasis the escaped text
+_CODE_RE = re.compile(r'`([^`\n]+)`')
+_LINK_RE = re.compile(r'(\bhttps?://[^\s<>"\']+[^\s<>"\'.,;:!?)\]])')
+_BOLD_RE = re.compile(r'\*\*(?=\S)(.+?)(?<=\S)\*\*')
+_ITALIC_RE = re.compile(r'(?<![\w*])[*_](?=\S)([^*_\n]+?)(?<=\S)[*_](?![\w*])')
+
+# Attachment links may point at our own files, the web, or inline data that
+# browsers won't execute as a page
+_SAFE_ATTACHMENT_URL = re.compile(
+    r'^(https?://|/(?!/)|data:(?!text/html|image/svg|application/xhtml)[\w.+-]+/[\w.+-]+[;,])', re.I)
+
+
+def _link(url):
+    """Anchor for a raw URL, shortened on the raw text so no entity is cut"""
+    label = url if len(url) <= MAX_URL_DISPLAY else url[:MAX_URL_DISPLAY - 1] + '…'
+    return f'<a href="{escape(url)}" target="_blank" rel="noopener noreferrer nofollow">{escape(label)}</a>'
+
+
+def _emphasis(text):
+    escaped = str(escape(text))
+    return _ITALIC_RE.sub(r'<em>\1</em>', _BOLD_RE.sub(r'<strong>\1</strong>', escaped))
+
+
+def _inline(text):
+    """Bold, italic and links for a stretch of raw text outside code spans"""
+    # Emphasis markers inside link URLs stay intact
+    parts = _LINK_RE.split(text)
+    return ''.join(_link(part) if i % 2 else _emphasis(part) for i, part in enumerate(parts))
+
+
+def render_text(text):
+    """Sanitized HTML for a plain-text message"""
+    if not text:
+        return ''
+    parts = _CODE_RE.split(text)
+    html = ''.join(f'<code>{escape(part)}</code>' if i % 2 else _inline(part)
+                   for i, part in enumerate(parts))
+    return html.replace('\r\n', '\n').replace('\n', '<br>')
+
+
+def render_attachment(url, filename, thumbnail_url=None):
+    """Sanitized download link for a file attachment, or a linked preview for an image"""
+    name = escape(filename or 'attachment')
+    if not url or not _SAFE_ATTACHMENT_URL.match(url):
+        return f'📎 {name}'
+    if thumbnail_url and _SAFE_ATTACHMENT_URL.match(thumbnail_url):
+        # The original is only fetched when the preview is clicked
+        return (f'<a href="{escape(url)}" class="attachment-image" target="_blank" rel="noopener noreferrer">'
+                f'<img src="{escape(thumbnail_url)}" alt="{name}" class="attachment-thumb" loading="lazy"></a>')
+    return (f'<a href="{escape(url)}" download="{name}" target="_blank" rel="noopener noreferrer">'
+            f'📎 {name}</a>')
+
+
+@lru_cache(maxsize=4096)
+def _render_legacy(text):
+    return render_text(text)
+
+
+def message_html(message):
+    """Stored HTML of a message, rendering (and caching) rows written before content_html existed"""
+    if message.content_html is not None:
+        return Markup(message.content_html)
+    return Markup(_render_legacy(message.content or ''))
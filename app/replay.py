@@ -0,0 +1,289 @@
+"""
+Replay of recorded socket traffic against a running server
+
+replay() opens one Socket.IO client per recorded connection and sends every
+recorded event at its recorded time, divided by `speed`. Each event is sent
+with an ack request; the time until the server's ack arrives is that event's
+latency. Events the server answered with `retry_later` count as rejected, and
+events still unanswered ACK_TIMEOUT seconds after the last send count as lost.
+Client ids get a suffix unique to the run, so repeating a replay isn't answered
+from the server's send dedupe cache.
+
+Reactions name a message by its room sequence number, which on the target
+need not exist yet. The replayer tracks each room's head: the room's last_seq
+before the run (room_heads()), raised by the seq in every send_message ack.
+A recorded seq past the head reacts to the head message instead, and reactions
+in a room with no messages yet are skipped.
+
+The report is a plain dict (JSON-serializable) so runs of different builds
+can be saved and compared with compare().
+"""
+
+import math
+import threading
+import time
+import uuid
+
+import socketio
+from sqlalchemy import insert, select
+
+from app import db
+from app.models import Room, User
+
+PLACEHOLDER_EMAIL_DOMAIN = 'replay.invalid'
+CLOCK_FIELDS = ('sent_at', 'rendered_at')
+ACK_TIMEOUT = 10
+PERCENTILES = (50, 95, 99)
+
+
+def referenced_names(records):
+    """(user aliases, room aliases) a recording refers to"""
+    users, rooms = set(), set()
+    for _, _, event, payload in records:
+        if not isinstance(payload, dict):
+            continue
+        if event == 'connect':
+            users.add(payload.get('user'))
+        users.add(payload.get('recipient'))
+        rooms.add(payload.get('room'))
+        rooms.update(payload.get('rooms') or ())
+    users.discard(None)
+    rooms.discard(None)
+    return users, rooms
+
+
+def prepare(records):
+    """Create the users and rooms a recording refers to; returns {alias: User}"""
+    usernames, room_names = referenced_names(records)
+    for model, column, names, new_row in (
+            (User, User.username, usernames,
+             lambda name: {'username': name, 'email': f"{name}@{PLACEHOLDER_EMAIL_DOMAIN}"}),
+            (Room, Room.name, room_names, lambda name: {'name': name})):
+        if not names:
+            continue
+        existing = set(db.session.scalars(select(column).where(column.in_(names))))
+        missing = sorted(names - existing)
+        if missing:
+            db.session.execute(insert(model.__table__), [new_row(name) for name in missing])
+    db.session.commit()
+    if not usernames:
+        return {}
+    return {user.username: user for user in User.query.filter(User.username.in_(usernames))}
+
+
+def room_heads(records):
+    """{room alias: last_seq} of the rooms a recording reacts in, as they are on the target"""
+    names = {payload.get('room') for _, _, event, payload in records
+             if event == 'react' and isinstance(payload, dict)}
+    names.discard(None)
+    if not names:
+        return {}
+    return dict(db.session.execute(select(Room.name, Room.last_seq).where(Room.name.in_(names))).all())
+
+
+def _percentile(ordered, p):
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+class _Results:
+    def __init__(self, heads=None):
+        self.heads = dict(heads or {})  # room alias -> highest seq sent on the target
+        self.latencies = {}  # event -> [seconds]
+        self.errors = {}
+        self.rejected = {}
+        self.lag = []  # seconds each late event was sent behind schedule
+        self.pending = {}  # connection number -> events awaiting their ack
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def sent(self, number):
+        with self.lock:
+            self.pending[number] = self.pending.get(number, 0) + 1
+
+    def unsent(self, number):
+        with self.lock:
+            self.pending[number] -= 1
+
+    def outstanding(self, number=None):
+        with self.lock:
+            if number is None:
+                return sum(self.pending.values())
+            return self.pending.get(number, 0)
+
+    def acked(self, number, event, started, args, room=None):
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.pending[number] -= 1
+            self.latencies.setdefault(event, []).append(elapsed)
+            ack = args[0] if args else None
+            if isinstance(ack, dict) and ack.get('status') == 'retry_later':
+                self.rejected[event] = self.rejected.get(event, 0) + 1
+            elif isinstance(ack, dict) and room is not None and isinstance(ack.get('seq'), int):
+                self.heads[room] = max(self.heads.get(room, 0), ack['seq'])
+
+    def head(self, room):
+        with self.lock:
+            return self.heads.get(room, 0)
+
+    def observe(self, event, seconds):
+        with self.lock:
+            self.latencies.setdefault(event, []).append(seconds)
+
+    def error(self, event):
+        with self.lock:
+            self.errors[event] = self.errors.get(event, 0) + 1
+
+    def report(self, duration, speed, lost):
+        by_event = {}
+        for event in sorted(set(self.latencies) | set(self.errors)):
+            ordered = sorted(self.latencies.get(event, ()))
+            stats = {'count': len(ordered), 'errors': self.errors.get(event, 0),
+                     'rejected': self.rejected.get(event, 0),
+                     'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3) if ordered else None}
+            for p in PERCENTILES:
+                value = _percentile(ordered, p)
+                stats[f"p{p}_ms"] = None if value is None else round(value * 1000, 3)
+            by_event[event] = stats
+        answered = sum(len(values) for values in self.latencies.values())
+        lag = sorted(self.lag)
+        return {
+            'speed': speed,
+            'duration_s': round(duration, 3),
+            'events': answered,
+            'throughput': round(answered / duration, 2) if duration else None,
+            'lost': lost,
+            'skipped': self.skipped,
+            'late_sends': len(lag),
+            'max_lag_ms': round(lag[-1] * 1000, 3) if lag else 0,
+            'by_event': by_event,
+        }
+
+
+def _prepared(payload, run_id):
+    """Payload with the client clock filled in and client ids unique to this run"""
+    if not isinstance(payload, dict):
+        return payload
+    payload = dict(payload)
+    now = time.time() * 1000
+    for key in CLOCK_FIELDS:
+        if key in payload:
+            payload[key] = now
+    if isinstance(payload.get('client_id'), str):
+        # Otherwise a second replay within SEND_DEDUPE_WINDOW is answered from the dedupe cache
+        payload['client_id'] = f"{payload['client_id']}-{run_id}"
+    return payload
+
+
+def _on_target(payload, head):
+    """React payload with its seq moved onto a message the target has, or None if it has none"""
+    if not head or not isinstance(payload.get('seq'), int):
+        return None
+    return dict(payload, seq=min(max(payload['seq'], 1), head))
+
+
+def _disconnect_when_answered(client, number, results):
+    deadline = time.monotonic() + ACK_TIMEOUT
+    while results.outstanding(number) > 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    client.disconnect()
+
+
+def replay(records, url, token_for, speed=1.0, progress=None, heads=None):
+    """Send recorded traffic to the server at `url`; returns the report
+
+    `token_for(user_alias)` returns a socket token for a recorded user.
+    `progress(records_done)` is called every 1000 records.
+    `heads` is room_heads(records), read from the target's database.
+    """
+    results = _Results(heads)
+    clients = {}  # connection number -> socketio.Client
+    closing = []
+    run_id = uuid.uuid4().hex[:8]
+    started = time.monotonic()
+    try:
+        for done, (offset_ms, number, event, payload) in enumerate(records, 1):
+            wait = started + offset_ms / 1000 / speed - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            elif wait < -0.001:
+                results.lag.append(-wait)
+
+            if event == 'connect':
+                client = socketio.Client(reconnection=False)
+                connect_started = time.perf_counter()
+                try:
+                    # Over polling, bursts of emits exceed the server's packets-per-request limit
+                    client.connect(url, auth={'token': token_for(payload['user'])},
+                                   transports=['websocket'], wait_timeout=ACK_TIMEOUT)
+                    results.observe(event, time.perf_counter() - connect_started)
+                    clients[number] = client
+                except Exception:
+                    results.error(event)
+            elif event == 'disconnect':
+                client = clients.pop(number, None)
+                if client is not None:
+                    # The recorded client had its answers before it left
+                    thread = threading.Thread(target=_disconnect_when_answered,
+                                              args=(client, number, results), daemon=True)
+                    thread.start()
+                    closing.append(thread)
+            else:
+                client = clients.get(number)
+                if client is None:
+                    # Its connection was refused or predates the recording
+                    results.skipped += 1
+                    continue
+                payload = _prepared(payload, run_id)
+                room = payload.get('room') if isinstance(payload, dict) else None
+                if event == 'react':
+                    payload = _on_target(payload, results.head(room))
+                    if payload is None:
+                        results.skipped += 1
+                        continue
+                sent_at = time.perf_counter()
+                results.sent(number)
+                try:
+                    client.emit(event, payload,
+                                callback=lambda *args, number=number, event=event, sent_at=sent_at, room=room:
+                                results.acked(number, event, sent_at, args, room))
+                except Exception:
+                    results.unsent(number)
+                    results.error(event)
+            if progress and done % 1000 == 0:
+                progress(done)
+
+        deadline = time.monotonic() + ACK_TIMEOUT
+        while results.outstanding() > 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        duration = time.monotonic() - started
+        for thread in closing:
+            thread.join()
+    finally:
+        for client in clients.values():
+            try:
+                client.disconnect()
+            except Exception:
+                pass
+    return results.report(duration, speed, results.outstanding())
+
+
+def _change(current, baseline):
+    if current is None or not baseline:
+        return None
+    return round((current - baseline) / baseline * 100, 1)
+
+
+def compare(report, baseline):
+    """Per-event latency and overall throughput changes against a baseline report, in percent"""
+    events = {}
+    for event, stats in report['by_event'].items():
+        before = baseline.get('by_event', {}).get(event)
+        if before is None:
+            continue
+        events[event] = {f"p{p}": _change(stats[f"p{p}_ms"], before.get(f"p{p}_ms")) for p in PERCENTILES}
+    return {
+        'throughput': _change(report.get('throughput'), baseline.get('throughput')),
+        'by_event': events,
+    }
@@ -0,0 +1,124 @@
+"""
+In-memory room directory
+
+Backs GET /api/rooms. The index is seeded from the rooms table (never from
+aggregates over message) and then updated incrementally: every message sent
+through this worker bumps its room's last activity and per-minute counter.
+Rooms created by other workers are picked up when the index is re-seeded every
+ROOM_DIRECTORY_REFRESH seconds. Listings are cached for ROOM_DIRECTORY_TTL
+seconds, so a burst of directory requests costs one sort.
+"""
+
+import heapq
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from flask import current_app
+
+from app.models import Room
+
+RATE_WINDOW_MINUTES = 10
+
+SORT_KEYS = {
+    'activity': lambda entry: entry['last_message_at'] or '',
+    'online': lambda entry: (entry['online'], entry['last_message_at'] or ''),
+    'rate': lambda entry: (entry['messages_per_minute'], entry['last_message_at'] or ''),
+}
+
+
+class RoomActivity:
+    """Activity of one room: last message time and per-minute message counts"""
+
+    __slots__ = ('name', 'created_at', 'last_message_at', 'minutes')
+
+    def __init__(self, name, created_at=None, last_message_at=None):
+        self.name = name
+        self.created_at = created_at
+        self.last_message_at = last_message_at
+        self.minutes = deque()  # [minute, count], oldest first
+
+    def note_message(self, at):
+        if self.last_message_at is None or at > self.last_message_at:
+            self.last_message_at = at
+        minute = int(at.timestamp() // 60)
+        if self.minutes and self.minutes[-1][0] == minute:
+            self.minutes[-1][1] += 1
+        else:
+            self.minutes.append([minute, 1])
+        self._trim(minute)
+
+    def _trim(self, now_minute):
+        while self.minutes and self.minutes[0][0] <= now_minute - RATE_WINDOW_MINUTES:
+            self.minutes.popleft()
+
+    def rate(self, now_minute):
+        """Messages per minute over the last RATE_WINDOW_MINUTES minutes"""
+        self._trim(now_minute)
+        return sum(count for _, count in self.minutes) / RATE_WINDOW_MINUTES
+
+
+_rooms = {}  # name -> RoomActivity
+_seeded_at = 0.0
+_cache = {}  # (sort, limit) -> (expires, payload)
+_lock = threading.Lock()
+
+
+def _activity(name):
+    entry = _rooms.get(name)
+    if entry is None:
+        entry = _rooms[name] = RoomActivity(name)
+    return entry
+
+
+def note_message(room, at=None):
+    """Record a message sent to `room`"""
+    with _lock:
+        _activity(room).note_message(at or datetime.utcnow())
+
+
+def seed(force=False):
+    """(Re)load the room list from the rooms table when the refresh interval has passed"""
+    global _seeded_at
+    refresh = current_app.config.get('ROOM_DIRECTORY_REFRESH', 60)
+    if not force and time.monotonic() - _seeded_at < refresh:
+        return
+    rows = Room.query.with_entities(Room.name, Room.created_at, Room.last_message_at).all()
+    with _lock:
+        for name, created_at, last_message_at in rows:
+            entry = _activity(name)
+            entry.created_at = created_at
+            if last_message_at and (entry.last_message_at is None or last_message_at > entry.last_message_at):
+                entry.last_message_at = last_message_at
+    _seeded_at = time.monotonic()
+
+
+def listing(sort='activity', limit=50):
+    """Rooms sorted by `sort` (activity, online or rate), cached for ROOM_DIRECTORY_TTL seconds"""
+    from app.socket_events import online_users_per_room
+
+    key = (sort, limit)
+    cached = _cache.get(key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    seed()
+    now_minute = int(datetime.utcnow().timestamp() // 60)
+    with _lock:
+        # Rooms people are in before anyone has written there aren't in the index yet
+        rooms = list(_rooms.values()) + [RoomActivity(name) for name in list(online_users_per_room)
+                                         if name not in _rooms]
+        entries = [{
+            'name': entry.name,
+            'online': len(online_users_per_room.get(entry.name, ())),
+            'last_message_at': entry.last_message_at.isoformat() if entry.last_message_at else None,
+            'messages_per_minute': round(entry.rate(now_minute), 2),
+            'created_at': entry.created_at.isoformat() if entry.created_at else None,
+        } for entry in rooms]
+    top = heapq.nlargest(limit, entries, key=SORT_KEYS[sort])
+
+    payload = {'rooms': top, 'total': len(entries), 'sort': sort,
+               'generated_at': datetime.utcnow().isoformat()}
+    _cache[key] = (time.monotonic() + current_app.config.get('ROOM_DIRECTORY_TTL', 5), payload)
+    return payload
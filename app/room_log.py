@@ -0,0 +1,100 @@
+"""
+Per-room message sequence numbers and the reconnect resume window
+
+Every room message gets the next value of its room's counter (rooms.last_seq,
+incremented atomically in the same transaction as the insert), so clients can
+tell exactly which messages they missed while disconnected. The most recent
+RESUME_WINDOW_SIZE payloads per room are kept in memory; a `resume` for a gap
+inside the window is answered without touching the database.
+"""
+
+from collections import deque
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import update
+
+from app import db, name_cache, sharding
+from app.models import Message, Room
+
+_windows = {}  # room name -> deque of payloads, oldest first
+
+
+def next_seq(room_id, sent_at=None):
+    """Claim the next sequence number of a room (part of the caller's transaction)
+
+    The same UPDATE records when the room last saw a message, which the room
+    directory uses instead of aggregating over message.
+    """
+    return db.session.execute(
+        update(Room).where(Room.id == room_id)
+        .values(last_seq=Room.last_seq + 1, last_message_at=sent_at or datetime.utcnow())
+        .returning(Room.last_seq)
+    ).scalar()
+
+
+def current_seq(room_id):
+    """Latest sequence number handed out in a room (0 if none)"""
+    if room_id is None:
+        return 0
+    return db.session.query(Room.last_seq).filter_by(id=room_id).scalar() or 0
+
+
+def message_payload(message):
+    """receive_message payload for a stored room message"""
+    return {
+        'room': message.room,
+        'seq': message.seq,
+        'username': message.username,
+        'message': message.content,
+        'html': str(message.html),
+        'timestamp': message.timestamp.strftime('%H:%M:%S'),
+    }
+
+
+def record(room, payload):
+    """Remember a payload that was just broadcast to a room"""
+    window = _windows.get(room)
+    if window is None:
+        window = _windows[room] = deque(maxlen=current_app.config.get('RESUME_WINDOW_SIZE', 200))
+    window.append(payload)
+
+
+def forget(room):
+    _windows.pop(room, None)
+
+
+def _window_is_authoritative(room):
+    # Another worker may have broadcast messages this one never saw, unless
+    # this worker owns the room or is the only worker
+    if sharding.is_enabled():
+        return sharding.is_local(room)
+    return current_app.config.get('WEB_CONCURRENCY', 1) <= 1
+
+
+def missed(room, last_seq, limit=None):
+    """Messages in `room` after `last_seq`, oldest first, and whether the list is complete
+
+    Served from the in-memory window when it covers the gap, otherwise from
+    the database (at most `limit` messages).
+    """
+    if limit is None:
+        limit = current_app.config.get('RESUME_MAX_MESSAGES', 500)
+
+    window = _windows.get(room)
+    if window and _window_is_authoritative(room) and min(p['seq'] for p in window) <= last_seq + 1:
+        # Concurrent senders may have recorded their payloads slightly out of order
+        gap = sorted((payload for payload in window if payload['seq'] > last_seq), key=lambda p: p['seq'])
+        return gap[:limit], len(gap) <= limit
+
+    room_id = name_cache.room_id_for(room)
+    if room_id is None:
+        return [], True
+    messages = (Message.query
+                .filter(Message.room_id == room_id, Message.seq > last_seq)
+                .order_by(Message.seq)
+                .limit(limit + 1)
+                .all())
+    name_cache.prime_users(msg.user_id for msg in messages)
+    complete = len(messages) <= limit
+    return [message_payload(msg) for msg in messages[:limit]], complete
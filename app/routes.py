@@ -1,21 +1,31 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session, current_app, Response, abort, send_from_directory, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import or_, tuple_
 from app.models import User, Message
-from app import db, oauth
+from app import db, export, metrics, name_cache, reactions, sharding, room_log, room_directory, socket_auth, thumbnails
+from app.profiler import query_budget
 from app.email_service import send_verification_email, send_password_reset_email, send_welcome_email
 import re
-from datetime import datetime, timedelta
+from datetime import datetime
 from functools import wraps
 import secrets
+import os
+import time
+import uuid
 
 main = Blueprint('main', __name__)
 
 # Configure Google OAuth
-def configure_google_oauth():
-    """Configure Google OAuth client"""
-    if not hasattr(configure_google_oauth, 'configured'):
-        oauth.register(
+def google_oauth():
+    """Google OAuth client; Authlib is imported and registered on first use"""
+    oauth = current_app.extensions.get('authlib.integrations.flask_client')
+    if oauth is None:
+        from authlib.integrations.flask_client import OAuth
+        oauth = OAuth(current_app)
+    client = oauth.create_client('google')
+    if client is None:
+        client = oauth.register(
             name='google',
             client_id=current_app.config['GOOGLE_CLIENT_ID'],
             client_secret=current_app.config['GOOGLE_CLIENT_SECRET'],
@@ -30,7 +40,7 @@ def configure_google_oauth():
                 'response_type': 'code'
             }
         )
-        configure_google_oauth.configured = True
+    return client
 
 # Password validation function
 def validate_password(password):
@@ -53,33 +63,30 @@ def validate_email(email):
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(pattern, email) is not None
 
+def _rate_limited(name, max_requests, window):
+    """Count a request against this client's limit for `name`; True once it's exceeded"""
+    # Epoch seconds kept in the (server-side) session, see app/sessions.py
+    session_key = f"rate_limit_{request.remote_addr}:{name}"
+    now = int(time.time())
+    recent = [t for t in session.get(session_key, ()) if isinstance(t, int) and now - t < window]
+    if len(recent) >= max_requests:
+        session[session_key] = recent
+        return True
+    recent.append(now)
+    session[session_key] = recent
+    session.permanent = True
+    return False
+
 # Rate limiting decorator
 def rate_limit(max_requests=5, window=300):  # 5 requests per 5 minutes
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            key = f"{request.remote_addr}:{f.__name__}"
-            current_time = datetime.utcnow()
-            
-            # Clean old entries
-            session_key = f"rate_limit_{key}"
-            if session_key not in session:
-                session[session_key] = []
-            
-            # Remove old requests outside the window
-            session[session_key] = [
-                timestamp for timestamp in session[session_key]
-                if current_time - datetime.fromisoformat(timestamp) < timedelta(seconds=window)
-            ]
-            
-            if len(session[session_key]) >= max_requests:
+            if _rate_limited(f.__name__, max_requests, window):
                 flash('Too many requests. Please try again later.', 'error')
                 # Return to home page instead of redirecting to same URL to avoid loop
                 return redirect(url_for('main.index'))
             
-            session[session_key].append(current_time.isoformat())
-            session.permanent = True
-            
             return f(*args, **kwargs)
         return decorated_function
     return decorator
@@ -199,26 +206,10 @@ def login():
         
     if request.method == 'POST':
         # Apply rate limiting only to POST requests
-        key = f"{request.remote_addr}:login_post"
-        current_time = datetime.utcnow()
-        
-        # Clean old entries
-        session_key = f"rate_limit_{key}"
-        if session_key not in session:
-            session[session_key] = []
-        
-        # Remove old requests outside the window (5 minutes)
-        session[session_key] = [
-            timestamp for timestamp in session[session_key]
-            if current_time - datetime.fromisoformat(timestamp) < timedelta(seconds=300)
-        ]
-        
-        if len(session[session_key]) >= 5:  # 5 login attempts per 5 minutes
+        if _rate_limited('login_post', 5, 300):  # 5 login attempts per 5 minutes
             flash('Too many login attempts. Please try again later.', 'error')
             return render_template('login.html')
         
-        session[session_key].append(current_time.isoformat())
-        session.permanent = True
         username_or_email = request.form.get('username', '').strip()
         password = request.form.get('password', '')
         remember_me = request.form.get('remember_me') == 'on'
@@ -289,13 +280,38 @@ def logout():
 
 @main.route('/chat/<room>')
 @login_required
+@query_budget(8)
 def chat(room):
-    # Update last seen
-    current_user.update_last_seen()
-    db.session.commit()
-    
-    messages = Message.query.filter_by(room=room).order_by(Message.timestamp).all()
-    return render_template('chat.html', username=current_user.username, messages=messages, room=room)
+    # last_seen is already maintained by the app-wide before_request hook
+    room_id = name_cache.room_id_for(room)
+    # The page shows messages up to room_seq and its socket resumes from there,
+    # so nothing sent while the page loads is lost or shown twice
+    room_seq = room_log.current_seq(room_id)
+    messages = []
+    if room_id:
+        messages = (Message.query
+                    .filter(Message.room_id == room_id, or_(Message.seq.is_(None), Message.seq <= room_seq))
+                    .order_by(Message.timestamp)
+                    .all())
+    name_cache.prime_users(msg.user_id for msg in messages)
+    reaction_counts, my_reactions = reactions.snapshot(room_id, current_user.id, last_seq=room_seq)
+    # With sharding on, the page opens its socket against the room's owner
+    socket_url = sharding.redirect_url(room) or ''
+    socket_token, socket_token_ttl = socket_auth.issue_token(current_user)
+    return render_template('chat.html', username=current_user.username, messages=messages, room=room,
+                           socket_url=socket_url, room_seq=room_seq,
+                           socket_token=socket_token, socket_token_ttl=socket_token_ttl,
+                           reaction_emojis=reactions.EMOJIS, reaction_counts=reaction_counts,
+                           my_reactions=my_reactions)
+
+@main.route('/api/socket-token')
+@login_required
+def socket_token():
+    """A fresh socket token, for reconnects after the page's token expired"""
+    token, ttl = socket_auth.issue_token(current_user)
+    response = jsonify({'token': token, 'expires_in': ttl})
+    response.cache_control.no_store = True
+    return response
 
 # Email Verification Routes
 @main.route('/verify-email/<token>')
@@ -500,6 +516,7 @@ def change_password():
 
 # API Routes for AJAX requests
 @main.route('/api/check-username')
+@query_budget(3)
 def check_username():
     username = request.args.get('username', '').strip()
     
@@ -520,6 +537,7 @@ def check_username():
     return jsonify({'available': True, 'message': 'Username is available'})
 
 @main.route('/api/check-email')
+@query_budget(3)
 def check_email():
     email = request.args.get('email', '').strip().lower()
     
@@ -536,11 +554,182 @@ def check_email():
     
     return jsonify({'available': True, 'message': 'Email is available'})
 
+@main.route('/api/rooms')
+@login_required
+@query_budget(2)  # user load, occasional re-seed from the rooms table
+def room_list():
+    """Room directory sorted by recent activity, online users or message rate"""
+    sort = request.args.get('sort', 'activity')
+    if sort not in room_directory.SORT_KEYS:
+        return jsonify({'error': f'Unknown sort "{sort}"'}), 400
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+    return jsonify(room_directory.listing(sort, limit))
+
+@main.route('/api/rooms/<room>/messages')
+@login_required
+@query_budget(9)
+def room_history(room):
+    """Page backwards through a room's history, falling back to archived months"""
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+    before = request.args.get('before')
+    before_id = request.args.get('before_id', type=int)
+    try:
+        before = datetime.fromisoformat(before) if before else datetime.utcnow()
+    except ValueError:
+        return jsonify({'error': 'Invalid "before" timestamp'}), 400
+    
+    room_id = name_cache.room_id_for(room)
+    messages = []
+    if room_id:
+        # Pages end on a (timestamp, id) pair so messages sharing a timestamp aren't skipped
+        if before_id is None:
+            older = Message.timestamp < before
+        else:
+            older = tuple_(Message.timestamp, Message.id) < tuple_(before, before_id)
+        messages = (Message.query
+                    .filter(Message.room_id == room_id, Message.is_private.isnot(True), older)
+                    .order_by(Message.timestamp.desc(), Message.id.desc())
+                    .limit(limit)
+                    .all())
+        name_cache.prime_users(msg.user_id for msg in messages)
+    items = [msg.to_dict() for msg in reversed(messages)]
+    
+    # Live partitions exhausted: read older months from the archive files
+    if len(items) < limit:
+        from app.partitions import read_archived_messages
+        if messages:
+            before, before_id = messages[-1].timestamp, messages[-1].id
+        items = read_archived_messages(room, before, limit - len(items), before_id) + items
+    
+    seqs = [item['seq'] for item in items if item['seq']]
+    counts, mine = reactions.snapshot(room_id, current_user.id, min(seqs), max(seqs)) if seqs else ({}, {})
+    for item in items:
+        item['reactions'] = counts.get(item['seq'], {})
+        item['my_reactions'] = mine.get(item['seq'], [])
+    
+    full = len(items) == limit
+    return jsonify({
+        'room': room,
+        'messages': items,
+        'next_before': items[0]['timestamp'] if full else None,
+        'next_before_id': items[0]['id'] if full else None
+    })
+
+@main.route('/api/rooms/<room>/owner')
+@login_required
+def room_owner(room):
+    """Which worker serves this room's socket traffic"""
+    worker_id, url = sharding.owner(room)
+    return jsonify({
+        'room': room,
+        'worker_id': worker_id,
+        'url': url,
+        'local': worker_id == sharding.worker_id()
+    })
+
+# History export
+def _export_token_valid():
+    token = current_app.config.get('EXPORT_TOKEN')
+    return bool(token) and secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+
+def _export_response(target):
+    """Stream the target's history as ?format=ndjson|csv, gzipped with ?gzip=1"""
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in export.FORMATS:
+        return jsonify({'error': f'Unknown format "{fmt}"'}), 400
+    try:
+        since = export.parse_time(request.args.get('since'))
+        until = export.parse_time(request.args.get('until'))
+    except ValueError:
+        return jsonify({'error': 'Invalid "since" or "until" timestamp'}), 400
+    compress = request.args.get('gzip', '').lower() in ['1', 'true', 'on']
+
+    chunks = export.stream(export.rows(target, since, until), fmt, compress)
+    mimetype = 'application/gzip' if compress else ('text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{export.filename(target, fmt, compress)}"'
+    return response
+
+@main.route('/api/export/rooms/<room>')
+def export_room(room):
+    """A room's full public history; any signed-in user, or the EXPORT_TOKEN"""
+    if not (_export_token_valid() or current_user.is_authenticated):
+        abort(401)
+    target = export.room_target(room)
+    if target is None:
+        return jsonify({'error': f'Room "{room}" not found'}), 404
+    return _export_response(target)
+
+@main.route('/api/export/users/<username>')
+def export_user(username):
+    """Messages a user sent or received privately; the user themselves, or the EXPORT_TOKEN"""
+    if not _export_token_valid():
+        if not current_user.is_authenticated:
+            abort(401)
+        if current_user.username != username:
+            abort(403)
+    target = export.user_target(username)
+    if target is None:
+        return jsonify({'error': f'User "{username}" not found'}), 404
+    return _export_response(target)
+
+# Attachments
+@main.route('/api/uploads', methods=['POST'])
+@login_required
+def upload_file():
+    """Store an attachment; images get a thumbnail made in the background"""
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({'error': 'No file uploaded'}), 400
+    extension = upload.filename.rsplit('.', 1)[-1].lower() if '.' in upload.filename else ''
+    if extension not in current_app.config.get('ALLOWED_EXTENSIONS', ()):
+        return jsonify({'error': f'File type ".{extension}" is not allowed'}), 400
+
+    stored_name = f"{uuid.uuid4().hex}.{extension}"
+    upload.save(os.path.join(current_app.config['UPLOAD_FOLDER'], stored_name))
+    thumbnail = thumbnails.submit(stored_name)
+    return jsonify({
+        'url': url_for('main.uploaded_file', name=stored_name),
+        'filename': upload.filename,
+        'thumbnail': url_for('main.uploaded_thumbnail', name=thumbnail) if thumbnail else None,
+    }), 201
+
+@main.route('/uploads/<name>')
+@login_required
+def uploaded_file(name):
+    return send_from_directory(current_app.config['UPLOAD_FOLDER'], name)
+
+@main.route('/uploads/thumbs/<name>')
+@login_required
+def uploaded_thumbnail(name):
+    # A message can reach clients before its thumbnail is written
+    if not thumbnails.wait(name, current_app.config.get('THUMBNAIL_WAIT', 5)):
+        abort(404)
+    response = send_from_directory(os.path.join(current_app.config['UPLOAD_FOLDER'], thumbnails.THUMBNAIL_DIR), name)
+    response.cache_control.max_age = 86400
+    response.cache_control.private = True
+    return response
+
+# Metrics
+@main.route('/metrics')
+def metrics_endpoint():
+    """Expose metrics in the Prometheus text format"""
+    if not current_app.config.get('METRICS_ENABLED', True):
+        abort(404)
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token:
+        # Series are labelled with room names: only open for local debugging
+        if not (current_app.debug or current_app.testing):
+            abort(403)
+    elif not secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(401)
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
 # Google OAuth Routes
 @main.route('/auth/google')
 def google_login():
     """Initiate Google OAuth login"""
-    configure_google_oauth()
+    google = google_oauth()
     
     # Store the next URL in session if provided
     next_url = request.args.get('next')
@@ -548,19 +737,19 @@ def google_login():
         session['next_url'] = next_url
     
     redirect_uri = url_for('main.google_callback', _external=True)
-    return oauth.google.authorize_redirect(redirect_uri)
+    return google.authorize_redirect(redirect_uri)
 
 @main.route('/auth/google/callback')
 def google_callback():
     """Handle Google OAuth callback"""
-    configure_google_oauth()
+    google = google_oauth()
     
     try:
         # Get the authorization token
-        token = oauth.google.authorize_access_token()
+        token = google.authorize_access_token()
         
         # Get user info from Google using the access token
-        resp = oauth.google.get('https://www.googleapis.com/oauth2/v2/userinfo', token=token)
+        resp = google.get('https://www.googleapis.com/oauth2/v2/userinfo', token=token)
         user_info = resp.json()
         
         google_id = user_info.get('sub')
@@ -599,10 +788,14 @@ def google_callback():
                 # Create new user
                 # Generate unique username from email
                 base_username = email.split('@')[0]
+                taken = {
+                    name for (name,) in db.session.query(User.username)
+                    .filter(User.username.startswith(base_username, autoescape=True))
+                }
                 username = base_username
                 counter = 1
                 
-                while User.query.filter_by(username=username).first():
+                while username in taken:
                     username = f"{base_username}{counter}"
                     counter += 1
                 
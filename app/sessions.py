@@ -0,0 +1,248 @@
+"""
+Server-side sessions
+
+The session cookie only carries a random session id; the data lives in a
+store selected by SESSION_BACKEND:
+
+    memory    a dict in this process (development; not shared between workers)
+    database  the `sessions` table (production)
+    cookie    Flask's default signed cookie (no server-side state)
+
+Data is serialized with Flask's tagged JSON (the same value types the cookie
+session supports) and zlib-compressed when that pays off. A session is only
+written back when it was modified, or when less than half of its lifetime is
+left, which slides its expiry without a write per request. Permanent sessions
+live PERMANENT_SESSION_LIFETIME, others SESSION_IDLE_TIMEOUT seconds. Expired
+entries are ignored on read and purged every SESSION_PURGE_INTERVAL seconds.
+The id is replaced when a user logs in, so a session id planted before login
+is worthless afterwards.
+"""
+
+import secrets
+import threading
+import zlib
+from datetime import datetime, timedelta
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from flask_login import user_logged_in
+from sqlalchemy import delete, select, update
+from werkzeug.datastructures import CallbackDict
+
+from app import db, socketio
+from app.models import StoredSession
+
+COMPRESS_OVER = 200  # bytes of JSON before compression is tried
+_PLAIN, _ZLIB = b'j', b'z'
+
+_serializer = TaggedJSONSerializer()
+
+
+def dumps(data):
+    raw = _serializer.dumps(dict(data)).encode('utf-8')
+    if len(raw) > COMPRESS_OVER:
+        packed = zlib.compress(raw, 6)
+        if len(packed) < len(raw):
+            return _ZLIB + packed
+    return _PLAIN + raw
+
+
+def loads(blob):
+    kind, body = blob[:1], blob[1:]
+    if kind == _ZLIB:
+        body = zlib.decompress(body)
+    elif kind != _PLAIN:
+        raise ValueError('unknown session encoding')
+    return _serializer.loads(body.decode('utf-8'))
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        def on_update(session):
+            session.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.previous_sid = None
+        self.modified = False
+
+    def regenerate(self):
+        """Move the data to a new id; the old one is deleted on save"""
+        if self.sid and self.previous_sid is None:
+            self.previous_sid = self.sid
+        self.sid = None
+        self.modified = True
+
+
+class MemoryStore:
+    def __init__(self):
+        self._entries = {}  # sid -> (expires_at, blob)
+        self._lock = threading.Lock()
+
+    def load(self, sid, now):
+        entry = self._entries.get(sid)
+        if entry is None or entry[0] <= now:
+            return None
+        return entry
+
+    def save(self, sid, blob, expires_at):
+        with self._lock:
+            self._entries[sid] = (expires_at, blob)
+
+    def touch(self, sid, expires_at):
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is not None:
+                self._entries[sid] = (expires_at, entry[1])
+
+    def delete(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def purge(self, now):
+        with self._lock:
+            expired = [sid for sid, (expires_at, _) in self._entries.items() if expires_at <= now]
+            for sid in expired:
+                del self._entries[sid]
+        return len(expired)
+
+
+class DatabaseStore:
+    """Sessions in the `sessions` table, on their own connections so a request's
+    db.session transaction is never committed or rolled back by session I/O"""
+
+    table = StoredSession.__table__
+
+    def load(self, sid, now):
+        with db.engine.connect() as conn:
+            row = conn.execute(
+                select(self.table.c.expires_at, self.table.c.data)
+                .where(self.table.c.id == sid, self.table.c.expires_at > now)
+            ).first()
+        return tuple(row) if row else None
+
+    def save(self, sid, blob, expires_at):
+        with db.engine.begin() as conn:
+            result = conn.execute(update(self.table).where(self.table.c.id == sid)
+                                  .values(data=blob, expires_at=expires_at))
+            if not result.rowcount:
+                conn.execute(self.table.insert().values(id=sid, data=blob, expires_at=expires_at))
+
+    def touch(self, sid, expires_at):
+        with db.engine.begin() as conn:
+            conn.execute(update(self.table).where(self.table.c.id == sid).values(expires_at=expires_at))
+
+    def delete(self, sid):
+        with db.engine.begin() as conn:
+            conn.execute(delete(self.table).where(self.table.c.id == sid))
+
+    def purge(self, now):
+        with db.engine.begin() as conn:
+            return conn.execute(delete(self.table).where(self.table.c.expires_at <= now)).rowcount
+
+
+STORES = {'memory': MemoryStore, 'database': DatabaseStore}
+
+
+class ServerSessionInterface(SessionInterface):
+    def __init__(self, store):
+        self.store = store
+
+    def lifetime(self, app, session):
+        if session.permanent:
+            return app.permanent_session_lifetime
+        return timedelta(seconds=app.config.get('SESSION_IDLE_TIMEOUT', 86400))
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and len(sid) <= 64:
+            entry = self.store.load(sid, datetime.utcnow())
+            if entry is not None:
+                expires_at, blob = entry
+                try:
+                    return ServerSession(loads(blob), sid=sid, expires_at=expires_at)
+                except (ValueError, zlib.error):
+                    pass
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.previous_sid:
+            self.store.delete(session.previous_sid)
+
+        if not session:
+            if session.sid or session.previous_sid:
+                if session.sid:
+                    self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app),
+                                       httponly=self.get_cookie_httponly(app))
+            return
+
+        now = datetime.utcnow()
+        lifetime = self.lifetime(app, session)
+        new_sid = session.sid is None
+        if session.modified or new_sid:
+            session.sid = session.sid or secrets.token_urlsafe(32)
+            session.expires_at = now + lifetime
+            self.store.save(session.sid, dumps(session), session.expires_at)
+        elif session.expires_at - now < lifetime / 2:
+            # Slide the expiry without rewriting the data
+            session.expires_at = now + lifetime
+            self.store.touch(session.sid, session.expires_at)
+        else:
+            return
+
+        response.vary.add('Cookie')
+        response.set_cookie(name, session.sid,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+
+def _rotate_on_login(sender, user, **extra):
+    from flask import session
+    if isinstance(session, ServerSession):
+        session.regenerate()
+
+
+def init_app(app):
+    """Install the SESSION_BACKEND session interface (no-op for 'cookie')"""
+    backend = app.config.get('SESSION_BACKEND', 'memory')
+    if backend == 'cookie':
+        return
+    if backend not in STORES:
+        raise ValueError(f'Unknown SESSION_BACKEND "{backend}"')
+    app.session_interface = ServerSessionInterface(STORES[backend]())
+    user_logged_in.connect(_rotate_on_login, app)
+
+
+def purge():
+    """Delete expired sessions; returns how many"""
+    from flask import current_app
+    interface = current_app.session_interface
+    if not isinstance(interface, ServerSessionInterface):
+        return 0
+    return interface.store.purge(datetime.utcnow())
+
+
+def _purge_loop(app, interval):
+    while True:
+        socketio.sleep(interval)
+        with app.app_context():
+            try:
+                purge()
+            except Exception as e:
+                print(f"[Sessions] Purging expired sessions failed: {e}")
+
+
+def start(app):
+    """Purge expired sessions in the background"""
+    if isinstance(app.session_interface, ServerSessionInterface):
+        socketio.start_background_task(_purge_loop, app, app.config.get('SESSION_PURGE_INTERVAL', 600))
@@ -0,0 +1,182 @@
+"""
+Room-affinity sharding across worker processes
+
+With SHARDING_ENABLED, every room is owned by exactly one worker, chosen by a
+consistent hash ring over the live workers. Clients open their socket against
+the owner of their room (the chat page is rendered with the owner's URL), and
+any worker receiving join/send traffic for a room it doesn't own answers with
+a `room_moved` event carrying the owner's URL instead of handling it. Room
+broadcasts and per-room in-memory state therefore stay on one process.
+
+Workers find each other through the shard_workers table: each one heartbeats
+its row every SHARD_HEARTBEAT_INTERVAL seconds and rebuilds the ring from the
+rows that are still fresh. When a worker joins or leaves, only the rooms whose
+hash range moved change owner (about 1/N of them); the previous owner sends
+`room_moved` to those rooms and drops their local state.
+
+Private messages are not tied to a room's owner: they are emitted to the
+recipient's personal Socket.IO room, which the SOCKETIO_MESSAGE_QUEUE shared
+by all workers carries to whichever worker the recipient is connected to.
+"""
+
+import hashlib
+import os
+import socket
+from bisect import bisect
+from datetime import datetime, timedelta
+
+from app import db, metrics, socketio
+from app.models import ShardWorker
+
+STALE_AFTER_HEARTBEATS = 3
+
+_enabled = False
+_worker_id = None
+_worker_url = None
+_interval = 5
+_ring = None
+_members = {}  # worker_id -> url
+_on_rebalance = []
+
+
+def _hash(key):
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes"""
+
+    def __init__(self, nodes=(), replicas=64):
+        self.replicas = replicas
+        self.nodes = frozenset(nodes)
+        points = sorted((_hash(f'{node}#{i}'), node) for node in self.nodes for i in range(replicas))
+        self._keys = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, key):
+        """Return the node owning `key`, or None if the ring is empty"""
+        if not self._keys:
+            return None
+        return self._owners[bisect(self._keys, _hash(key)) % len(self._keys)]
+
+
+def init_app(app):
+    """Read sharding settings; the heartbeat only starts with start()"""
+    global _enabled, _worker_id, _worker_url, _interval, _ring
+    _enabled = app.config.get('SHARDING_ENABLED', False)
+    if _enabled and not app.config.get('SHARD_WORKER_URL'):
+        # Peers redirect clients of our rooms to this URL
+        raise ValueError('SHARDING_ENABLED requires SHARD_WORKER_URL')
+    if _enabled and not app.config.get('SOCKETIO_MESSAGE_QUEUE'):
+        # Private messages reach recipients connected to other workers through it
+        raise ValueError('SHARDING_ENABLED requires SOCKETIO_MESSAGE_QUEUE')
+    _worker_id = app.config.get('SHARD_WORKER_ID') or f'{socket.gethostname()}:{os.getpid()}'
+    _worker_url = app.config.get('SHARD_WORKER_URL') or ''
+    _interval = app.config.get('SHARD_HEARTBEAT_INTERVAL', 5)
+    _ring = HashRing([_worker_id], app.config.get('SHARD_VIRTUAL_NODES', 64))
+    _members.clear()
+    _members[_worker_id] = _worker_url
+
+
+def is_enabled():
+    return _enabled
+
+
+def worker_id():
+    return _worker_id
+
+
+def owner(room):
+    """Return (worker_id, url) of the worker owning this room"""
+    if not _enabled or _ring is None:
+        return _worker_id, _worker_url
+    node = _ring.owner(room) or _worker_id
+    return node, _members.get(node, '')
+
+
+def is_local(room):
+    """True if this worker owns the room (always true with sharding off)"""
+    return owner(room)[0] == _worker_id
+
+
+def redirect_url(room):
+    """URL the client should reconnect to for this room, or None if it is ours"""
+    node, url = owner(room)
+    return None if node == _worker_id else url
+
+
+def on_rebalance(f):
+    """Register f(lost_rooms) to be called after ownership changes"""
+    _on_rebalance.append(f)
+    return f
+
+
+def heartbeat(local_rooms=()):
+    """Record our heartbeat, refresh membership and return rooms we no longer own"""
+    global _ring
+    now = datetime.utcnow()
+    db.session.merge(ShardWorker(worker_id=_worker_id, url=_worker_url, heartbeat_at=now))
+    cutoff = now - timedelta(seconds=_interval * STALE_AFTER_HEARTBEATS)
+    live = {row.worker_id: row.url for row in ShardWorker.query.filter(ShardWorker.heartbeat_at >= cutoff)}
+    db.session.commit()
+
+    live[_worker_id] = _worker_url
+    if set(live) == _ring.nodes:
+        _members.update(live)
+        return []
+
+    old_ring = _ring
+    _members.clear()
+    _members.update(live)
+    _ring = HashRing(live, _ring.replicas)
+    print(f"[Sharding] Ring rebalanced: {sorted(live)}")
+    return [room for room in local_rooms if old_ring.owner(room) == _worker_id and not is_local(room)]
+
+
+def leave():
+    """Remove our row so the other workers rebalance without waiting for staleness"""
+    ShardWorker.query.filter_by(worker_id=_worker_id).delete()
+    db.session.commit()
+
+
+def _heartbeat_loop(app, local_rooms):
+    while True:
+        socketio.sleep(_interval)
+        with app.app_context():
+            try:
+                lost = heartbeat(list(local_rooms()))
+            except Exception as e:
+                db.session.rollback()
+                print(f"[Sharding] Heartbeat failed: {e}")
+                continue
+        if lost:
+            for callback in _on_rebalance:
+                callback(lost)
+
+
+def start(app, local_rooms):
+    """Join the ring and keep heartbeating; local_rooms() lists rooms with local state"""
+    if not _enabled:
+        return
+    import atexit
+
+    with app.app_context():
+        heartbeat()
+
+    def leave_ring():
+        with app.app_context():
+            try:
+                leave()
+            except Exception:
+                db.session.rollback()
+
+    atexit.register(leave_ring)
+    socketio.start_background_task(_heartbeat_loop, app, local_rooms)
+    print(f"[Sharding] Worker {_worker_id} ({_worker_url or 'no url'}) joined the ring")
+
+
+metrics.registry.gauge(
+    'shard_ring_workers',
+    'Live workers in the room ownership ring',
+    callback=lambda: [((), len(_ring.nodes) if _ring is not None else 0)]
+)
@@ -0,0 +1,66 @@
+"""
+Socket identity from short-lived signed tokens
+
+main.chat (and /api/socket-token, for reconnects after the token expired)
+issue a JWT naming the signed-in user, valid for SOCKET_TOKEN_TTL seconds.
+The socket sends it as `auth.token` when connecting; the connect handler
+verifies the signature and binds the identity to the sid. Event handlers read
+the sender from that per-sid cache, never from the event payload, and never
+touch the database or the Flask session to find out who is talking.
+"""
+
+import time
+
+import jwt
+from flask import current_app
+
+AUDIENCE = 'socket'
+ALGORITHM = 'HS256'
+
+_identities = {}  # sid -> Identity
+
+
+class Identity:
+    __slots__ = ('user_id', 'username')
+
+    def __init__(self, user_id, username):
+        self.user_id = user_id
+        self.username = username
+
+    def __repr__(self):
+        return f"<Identity {self.username} ({self.user_id})>"
+
+
+def issue_token(user):
+    """Signed socket token for `user`; returns (token, seconds until it expires)"""
+    ttl = current_app.config.get('SOCKET_TOKEN_TTL', 300)
+    now = int(time.time())
+    token = jwt.encode({'sub': str(user.id), 'name': user.username, 'aud': AUDIENCE,
+                        'iat': now, 'exp': now + ttl},
+                       current_app.config['SECRET_KEY'], algorithm=ALGORITHM)
+    return token, ttl
+
+
+def verify_token(token):
+    """Identity named by a valid token, or None if it is missing, forged or expired"""
+    if not token or not isinstance(token, str):
+        return None
+    try:
+        claims = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=[ALGORITHM],
+                            audience=AUDIENCE, leeway=5)
+        return Identity(int(claims['sub']), claims['name'])
+    except (jwt.InvalidTokenError, KeyError, ValueError):
+        return None
+
+
+def bind(sid, identity):
+    _identities[sid] = identity
+
+
+def forget(sid):
+    return _identities.pop(sid, None)
+
+
+def identity(sid):
+    """Identity bound to a connected socket, or None"""
+    return _identities.get(sid)
@@ -1,86 +1,383 @@
-from flask_socketio import SocketIO, emit, join_room, leave_room
-from flask import request
-from flask_login import current_user
-from app import socketio, db
+from flask_socketio import SocketIO, ConnectionRefusedError, emit, join_room, leave_room
+from flask import request, current_app, url_for
+from app import socketio, db, metrics, watchdog, traffic, tracing, admission, batching, reactions, socket_auth, name_cache, sharding, delivery, room_log, unread, room_directory, rendering, thumbnails
 from app.models import Message
+from app.profiler import query_budget
+from collections import OrderedDict
 from datetime import datetime
+from functools import wraps
+import threading
+import time
 
 # Track online users per room and user-socket mapping
 online_users_per_room = {}
 user_sid_map = {}
+socket_focus = {}  # sid -> the room this socket gets full messages and presence for
+draining_users = set()  # user ids whose pending private messages are being pushed
 
-@socketio.on('connect')
-def handle_connect():
-    print("[SocketIO] A user connected.")
+def on_event(event):
+    """Register a Socket.IO handler with latency/exception instrumentation and traffic recording"""
+    def decorator(f):
+        return socketio.on(event)(metrics.timed_event(event)(watchdog.tracked(traffic.recorded(event)(f))))
+    return decorator
 
-@socketio.on('disconnect')
-def handle_disconnect():
-    username = request.args.get('username')
+def _room_sizes():
+    return [((room,), len(users)) for room, users in list(online_users_per_room.items())]
+
+metrics.registry.gauge(
+    'chat_room_online_users',
+    'Online users per chat room',
+    ('room',),
+    callback=_room_sizes
+)
+
+def redirect_to_owner(room):
+    """With sharding on, point the client at the worker owning `room` if it isn't us"""
+    url = sharding.redirect_url(room)
+    if url is None:
+        return False
+    emit('room_moved', {'room': room, 'url': url})
+    return True
+
+@sharding.on_rebalance
+def hand_off_rooms(rooms):
+    """Send clients of rooms that changed owner to the new owner and drop local state"""
+    for room in rooms:
+        batching.forget(room)
+        socketio.emit('room_moved', {'room': room, 'url': sharding.redirect_url(room)}, to=room)
+        socketio.close_room(room)
+        online_users_per_room.pop(room, None)
+        room_log.forget(room)
+        print(f"[SocketIO] Room {room} moved to worker {sharding.owner(room)[0]}.")
+
+def refresh_presence(room):
+    socketio.emit('user_list', list(online_users_per_room.get(room, ())), room=room)
+
+def broadcast_presence(room):
+    """Send a room's user list, coalesced while the worker is shedding load"""
+    if not admission.defer_presence(room):
+        refresh_presence(room)
+
+def current_identity():
+    """Who is on this socket, as established by its token at connect time"""
+    return socket_auth.identity(request.sid)
+
+@on_event('connect')
+def handle_connect(auth=None):
+    identity = socket_auth.verify_token(auth.get('token') if isinstance(auth, dict) else None)
+    if identity is None:
+        raise ConnectionRefusedError('unauthorized')
+    admission.connected()
+    socket_auth.bind(request.sid, identity)
+    name_cache.remember_user(identity.user_id, identity.username)
+    # Private messages are addressed to the user, whichever worker they are on
+    join_room(user_room(identity.user_id))
+    metrics.CONNECTED_SOCKETS.inc()
+    print(f"[SocketIO] {identity.username} connected.")
+
+@on_event('disconnect')
+def handle_disconnect(reason=None):
+    admission.disconnected()
+    metrics.CONNECTED_SOCKETS.dec()
+    identity = socket_auth.forget(request.sid)
+    socket_focus.pop(request.sid, None)
+    if identity is None:
+        return
+    username = identity.username
     print(f"[SocketIO] {username} disconnected.")
 
-    for room, users in online_users_per_room.items():
+    for room, users in list(online_users_per_room.items()):
         if username in users:
             users.remove(username)
-            emit('user_list', list(users), room=room)
+            broadcast_presence(room)
             emit('user_typing', {'username': username, 'typing': False}, room=room)
+            if not users:
+                online_users_per_room.pop(room, None)
 
-    user_sid_map.pop(username, None)
+    if user_sid_map.get(username) == request.sid:
+        user_sid_map.pop(username, None)
+        unread.release(identity.user_id)
 
-@socketio.on('join_room')
-def handle_join(data):
-    username = data.get('username')
-    room = data.get('room')
+def deliver_pending(user_id):
+    """Push private messages queued while the user was offline, one batch per emit"""
+    if user_id in draining_users:
+        return
+    draining_users.add(user_id)
+    try:
+        batch = current_app.config.get('PENDING_DELIVERY_BATCH', 500)
+        while True:
+            messages = delivery.pending_messages(user_id, batch)
+            if not messages:
+                return
+            emit('receive_private_messages', {
+                'messages': [delivery.private_payload(msg) for msg in messages]
+            }, room=request.sid)
+            delivery.mark_delivered(messages)
+            print(f"[SocketIO] Delivered {len(messages)} queued private messages to user {user_id}.")
+            if len(messages) < batch:
+                return
+    finally:
+        draining_users.discard(user_id)
+
+def notify_room(room):
+    """Socket.IO room for lightweight activity notifications about `room`"""
+    return f'notify:{room}'
+
+def user_room(user_id):
+    """Socket.IO room holding every socket of a user, on any worker (see app/sharding.py)"""
+    return f'user:{user_id}'
+
+def focus_room(room, identity):
+    """Make `room` the socket's focused room: full messages, presence, read marker"""
+    username = identity.username
+    previous = socket_focus.get(request.sid)
+    if previous and previous != room:
+        leave_room(previous)
+        users = online_users_per_room.get(previous)
+        if users and username in users:
+            users.discard(username)
+            broadcast_presence(previous)
+            if not users:
+                online_users_per_room.pop(previous, None)
 
     join_room(room)
+    join_room(notify_room(room))
+    socket_focus[request.sid] = room
     user_sid_map[username] = request.sid
 
     if room not in online_users_per_room:
         online_users_per_room[room] = set()
 
     online_users_per_room[room].add(username)
-    print(f"[SocketIO] {username} joined room: {room}")
+    broadcast_presence(room)
 
-    emit('user_list', list(online_users_per_room[room]), room=room)
+    # Everything up to now counts as read in the focused room
+    user_id = identity.user_id
+    room_id = name_cache.room_id_for(room)
+    unread.load(user_id, [room_id])
+    unread.mark_read(user_id, room_id)
+    return user_id, room_id
 
-@socketio.on('send_message')
-def handle_send_message(data):
-    username = data.get('username')
-    message_text = data.get('message')
+@on_event('join_room')
+@admission.join
+@query_budget(5)  # room lookup, read marker, pending queue, sender names, delivered update
+def handle_join(data):
+    identity = current_identity()
     room = data.get('room')
-    timestamp = datetime.utcnow()
 
-    new_msg = Message(username=username, content=message_text, room=room, timestamp=timestamp)
+    if redirect_to_owner(room):
+        return
+
+    user_id, _ = focus_room(room, identity)
+    print(f"[SocketIO] {identity.username} joined room: {room}")
+    deliver_pending(user_id)
+
+@on_event('subscribe')
+@admission.join
+@query_budget(3)  # room ids, room heads, read markers
+def handle_subscribe(data):
+    """Receive activity notifications and unread counts for several rooms on one socket"""
+    rooms = [room for room in (data.get('rooms') or []) if room]
+    user_id = current_identity().user_id
+
+    room_ids = name_cache.room_ids_for(rooms)
+    unread.load(user_id, room_ids.values())
+    states = {}
+    for room in rooms:
+        join_room(notify_room(room))
+        seq, count = unread.state(user_id, room_ids[room]) if room in room_ids else (0, 0)
+        states[room] = {'seq': seq, 'unread': count}
+    emit('subscribed', {'rooms': states})
+
+@on_event('focus')
+@admission.join
+@query_budget(3)  # room lookup, room head, read marker
+def handle_focus(data):
+    """Switch the socket's focused room without reconnecting"""
+    room = data.get('room')
+
+    if redirect_to_owner(room):
+        return
+
+    user_id, room_id = focus_room(room, current_identity())
+    emit('focused', {'room': room, 'seq': unread.state(user_id, room_id)[0]})
+
+@on_event('resume')
+def handle_resume(data):
+    """Replay the room messages a reconnecting client missed
+
+    `rooms` maps each room to the last sequence number the client saw (None
+    for none); entries without an integer seq are skipped.
+    """
+    rooms = data.get('rooms') if isinstance(data, dict) else None
+    if not isinstance(rooms, dict):
+        return
+    for room, last_seq in rooms.items():
+        if last_seq is None:
+            last_seq = 0
+        if not isinstance(last_seq, int) or isinstance(last_seq, bool):
+            continue
+        if redirect_to_owner(room):
+            continue
+        messages, complete = room_log.missed(room, last_seq)
+        emit('resumed', {'room': room, 'messages': messages, 'complete': complete})
+
+class SendDedupeCache:
+    """Client message ids seen recently, bounded in count and age
+
+    Lookups and inserts are O(1) dict operations; entries are kept in arrival
+    order so expired ones are evicted from the front. A key maps to None while
+    its message is being stored and to the ack once it has been.
+    """
+
+    IN_FLIGHT = None
+
+    def __init__(self):
+        self._entries = OrderedDict()  # key -> (expires, ack)
+        self._lock = threading.Lock()
+
+    def _evict(self, now, max_entries):
+        while self._entries:
+            key, (expires, _) = next(iter(self._entries.items()))
+            if expires > now and len(self._entries) < max_entries:
+                break
+            self._entries.popitem(last=False)
+
+    def claim(self, key):
+        """Return (True, None) for a new key, or (False, ack) for a replay"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                return False, entry[1]
+            self._evict(now, current_app.config.get('SEND_DEDUPE_MAX_ENTRIES', 50000))
+            self._entries[key] = (now + current_app.config.get('SEND_DEDUPE_WINDOW', 300), self.IN_FLIGHT)
+            return True, None
+
+    def complete(self, key, ack):
+        with self._lock:
+            if key in self._entries:
+                self._entries[key] = (self._entries[key][0], ack)
+
+    def release(self, key):
+        """Forget a key whose send failed so the client's retry goes through"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+recent_sends = SendDedupeCache()
+
+def deduplicated(f):
+    """Make a send handler idempotent on the client-generated `client_id`
+
+    A replay within SEND_DEDUPE_WINDOW gets the original ack back (or a
+    pending status while the original is still being stored) and is neither
+    stored nor broadcast again.
+    """
+    @wraps(f)
+    def wrapper(data, *args, **kwargs):
+        client_id = data.get('client_id') if isinstance(data, dict) else None
+        if not client_id:
+            return f(data, *args, **kwargs)
+
+        key = (current_identity().user_id, str(client_id)[:64])
+        is_new, ack = recent_sends.claim(key)
+        if not is_new:
+            metrics.SOCKET_DUPLICATE_SENDS.inc()
+            return ack or {'client_id': client_id, 'status': 'pending'}
+        try:
+            ack = f(data, *args, **kwargs)
+        except Exception:
+            recent_sends.release(key)
+            raise
+        if ack is None:
+            recent_sends.release(key)
+            return None
+        ack = dict(ack, client_id=client_id)
+        recent_sends.complete(key, ack)
+        return ack
+    return wrapper
+
+def publish_room_message(username, user_id, room, content, content_html, timestamp, trace=None):
+    """Store a room message, broadcast it and update the per-room indexes"""
+    room_id = name_cache.room_id_for(room, create=True)
+    seq = room_log.next_seq(room_id, timestamp)
+    new_msg = Message(user_id=user_id, content=content, content_html=content_html,
+                      room_id=room_id, seq=seq, timestamp=timestamp)
     db.session.add(new_msg)
     db.session.commit()
+    tracing.persisted(trace)
 
-    emit('receive_message', {
+    payload = {
+        'room': room,
+        'seq': seq,
         'username': username,
-        'message': message_text,
+        'message': content,
+        'html': content_html,
         'timestamp': timestamp.strftime('%H:%M:%S')  # includes seconds
-    }, room=room)
+    }
+    if trace is None:
+        batching.publish(room, payload)
+    else:
+        audience = len(online_users_per_room.get(room, ()))
+        batching.publish(room, dict(payload, trace=tracing.payload(trace, audience)), trace)
+    room_log.record(room, payload)
+    unread.note_message(room_id, seq)
+    unread.mark_read(user_id, room_id, seq)
+    room_directory.note_message(room, timestamp)
+
+    # Subscribers focused elsewhere only get a small notification
+    emit('room_activity', {'room': room, 'seq': seq, 'username': username}, room=notify_room(room))
+    return {'status': 'ok', 'id': new_msg.id, 'seq': seq}
 
-@socketio.on('send_file')
+@on_event('send_message')
+@admission.persistence
+@deduplicated
+@query_budget(7)  # worst case: cold name cache and a brand new room
+def handle_send_message(data):
+    trace = tracing.begin(data)
+    identity = current_identity()
+    message_text = data.get('message')
+    room = data.get('room')
+    timestamp = datetime.utcnow()
+
+    if redirect_to_owner(room):
+        return
+
+    return publish_room_message(identity.username, identity.user_id, room, message_text,
+                                rendering.render_text(message_text), timestamp, trace)
+
+@on_event('send_file')
+@admission.persistence
+@deduplicated
+@query_budget(7)
 def handle_send_file(data):
-    username = data.get('username')
+    identity = current_identity()
     room = data.get('room')
     file_data = data.get('file')
     filename = data.get('filename')
     timestamp = datetime.utcnow()
 
-    file_link = f"<a href='{file_data}' download='{filename}' target='_blank'>📎 {filename}</a>"
-    new_msg = Message(username=username, content=file_link, room=room, timestamp=timestamp)
-    db.session.add(new_msg)
-    db.session.commit()
+    if redirect_to_owner(room):
+        return
 
-    emit('receive_message', {
-        'username': username,
-        'message': file_link,
-        'timestamp': timestamp.strftime('%H:%M:%S')  # includes seconds
-    }, room=room)
+    # Images uploaded through /api/uploads are shown as their thumbnail
+    thumbnail_url = None
+    uploads_prefix = url_for('main.uploaded_file', name='')
+    if file_data and file_data.startswith(uploads_prefix) and thumbnails.is_available():
+        stored_name = file_data[len(uploads_prefix):]
+        if thumbnails.is_image(stored_name):
+            thumbnail_url = url_for('main.uploaded_thumbnail', name=thumbnails.thumbnail_name(stored_name))
 
-@socketio.on('typing')
+    return publish_room_message(identity.username, identity.user_id, room, f"📎 {filename}",
+                                rendering.render_attachment(file_data, filename, thumbnail_url), timestamp)
+
+@on_event('typing')
+@admission.nonessential
 def handle_typing(data):
-    username = data.get('username')
+    username = current_identity().username
     room = data.get('room')
     typing = data.get('typing', False)
 
@@ -89,49 +386,103 @@ def handle_typing(data):
         'typing': typing
     }, room=room, include_self=False)
 
-@socketio.on('private_message')
+@on_event('private_message')
+@admission.persistence
+@deduplicated
+@query_budget(3)  # cold cache: the recipient lookup, the insert and the reload after commit
 def handle_private_message(data):
-    sender = data.get('sender')
+    identity = current_identity()
+    sender_id = identity.user_id
     recipient = data.get('recipient')
     message_text = data.get('message')
     timestamp = datetime.utcnow()
 
-    recipient_sid = user_sid_map.get(recipient)
+    # Only a recipient on this worker is known to be online; one connected to
+    # another worker confirms with `private_received` when the message arrives
+    online_here = recipient in user_sid_map
 
+    recipient_id = name_cache.user_id_for(recipient)
+    if recipient_id is None:
+        print(f"[SocketIO] Dropping private message from '{identity.username}' to unknown user '{recipient}'.")
+        return
+
+    # Offline recipients get it from their pending queue when they next join
     new_msg = Message(
-        username=sender,
+        user_id=sender_id,
         content=message_text,
-        recipient=recipient,
+        content_html=rendering.render_text(message_text),
+        recipient_id=recipient_id,
         is_private=True,
-        timestamp=timestamp
+        timestamp=timestamp,
+        delivered_at=timestamp if online_here else None
     )
     db.session.add(new_msg)
     db.session.commit()
 
-    message_payload = {
-        'sender': sender,
-        'message': message_text,
-        'timestamp': timestamp.strftime('%H:%M:%S')  # include seconds
-    }
+    message_payload = delivery.private_payload(new_msg, timestamp)
+
+    emit('receive_private_message', dict(message_payload, confirm=not online_here),
+         room=user_room(recipient_id))
+
+    emit('receive_private_message', dict(message_payload, queued=not online_here), room=request.sid)
+
+    if not online_here:
+        print(f"[SocketIO] User '{recipient}' is not on this worker. Private message queued for delivery.")
 
-    if recipient_sid:
-        emit('receive_private_message', message_payload, room=recipient_sid)
+    return {'status': 'queued' if not online_here else 'ok', 'id': new_msg.id}
 
-    emit('receive_private_message', message_payload, room=request.sid)
+@on_event('private_received')
+@query_budget(1)
+def handle_private_received(data):
+    """The recipient got a private message that was sent while they looked offline"""
+    message_id = data.get('id') if isinstance(data, dict) else None
+    if not isinstance(message_id, int):
+        return {'status': 'invalid'}
+    delivery.mark_received(current_identity().user_id, message_id)
+    return {'status': 'ok'}
 
-    if not recipient_sid:
-        print(f"[SocketIO] User '{recipient}' is offline. Could not send private message.")
+@on_event('clock')
+def handle_clock(data=None):
+    """Server time in ms, for clients to convert their trace timestamps"""
+    return {'now': time.time() * 1000}
+
+@on_event('trace_render')
+@admission.nonessential
+def handle_trace_render(data):
+    tracing.rendered(str(data.get('id')), data.get('rendered_at'), current_identity().username)
 
 # ✅ Handle Seen Message Acknowledgement
-@socketio.on('message_seen')
+@on_event('message_seen')
+@admission.nonessential
 def handle_message_seen(data):
     sender = data.get('sender')
     timestamp = data.get('timestamp')
     room = data.get('room')
 
+    if data.get('seq'):
+        unread.mark_read(current_identity().user_id,
+                         name_cache.room_id_for(room), int(data['seq']))
+
     emit('message_seen_ack', {
         'sender': sender,
         'timestamp': timestamp
     }, room=room)
     print(f"[SocketIO] Message from {sender} seen at {timestamp} in room {room}.") 
-    
\ No newline at end of file
+    
+
+@on_event('react')
+@admission.nonessential
+@query_budget(1)  # room lookup on a cold name cache
+def handle_react(data):
+    """Add or remove an emoji reaction; written and broadcast by the next reactions flush"""
+    room = data.get('room')
+    seq = data.get('seq')
+    if room is None or socket_focus.get(request.sid) != room or not isinstance(seq, int):
+        return {'status': 'invalid'}
+    user_id = current_identity().user_id
+    room_id = name_cache.room_id_for(room)
+    if room_id is None or not 0 < seq <= unread.state(user_id, room_id)[0]:
+        return {'status': 'invalid'}
+    if not reactions.react(room_id, room, seq, user_id, data.get('emoji'), bool(data.get('on', True))):
+        return {'status': 'invalid'}
+    return {'status': 'queued'}
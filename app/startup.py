@@ -0,0 +1,59 @@
+"""
+Startup timing
+
+Records how long the app package took to import, how long create_app took and
+how long the first request took to serve (template compilation, first DB
+connection and any lazily loaded extension land there). The numbers are
+printed once and exported as the app_startup_seconds gauge on /metrics.
+"""
+
+import time
+
+from flask import request
+
+from app import metrics
+
+_phases = {}  # phase -> seconds
+
+
+def record(phase, seconds):
+    _phases.setdefault(phase, seconds)
+
+
+def phases():
+    return dict(_phases)
+
+
+metrics.registry.gauge(
+    'app_startup_seconds',
+    'Time spent in each startup phase of this process',
+    ('phase',),
+    callback=lambda: [((phase,), seconds) for phase, seconds in list(_phases.items())]
+)
+
+
+def _report(prefix, names):
+    parts = [f"{name} {_phases[name] * 1000:.0f} ms" for name in names if name in _phases]
+    print(f"[Startup] {prefix}: " + ', '.join(parts))
+
+
+def report_ready():
+    _report('app ready', ('import', 'create_app'))
+
+
+def init_app(app):
+    """Time the first request this process serves"""
+    state = {'started': None, 'done': False}
+
+    @app.before_request
+    def start_first_request_timer():
+        if state['started'] is None:
+            state['started'] = time.perf_counter()
+
+    @app.after_request
+    def record_first_request(response):
+        if not state['done'] and state['started'] is not None:
+            state['done'] = True
+            record('first_request', time.perf_counter() - state['started'])
+            _report(f"first request ({request.path})", ('first_request',))
+        return response
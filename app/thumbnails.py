@@ -0,0 +1,132 @@
+"""
+Thumbnails for image attachments
+
+Uploaded images are shrunk to at most THUMBNAIL_SIZE pixels per side by a pool
+of THUMBNAIL_WORKERS separate processes, so decoding and resampling never run
+on the eventlet hub that serves requests and sockets. Messages embed the
+thumbnail and link to the original, which is only downloaded when clicked.
+
+Worker processes are spawned, not forked from the monkey-patched server. A
+spawned worker imports the server's main module as __mp_main__ and then this
+module (which loads the `app` package, but no app is created); run.py skips
+all of its setup under that name. Pillow is optional: without it images are
+sent as plain download links.
+"""
+
+import atexit
+import importlib.util
+import os
+import threading
+
+from flask import current_app
+
+from app import metrics
+
+# Pillow and the process pool are only imported once an image is uploaded
+PILLOW_INSTALLED = importlib.util.find_spec('PIL') is not None
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+THUMBNAIL_DIR = 'thumbs'
+
+THUMBNAILS = metrics.registry.counter(
+    'chat_thumbnails_total',
+    'Image attachment thumbnails by outcome',
+    ('outcome',)
+)
+
+_executor = None
+_pending = {}  # thumbnail name -> Future
+_lock = threading.Lock()
+
+
+def render_thumbnail(source, destination, max_size):
+    """Write a JPEG thumbnail of `source` (runs in a worker process)"""
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        image.seek(0)  # first frame of animated GIFs
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_size, max_size))
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        tmp_path = destination + '.tmp'
+        image.save(tmp_path, 'JPEG', quality=80, optimize=True)
+    os.replace(tmp_path, destination)
+    return image.size
+
+
+def is_available():
+    return PILLOW_INSTALLED and current_app.config.get('THUMBNAILS_ENABLED', True)
+
+
+def is_image(filename):
+    return filename.rsplit('.', 1)[-1].lower() in IMAGE_EXTENSIONS
+
+
+def thumbnail_name(stored_name):
+    return os.path.splitext(stored_name)[0] + '.jpg'
+
+
+def thumbnail_path(name):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], THUMBNAIL_DIR, name)
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            _executor = ProcessPoolExecutor(
+                max_workers=current_app.config.get('THUMBNAIL_WORKERS', 2),
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+            atexit.register(_shutdown)
+        return _executor
+
+
+def _shutdown():
+    """Stop the worker processes; idle workers otherwise keep the interpreter from exiting"""
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _finished(name, future):
+    with _lock:
+        _pending.pop(name, None)
+    error = future.exception()
+    if error is not None:
+        print(f"[Thumbnails] {name} failed: {error}")
+    THUMBNAILS.inc(labels=('failed' if error else 'created',))
+
+
+def submit(stored_name):
+    """Queue a thumbnail for an uploaded image; returns the thumbnail's name, or None"""
+    if not is_available() or not is_image(stored_name):
+        return None
+    name = thumbnail_name(stored_name)
+    destination = thumbnail_path(name)
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    source = os.path.join(current_app.config['UPLOAD_FOLDER'], stored_name)
+    future = _get_executor().submit(render_thumbnail, source, destination,
+                                    current_app.config.get('THUMBNAIL_SIZE', 320))
+    with _lock:
+        _pending[name] = future
+    future.add_done_callback(lambda f: _finished(name, f))
+    return name
+
+
+def wait(name, timeout):
+    """Whether thumbnail `name` exists, waiting up to `timeout` seconds if it is still being made"""
+    with _lock:
+        future = _pending.get(name)
+    if future is not None:
+        try:
+            future.result(timeout)
+        except Exception:
+            pass
+    return os.path.exists(thumbnail_path(name))
@@ -0,0 +1,186 @@
+"""
+End-to-end latency tracing for room messages
+
+A sampled message (TRACE_SAMPLE_RATE) is followed from the sender's click to
+other clients' screens:
+
+  network_in  client send -> handle_send_message received it
+  persist     received -> row committed
+  broadcast   committed -> receive_message emitted to the room
+  render      emitted -> rendered by a receiving client (reported back)
+  end_to_end  client send -> rendered by a receiving client
+
+Client timestamps are converted to server time with the offset each page
+measures through the `clock` event. Stages feed the message_latency_seconds
+histogram; with TRACE_FILE set, every span is also appended to that file in
+the Chrome trace event format (open it in Perfetto or chrome://tracing).
+"""
+
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import current_app
+
+from app import metrics, socketio
+
+MAX_STAGE_SECONDS = 60  # larger values mean a bad client clock, not latency
+OPEN_TRACE_SECONDS = 60  # how long render reports are accepted after a broadcast
+MAX_OPEN_TRACES = 10000
+
+MESSAGE_LATENCY = metrics.registry.histogram(
+    'message_latency_seconds',
+    'Latency of sampled room messages by stage',
+    ('stage',),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+
+
+class Trace:
+    """Timestamps (server epoch seconds) of one sampled message"""
+
+    __slots__ = ('id', 'number', 'room', 'sent_at', 'received_at', 'persisted_at', 'broadcast_at')
+
+    def __init__(self, trace_id, number, sent_at, received_at):
+        self.id = trace_id
+        self.number = number
+        self.room = None
+        self.sent_at = sent_at
+        self.received_at = received_at
+        self.persisted_at = None
+        self.broadcast_at = None
+
+
+_numbers = itertools.count(1)
+_open = OrderedDict()  # trace id -> Trace awaiting render reports
+_events = []  # trace file events not yet written
+_lock = threading.Lock()
+
+
+def _client_time(value):
+    """Server-clock seconds from a client's millisecond timestamp, or None"""
+    if not isinstance(value, (int, float)):
+        return None
+    return value / 1000
+
+
+def _observe(trace, stage, start, end, **args):
+    if start is None or end is None:
+        return
+    duration = end - start
+    if not 0 <= duration <= MAX_STAGE_SECONDS:
+        return
+    MESSAGE_LATENCY.observe(duration, (stage,))
+    if current_app.config.get('TRACE_FILE'):
+        event = {'name': stage, 'ph': 'X', 'pid': os.getpid(), 'tid': trace.number,
+                 'ts': int(start * 1e6), 'dur': int(duration * 1e6),
+                 'args': dict(args, trace_id=trace.id, room=trace.room)}
+        with _lock:
+            _events.append(event)
+
+
+def begin(data):
+    """Start a trace for an incoming send if it is sampled, else return None"""
+    if random.random() >= current_app.config.get('TRACE_SAMPLE_RATE', 0.1):
+        return None
+    trace_id = str(data.get('client_id') or uuid.uuid4().hex)[:64]
+    return Trace(trace_id, next(_numbers), _client_time(data.get('sent_at')), time.time())
+
+
+def persisted(trace):
+    if trace is not None:
+        trace.persisted_at = time.time()
+
+
+def payload(trace, audience):
+    """Trace info sent with receive_message; about TRACE_RENDER_REPORTS receivers report back"""
+    if trace is None:
+        return None
+    reports = current_app.config.get('TRACE_RENDER_REPORTS', 3)
+    return {'id': trace.id, 'rate': min(1.0, reports / max(audience, 1))}
+
+
+def broadcast(trace, room):
+    """Record the server-side stages once the message was emitted"""
+    if trace is None:
+        return
+    trace.room = room
+    trace.broadcast_at = time.time()
+    if current_app.config.get('TRACE_FILE'):
+        with _lock:
+            _events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': trace.number,
+                            'args': {'name': f"{room} {trace.id}"}})
+    _observe(trace, 'network_in', trace.sent_at, trace.received_at)
+    _observe(trace, 'persist', trace.received_at, trace.persisted_at)
+    _observe(trace, 'broadcast', trace.persisted_at, trace.broadcast_at)
+
+    now = time.monotonic()
+    with _lock:
+        _open[trace.id] = (now + OPEN_TRACE_SECONDS, trace)
+        while _open:
+            expires, _ = next(iter(_open.values()))
+            if expires > now and len(_open) <= MAX_OPEN_TRACES:
+                break
+            _open.popitem(last=False)
+
+
+def rendered(trace_id, rendered_at, username=None):
+    """Record a receiving client's render report"""
+    with _lock:
+        entry = _open.get(trace_id)
+    if entry is None:
+        return False
+    trace = entry[1]
+    rendered_at = _client_time(rendered_at)
+    _observe(trace, 'render', trace.broadcast_at, rendered_at, reporter=username)
+    _observe(trace, 'end_to_end', trace.sent_at, rendered_at, reporter=username)
+    return True
+
+
+def flush():
+    """Append buffered span events to TRACE_FILE; returns the number written"""
+    path = current_app.config.get('TRACE_FILE')
+    with _lock:
+        events = _events[:]
+        del _events[:]
+    if not path or not events:
+        return 0
+    new_file = not os.path.exists(path)
+    # JSON array format; trace viewers accept the missing closing bracket
+    with open(path, 'a', encoding='utf-8') as fh:
+        if new_file:
+            fh.write('[\n')
+        fh.write(''.join(json.dumps(event) + ',\n' for event in events))
+    return len(events)
+
+
+def _flush_loop(app, interval):
+    while True:
+        socketio.sleep(interval)
+        with app.app_context():
+            try:
+                flush()
+            except Exception as e:
+                print(f"[Tracing] Writing {app.config.get('TRACE_FILE')} failed: {e}")
+
+
+def start(app):
+    """Write the trace file periodically and once more at exit"""
+    if not app.config.get('TRACE_FILE'):
+        return
+    import atexit
+
+    def final_flush():
+        with app.app_context():
+            try:
+                flush()
+            except Exception:
+                pass
+
+    atexit.register(final_flush)
+    socketio.start_background_task(_flush_loop, app, app.config.get('TRACE_FLUSH_INTERVAL', 2))
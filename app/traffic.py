@@ -0,0 +1,224 @@
+"""
+Socket traffic recording
+
+With TRAFFIC_RECORD_FILE set, every socket event handled by app/socket_events.py
+is logged to that file so replay_traffic.py can later drive a test server with
+the same traffic. The file is gzip-compressed NDJSON: a header object, then one
+array per event
+
+    [milliseconds since recording started, connection number, event, payload]
+
+Connections are numbered in the order they connected; `connect` records carry
+the user and `disconnect` records no payload. Payloads are anonymized before
+they are buffered:
+
+  - user names, room names and client ids become keyed hashes, so the same
+    user or room keeps the same alias in every record and worker
+  - message text, file names and file URLs keep their length and whitespace,
+    every other character becomes "x"
+  - client clock values (sent_at, rendered_at) become 0; the replayer fills
+    in its own clock
+  - reaction emoji are kept when they are one of reactions.EMOJIS
+  - anything else that isn't a number, boolean or None is dropped
+
+Auth tokens are never written. Buffered records are appended every
+TRAFFIC_FLUSH_INTERVAL seconds and once more at exit. A "{pid}" in the file
+name is replaced by the process id, which gives every worker its own file.
+"""
+
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from functools import wraps
+
+from flask import current_app, request
+
+from app import metrics, reactions, socket_auth, socketio
+
+FORMAT = 'chat-traffic'
+VERSION = 1
+
+NAME_FIELDS = {'username': 'u', 'sender': 'u', 'recipient': 'u', 'room': 'r'}
+TEXT_FIELDS = ('message', 'filename', 'file')
+CLOCK_FIELDS = ('sent_at', 'rendered_at')
+ID_FIELDS = ('client_id', 'id')
+
+RECORDED_EVENTS = metrics.registry.counter(
+    'chat_traffic_recorded_events_total',
+    'Socket events written to TRAFFIC_RECORD_FILE'
+)
+
+_started = None  # monotonic time of the first record
+_connections = {}  # sid -> connection number
+_next_connection = [1]
+_records = []  # records not yet written
+_header_written = [False]
+_lock = threading.Lock()
+
+
+def alias(kind, value):
+    """Stable anonymous name for a user ('u') or room ('r'), or a client id ('c')"""
+    digest = hmac.new(current_app.config['SECRET_KEY'].encode('utf-8'),
+                      f"{kind}:{value}".encode('utf-8'), hashlib.sha256).hexdigest()
+    return f"{kind}-{digest[:10]}"
+
+
+def _blank(text):
+    return ''.join(ch if ch.isspace() else 'x' for ch in text)
+
+
+def anonymize(payload):
+    """Copy of an event payload with names, text and client clocks replaced"""
+    if not isinstance(payload, dict):
+        return None
+    clean = {}
+    for key, value in payload.items():
+        if key in CLOCK_FIELDS:
+            clean[key] = 0
+        elif value is None or isinstance(value, (bool, int, float)):
+            clean[key] = value
+        elif key in NAME_FIELDS and isinstance(value, str):
+            clean[key] = alias(NAME_FIELDS[key], value)
+        elif key in ID_FIELDS and isinstance(value, str):
+            clean[key] = alias('c', value)
+        elif key in TEXT_FIELDS and isinstance(value, str):
+            clean[key] = _blank(value)
+        elif key == 'emoji' and value in reactions.EMOJIS:
+            clean[key] = value
+        elif key == 'rooms' and isinstance(value, list):
+            clean[key] = [alias('r', room) for room in value if isinstance(room, str)]
+        elif key == 'rooms' and isinstance(value, dict):
+            # resume: room -> last seen seq
+            clean[key] = {alias('r', room): seq for room, seq in value.items()
+                          if isinstance(seq, (int, float)) or seq is None}
+    return clean
+
+
+def _record(event, payload):
+    global _started
+    now = time.monotonic()
+    with _lock:
+        if _started is None:
+            _started = now
+        if event == 'connect':
+            number = _connections[request.sid] = _next_connection[0]
+            _next_connection[0] += 1
+        elif event == 'disconnect':
+            number = _connections.pop(request.sid, None)
+        else:
+            number = _connections.get(request.sid)
+        if number is None:
+            return
+        _records.append([int((now - _started) * 1000), number, event, payload])
+    RECORDED_EVENTS.inc()
+
+
+def recorded(event):
+    """Decorator logging each call of a socket handler while recording is on"""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not current_app.config.get('TRAFFIC_RECORD_FILE'):
+                return f(*args, **kwargs)
+            if event == 'connect':
+                # Only connections that were accepted, named by their user
+                result = f(*args, **kwargs)
+                identity = socket_auth.identity(request.sid)
+                if identity is not None:
+                    _record(event, {'user': alias('u', identity.username)})
+                return result
+            if event == 'disconnect':
+                _record(event, None)
+                return f(*args, **kwargs)
+            _record(event, anonymize(args[0] if args else None))
+            return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def path():
+    configured = current_app.config.get('TRAFFIC_RECORD_FILE')
+    return configured.replace('{pid}', str(os.getpid())) if configured else None
+
+
+def flush():
+    """Append buffered records to the recording; returns the number written"""
+    target = path()
+    with _lock:
+        records = _records[:]
+        del _records[:]
+    if not target or not records:
+        return 0
+    lines = []
+    if not _header_written[0]:
+        # Every process starts its own section, with times and numbers from zero
+        _header_written[0] = True
+        lines.append(json.dumps({'format': FORMAT, 'version': VERSION, 'pid': os.getpid(),
+                                 'started_at': datetime.utcnow().isoformat()}))
+    lines.extend(json.dumps(record, separators=(',', ':')) for record in records)
+    # Each flush appends one gzip member; readers see a single stream
+    with open(target, 'ab') as fh:
+        fh.write(gzip.compress(('\n'.join(lines) + '\n').encode('utf-8')))
+    return len(records)
+
+
+def read(source):
+    """(header, records) of a recording written by flush()
+
+    Sections written by later processes are moved after the earlier ones, with
+    their connections renumbered so they don't collide.
+    """
+    header, records = None, []
+    time_offset = connection_offset = last_connection = 0
+    with gzip.open(source, 'rt', encoding='utf-8') as fh:
+        for line in fh:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if isinstance(item, dict):
+                if item.get('format') != FORMAT:
+                    raise ValueError(f"{source} is not a traffic recording")
+                header = header or item
+                time_offset = records[-1][0] if records else 0
+                connection_offset = last_connection
+                continue
+            if header is None:
+                raise ValueError(f"{source} is not a traffic recording")
+            item[0] += time_offset
+            item[1] += connection_offset
+            last_connection = max(last_connection, item[1])
+            records.append(item)
+    return header, records
+
+
+def _flush_loop(app, interval):
+    while True:
+        socketio.sleep(interval)
+        with app.app_context():
+            try:
+                flush()
+            except Exception as e:
+                print(f"[Traffic] Writing {path()} failed: {e}")
+
+
+def start(app):
+    """Write the recording periodically and once more at exit"""
+    if not app.config.get('TRAFFIC_RECORD_FILE'):
+        return
+    import atexit
+
+    def final_flush():
+        with app.app_context():
+            try:
+                flush()
+            except Exception:
+                pass
+
+    atexit.register(final_flush)
+    socketio.start_background_task(_flush_loop, app, app.config.get('TRAFFIC_FLUSH_INTERVAL', 2))
+    print(f"[Traffic] Recording socket events to {app.config['TRAFFIC_RECORD_FILE']}")
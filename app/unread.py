@@ -0,0 +1,169 @@
+"""
+Per-user unread counters for subscribed rooms
+
+Unread counts are never computed with COUNT(*). Each room's head sequence
+number (rooms.last_seq, see app/room_log.py) and each user's last read sequence
+per room are kept in memory, and unread = head - last_read. Sending a message
+advances one head; reading advances one marker. Changed markers are written
+back to room_reads in one bulk upsert every UNREAD_FLUSH_INTERVAL seconds.
+A disconnected user's markers are dropped from memory once they are written.
+"""
+
+import threading
+from datetime import datetime
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app import db, socketio
+from app.models import Room, RoomRead
+
+_heads = {}       # room_id -> latest seq seen
+_read_seqs = {}   # (user_id, room_id) -> last read seq
+_user_rooms = {}  # user_id -> room_ids with a marker in _read_seqs
+_dirty = set()    # markers changed since the last flush
+_released = set() # disconnected users whose dirty markers go after the next flush
+_lock = threading.Lock()
+
+
+def note_message(room_id, seq):
+    """Advance a room's head after a message was sent"""
+    if seq is not None and seq > _heads.get(room_id, 0):
+        _heads[room_id] = seq
+
+
+def load(user_id, room_ids):
+    """Refresh heads for these rooms and load the user's markers (two queries at most)
+
+    A room the user has never read starts fully read, rather than counting its
+    whole history as unread.
+    """
+    room_ids = [room_id for room_id in room_ids if room_id is not None]
+    if not room_ids:
+        return
+    for room_id, last_seq in db.session.query(Room.id, Room.last_seq).filter(Room.id.in_(room_ids)):
+        note_message(room_id, last_seq)
+
+    missing = [room_id for room_id in room_ids if (user_id, room_id) not in _read_seqs]
+    if not missing:
+        return
+    stored = dict(db.session.query(RoomRead.room_id, RoomRead.last_read_seq)
+                  .filter(RoomRead.user_id == user_id, RoomRead.room_id.in_(missing)))
+    with _lock:
+        _released.discard(user_id)
+        for room_id in missing:
+            if (user_id, room_id) in _read_seqs:
+                continue
+            if room_id in stored:
+                _set(user_id, room_id, stored[room_id])
+            else:
+                _set(user_id, room_id, _heads.get(room_id, 0))
+                _dirty.add((user_id, room_id))
+
+
+def _set(user_id, room_id, seq):
+    _read_seqs[(user_id, room_id)] = seq
+    _user_rooms.setdefault(user_id, set()).add(room_id)
+
+
+def _drop(user_id, room_ids):
+    rooms = _user_rooms.get(user_id)
+    for room_id in room_ids:
+        _read_seqs.pop((user_id, room_id), None)
+        if rooms is not None:
+            rooms.discard(room_id)
+    if not rooms:
+        _user_rooms.pop(user_id, None)
+
+
+def mark_read(user_id, room_id, seq=None):
+    """Move the user's marker forward to `seq` (default: the room's head)"""
+    if user_id is None or room_id is None:
+        return
+    seq = _heads.get(room_id, 0) if seq is None else seq
+    key = (user_id, room_id)
+    with _lock:
+        _released.discard(user_id)
+        if seq > _read_seqs.get(key, -1):
+            _set(user_id, room_id, seq)
+            _dirty.add(key)
+
+
+def state(user_id, room_id):
+    """(head seq, unread count) for a user in a loaded room"""
+    head = _heads.get(room_id, 0)
+    return head, max(head - _read_seqs.get((user_id, room_id), head), 0)
+
+
+def release(user_id):
+    """Drop a disconnected user's markers from memory; unwritten ones go after the next flush"""
+    with _lock:
+        rooms = _user_rooms.get(user_id, ())
+        _drop(user_id, [room_id for room_id in rooms if (user_id, room_id) not in _dirty])
+        if user_id in _user_rooms:
+            _released.add(user_id)
+
+
+def flush():
+    """Persist changed markers with one upsert; returns the number written"""
+    with _lock:
+        if not _dirty:
+            return 0
+        keys = list(_dirty)
+        _dirty.clear()
+        rows = [{'user_id': user_id, 'room_id': room_id, 'last_read_seq': _read_seqs[(user_id, room_id)],
+                 'updated_at': datetime.utcnow()} for user_id, room_id in keys]
+
+    dialect = db.engine.dialect.name
+    insert = pg_insert if dialect == 'postgresql' else sqlite_insert
+    greatest = db.func.greatest if dialect == 'postgresql' else db.func.max
+    statement = insert(RoomRead).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=['user_id', 'room_id'],
+        set_={
+            # Another worker may have written a newer marker meanwhile
+            'last_read_seq': greatest(RoomRead.last_read_seq, statement.excluded.last_read_seq),
+            'updated_at': statement.excluded.updated_at,
+        }
+    )
+    try:
+        db.session.execute(statement)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        with _lock:
+            _dirty.update(key for key in keys if key in _read_seqs)
+        raise
+
+    with _lock:
+        for user_id in list(_released):
+            rooms = _user_rooms.get(user_id, ())
+            _drop(user_id, [room_id for room_id in rooms if (user_id, room_id) not in _dirty])
+            if user_id not in _user_rooms:
+                _released.discard(user_id)
+    return len(rows)
+
+
+def _flush_loop(app, interval):
+    while True:
+        socketio.sleep(interval)
+        with app.app_context():
+            try:
+                flush()
+            except Exception as e:
+                print(f"[Unread] Flushing read markers failed: {e}")
+
+
+def start(app):
+    """Flush read markers periodically and once more at exit"""
+    import atexit
+
+    def final_flush():
+        with app.app_context():
+            try:
+                flush()
+            except Exception:
+                pass
+
+    atexit.register(final_flush)
+    socketio.start_background_task(_flush_loop, app, app.config.get('UNREAD_FLUSH_INTERVAL', 10))
@@ -0,0 +1,118 @@
+"""
+Set-based user maintenance for the admin scripts
+
+admin_users.py and verify_user.py never load the users table into the ORM:
+
+    count_users()     number of users, optionally only unverified ones
+    stream_users()    plain rows in id order through a server-side cursor,
+                      ADMIN_BATCH_SIZE rows at a time
+    verify_all()      UPDATE unverified users in batches of ADMIN_BATCH_SIZE
+                      (keyset ranges on id), committing after each batch
+    delete_user()     delete a user, or retire them if they are in the
+                      message history
+
+Memory stays flat however many users there are, and each verify batch holds
+its row locks only briefly.
+"""
+
+from flask import current_app
+from sqlalchemy import exists, func, or_, select, update
+
+from app import db
+from app.models import Message, User
+
+# Retired accounts keep their username for the messages that point at them
+RETIRED_EMAIL_DOMAIN = 'deleted.invalid'
+
+LIST_COLUMNS = (
+    User.id, User.username, User.email, User.first_name, User.last_name,
+    User.email_verified, User.is_active, User.created_at, User.last_login,
+)
+
+
+def _batch_size(batch_size):
+    return batch_size or current_app.config.get('ADMIN_BATCH_SIZE', 1000)
+
+
+def _unverified():
+    return User.email_verified.isnot(True)
+
+
+def count_users(unverified=False):
+    query = select(func.count(User.id))
+    if unverified:
+        query = query.where(_unverified())
+    return db.session.execute(query).scalar()
+
+
+def stream_users(batch_size=None):
+    """Yield user rows (see LIST_COLUMNS) in id order without building ORM objects"""
+    query = (select(*LIST_COLUMNS)
+             .order_by(User.id)
+             .execution_options(yield_per=_batch_size(batch_size)))
+    for row in db.session.execute(query):
+        yield row
+
+
+def verify_all(batch_size=None, progress=None):
+    """Mark every unverified user verified; returns the number of users updated
+
+    `progress(done, total)` is called after each committed batch.
+    """
+    batch_size = _batch_size(batch_size)
+    total = count_users(unverified=True)
+    done = 0
+    last_id = 0
+    while total:  # until a batch reaches past the last unverified id
+        # Highest id of the next batch; None means the rest fit in one batch
+        batch_end = db.session.execute(
+            select(User.id).where(_unverified(), User.id > last_id)
+            .order_by(User.id).offset(batch_size - 1).limit(1)
+        ).scalar()
+        query = update(User).where(_unverified(), User.id > last_id)
+        if batch_end is not None:
+            query = query.where(User.id <= batch_end)
+        result = db.session.execute(
+            query.values(email_verified=True, email_verification_token=None)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        done += result.rowcount
+        if progress and result.rowcount:
+            progress(done, total)
+        if batch_end is None:
+            break
+        last_id = batch_end
+    return done
+
+
+def delete_user(user):
+    """Delete `user`, or retire them when messages reference them; returns 'deleted' or 'retired'
+
+    Message.user_id and recipient_id are ON DELETE SET NULL and messages no
+    longer carry names, so deleting a user who sent or received messages
+    would orphan that history.  Those users are retired instead: the row and
+    username stay, everything that identifies or authenticates them is
+    cleared and they can no longer log in.
+    """
+    referenced = db.session.execute(select(exists().where(
+        or_(Message.user_id == user.id, Message.recipient_id == user.id)
+    ))).scalar()
+    if not referenced:
+        db.session.delete(user)
+        db.session.commit()
+        return 'deleted'
+    user.email = f"{user.username}@{RETIRED_EMAIL_DOMAIN}"
+    user.password_hash = None
+    user.email_verified = False
+    user.email_verification_token = None
+    user.password_reset_token = None
+    user.password_reset_expires = None
+    user.first_name = user.last_name = None
+    user.avatar_url = user.bio = None
+    user.google_id = user.oauth_provider = None
+    user.two_factor_enabled = False
+    user.two_factor_secret = None
+    user.is_active = False
+    db.session.commit()
+    return 'retired'
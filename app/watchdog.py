@@ -0,0 +1,147 @@
+"""
+Eventlet hub stall detector
+
+Everything on a worker runs on one eventlet hub, so a single blocking call
+(synchronous SMTP, password hashing, an unpatched driver, a slow stdout)
+freezes every connected socket. A heartbeat greenlet wakes every
+WATCHDOG_INTERVAL_MS and records how late it was (eventlet_hub_lag_seconds).
+A real OS thread, which keeps running while the hub is blocked, checks the
+heartbeat; once it is more than WATCHDOG_THRESHOLD_MS overdue, it captures the
+stack of whatever the hub thread is executing. When the hub recovers, the
+stall is logged with that stack and the socket event or route that was running,
+and counted in eventlet_hub_stalls_total.
+"""
+
+import sys
+import time
+import traceback
+import weakref
+from functools import wraps
+
+from greenlet import getcurrent
+
+from app import metrics, profiler, socketio
+
+HUB_LAG = metrics.registry.histogram(
+    'eventlet_hub_lag_seconds',
+    'How late the hub ran a greenlet that asked to wake up',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+HUB_STALLS = metrics.registry.counter(
+    'eventlet_hub_stalls_total',
+    'Times the hub was blocked for longer than WATCHDOG_THRESHOLD_MS',
+    ('scope',)
+)
+
+STACK_LIMIT = 30  # innermost frames logged per stall
+
+_scopes = weakref.WeakKeyDictionary()  # greenlet -> scope it is serving
+_state = {'tick': None, 'stall': None, 'lag': 0.0}
+
+
+def enter(scope):
+    """Note which route or socket event the current greenlet is serving"""
+    _scopes[getcurrent()] = scope
+
+
+def leave():
+    _scopes.pop(getcurrent(), None)
+
+
+def tracked(f):
+    """Attribute stalls inside a socket handler to its event"""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        enter(profiler.scope_name())
+        try:
+            return f(*args, **kwargs)
+        finally:
+            leave()
+    return wrapper
+
+
+def _running_scope():
+    # The one registered greenlet without a saved frame is the one on the CPU
+    for current, scope in list(_scopes.items()):
+        if current.gr_frame is None and not current.dead:
+            return scope
+    return 'background'
+
+
+def _capture(hub_thread_id, overdue):
+    frame = sys._current_frames().get(hub_thread_id)
+    stack = ''.join(traceback.format_stack(frame, STACK_LIMIT)) if frame is not None else '(no frame)\n'
+    _state['stall'] = {'scope': _running_scope(), 'stack': stack, 'overdue': overdue}
+
+
+def _report(lag):
+    stall = _state['stall']
+    _state['stall'] = None
+    scope = stall['scope'] if stall else 'background'
+    HUB_STALLS.inc(labels=(scope,))
+    if stall:
+        print(f"[Watchdog] Hub blocked for {lag * 1000:.0f} ms in {scope}; it was running:\n{stall['stack']}",
+              end='')
+    else:
+        print(f"[Watchdog] Hub blocked for {lag * 1000:.0f} ms in {scope}")
+
+
+def _heartbeat(interval, threshold):
+    while True:
+        _state['tick'] = time.monotonic()
+        socketio.sleep(interval)
+        lag = max(time.monotonic() - _state['tick'] - interval, 0.0)
+        HUB_LAG.observe(lag)
+        _state['lag'] = lag
+        if lag >= threshold:
+            _report(lag)
+
+
+def _watch(interval, threshold, hub_thread_id, sleep):
+    while True:
+        sleep(interval / 2)
+        tick = _state['tick']
+        if tick is None or _state['stall'] is not None:
+            continue
+        overdue = time.monotonic() - tick - interval
+        if overdue >= threshold:
+            _capture(hub_thread_id, overdue)
+
+
+def recent_lag():
+    """Hub lag measured by the latest heartbeat, in seconds (0 when not running)"""
+    return _state['lag']
+
+
+def init_app(app):
+    """Attribute stalls during HTTP requests to their route"""
+
+    @app.before_request
+    def enter_route_scope():
+        enter(profiler.scope_name())
+
+    @app.teardown_request
+    def leave_route_scope(exc):
+        leave()
+
+
+def start(app):
+    """Run the heartbeat greenlet and the watchdog thread (eventlet only)"""
+    if not app.config.get('WATCHDOG_ENABLED', True):
+        return
+    try:
+        from eventlet import patcher
+    except ImportError:
+        return
+    if not patcher.is_monkey_patched('thread'):
+        return  # no shared hub to watch
+
+    interval = app.config.get('WATCHDOG_INTERVAL_MS', 100) / 1000
+    threshold = app.config.get('WATCHDOG_THRESHOLD_MS', 250) / 1000
+    real_thread = patcher.original('threading')
+    hub_thread_id = patcher.original('_thread').get_ident()
+
+    socketio.start_background_task(_heartbeat, interval, threshold)
+    watcher = real_thread.Thread(target=_watch, name='hub-watchdog', daemon=True,
+                                 args=(interval, threshold, hub_thread_id, patcher.original('time').sleep))
+    watcher.start()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Maintenance script for the month-partitioned message table (PostgreSQL)
+
+Run it daily (e.g. from a cron job) so the partitions for upcoming months
+always exist and months older than the retention window are archived.
+"""
+
+import sys
+from app import create_app, db
+from app import partitions
+
+def ensure(months_ahead=None):
+    """Create partitions for the current and upcoming months"""
+
+    app = create_app()
+
+    with app.app_context():
+        try:
+            if not partitions.is_partitioned():
+                print("ERROR: The message table is not partitioned. Run 'flask db upgrade' on PostgreSQL first.")
+                return False
+
+            created = partitions.ensure_partitions(months_ahead)
+            if created:
+                for name in created:
+                    print(f"✓ Created partition {name}")
+            else:
+                print("All partitions already exist.")
+            return True
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"ERROR: Failed to create partitions: {str(e)}")
+            return False
+
+def archive(retention_months=None):
+    """Archive partitions older than the retention window"""
+
+    app = create_app()
+
+    with app.app_context():
+        try:
+            if not partitions.is_partitioned():
+                print("ERROR: The message table is not partitioned. Run 'flask db upgrade' on PostgreSQL first.")
+                return False
+
+            archives = partitions.archive_partitions(retention_months)
+            if not archives:
+                print("Nothing to archive.")
+            for archive in archives:
+                print(f"✓ Archived {archive.partition_name}: {archive.row_count} messages -> {archive.path}")
+            return True
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"ERROR: Failed to archive partitions: {str(e)}")
+            return False
+
+def list_partitions():
+    """List live partitions and archived months"""
+
+    app = create_app()
+
+    with app.app_context():
+        from app.models import MessageArchive
+
+        if partitions.is_partitioned():
+            print("Live partitions:")
+            print("-" * 70)
+            for partition in partitions.list_partitions():
+                if partition.is_default:
+                    print(f"{partition.name:<24} DEFAULT")
+                else:
+                    print(f"{partition.name:<24} {partition.start or 'MINVALUE'} -> {partition.end}")
+        else:
+            print("The message table is not partitioned.")
+
+        print("\nArchived:")
+        print("-" * 70)
+        for archive in MessageArchive.query.order_by(MessageArchive.range_start).all():
+            print(f"{archive.partition_name:<24} {archive.range_start} -> {archive.range_end} "
+                  f"({archive.row_count} messages) {archive.path}")
+
+if __name__ == '__main__':
+    print("ChatApp Message Archival Tool")
+    print("=" * 50)
+
+    if len(sys.argv) < 2:
+        print("Usage:")
+        print("  python archive_messages.py --ensure [months_ahead]       - Create upcoming partitions")
+        print("  python archive_messages.py --archive [retention_months]  - Archive old partitions")
+        print("  python archive_messages.py --list                        - List partitions and archives")
+        sys.exit(1)
+
+    command = sys.argv[1]
+    argument = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    if command == '--ensure':
+        ok = ensure(argument)
+    elif command == '--archive':
+        ok = ensure() and archive(argument)
+    elif command == '--list':
+        list_partitions()
+        ok = True
+    else:
+        print(f"ERROR: Unknown command '{command}'")
+        ok = False
+
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Show whether a slow PostgreSQL query freezes unrelated greenlets
+
+One greenlet runs `SELECT pg_sleep(...)` (a slow query in one room) while
+others keep issuing quick queries and a ticker measures how late the eventlet
+hub wakes it up (what every other connected socket would experience). The run
+is repeated with psycopg2 blocking and with app.green's wait callback.
+
+Usage:
+  DATABASE_URL=postgresql://... python benchmarks/bench_green_db.py [slow_seconds]
+"""
+
+import eventlet
+eventlet.monkey_patch()
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+
+from app import green
+
+TICK = 0.01
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(int(len(values) * pct), len(values) - 1)] if values else 0.0
+
+
+def run(engine, slow_seconds, quick_workers=4):
+    stop = eventlet.event.Event()
+    quick_latencies = []
+    hub_lags = []
+
+    def slow_room():
+        with engine.connect() as conn:
+            conn.execute(text("SELECT pg_sleep(:s)"), {'s': slow_seconds})
+
+    def quick_room():
+        while not stop.ready():
+            start = time.perf_counter()
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            quick_latencies.append(time.perf_counter() - start)
+            eventlet.sleep(TICK)
+
+    def ticker():
+        while not stop.ready():
+            start = time.perf_counter()
+            eventlet.sleep(TICK)
+            hub_lags.append(time.perf_counter() - start - TICK)
+
+    # Warm the pool so connection setup isn't measured
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+    threads = [eventlet.spawn(ticker)] + [eventlet.spawn(quick_room) for _ in range(quick_workers)]
+    eventlet.sleep(0.1)
+    started = time.perf_counter()
+    eventlet.spawn(slow_room).wait()
+    elapsed = time.perf_counter() - started
+    eventlet.sleep(0.1)
+    stop.send()
+    for thread in threads:
+        thread.wait()
+
+    return {
+        'slow query': elapsed,
+        'quick queries': len(quick_latencies),
+        'quick p99': percentile(quick_latencies, 0.99),
+        'hub lag max': max(hub_lags) if hub_lags else 0.0,
+        'ticks': len(hub_lags),
+    }
+
+
+def main():
+    url = os.environ.get('DATABASE_URL')
+    if not url or not url.startswith('postgres'):
+        print("Set DATABASE_URL to a PostgreSQL database")
+        sys.exit(1)
+    slow_seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    engine = create_engine(url, pool_size=8, max_overflow=0)
+
+    print(f"Slow query: pg_sleep({slow_seconds}), hub tick {TICK * 1000:.0f} ms")
+    print("=" * 60)
+    for label, setup in (('blocking psycopg2', green.unpatch_psycopg),
+                         ('green psycopg2', green.patch_psycopg)):
+        setup()
+        engine.dispose()
+        result = run(engine, slow_seconds)
+        print(f"{label}:")
+        print(f"  slow query took       {result['slow query'] * 1000:8.1f} ms")
+        print(f"  quick queries served  {result['quick queries']:8d}")
+        print(f"  quick query p99       {result['quick p99'] * 1000:8.1f} ms")
+        print(f"  worst hub lag         {result['hub lag max'] * 1000:8.1f} ms ({result['ticks']} ticks)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Measure the overhead added by the metrics instrumentation
+
+Usage:
+  python benchmarks/bench_metrics.py [iterations]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import metrics
+
+
+def handler(data):
+    return data
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    wrapped = metrics.timed_event('bench')(handler)
+    histogram = metrics.Histogram('bench_seconds', 'Benchmark histogram', ('event',))
+    counter = metrics.Counter('bench_total', 'Benchmark counter', ('event',))
+    payload = {'message': 'hello'}
+
+    cases = [
+        ('bare handler call', lambda: handler(payload)),
+        ('timed_event handler call', lambda: wrapped(payload)),
+        ('Histogram.observe', lambda: histogram.observe(0.004, ('send_message',))),
+        ('Counter.inc', lambda: counter.inc(labels=('send_message',))),
+    ]
+
+    print(f"Metrics overhead ({iterations} iterations each)")
+    print("=" * 50)
+    results = {}
+    for name, fn in cases:
+        seconds = min(timeit.repeat(fn, number=iterations, repeat=5))
+        results[name] = seconds / iterations * 1e9
+        print(f"{name:<28} {results[name]:8.0f} ns/call")
+
+    overhead = results['timed_event handler call'] - results['bare handler call']
+    print("-" * 50)
+    print(f"{'instrumentation overhead':<28} {overhead:8.0f} ns/event")
+
+    for i in range(50):
+        histogram.observe(i / 1000.0, (f'event_{i}',))
+    render_seconds = min(timeit.repeat(metrics.registry.render, number=100, repeat=3)) / 100
+    print(f"{'registry.render()':<28} {render_seconds * 1e6:8.0f} us/scrape")
+
+
+if __name__ == '__main__':
+    main()
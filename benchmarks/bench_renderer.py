@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Measure message renderer throughput (app/rendering.py)
+
+Rendering happens once per message, on the socket handler's path, so this is
+the per-send cost it adds.
+
+Usage:
+  python benchmarks/bench_renderer.py [iterations]
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import rendering
+
+SAMPLES = {
+    'short plain': 'ok see you in 5',
+    'typical': 'Deploy is done, **all green** now. Logs: https://ci.example.com/builds/4821?tab=logs',
+    'formatted': 'Use `git rebase -i` then *force push*, see _docs_ at https://git-scm.com/docs and **ping me**\nthanks',
+    'hostile': '<img src=x onerror=alert(1)> "quotes" & <b>tags</b> ' * 4,
+    'long (2 KB)': ('lorem ipsum dolor sit amet **consectetur** adipiscing https://example.com/x ' * 30)[:2048],
+}
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    print(f"Renderer throughput ({iterations} iterations each)")
+    print("=" * 60)
+    for name, text in SAMPLES.items():
+        seconds = min(timeit.repeat(lambda: rendering.render_text(text), number=iterations, repeat=5))
+        per_call = seconds / iterations
+        print(f"{name:<16} {len(text):5d} chars {per_call * 1e6:8.1f} us/msg {1 / per_call:10.0f} msg/s")
+
+    seconds = min(timeit.repeat(lambda: rendering.render_attachment('/static/uploads/report.pdf', 'report.pdf'),
+                                number=iterations, repeat=5))
+    print(f"{'attachment link':<16} {'':11} {seconds / iterations * 1e6:8.1f} us/msg")
+
+
+if __name__ == '__main__':
+    main()
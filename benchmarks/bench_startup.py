@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Report cold-start cost: slowest imports, create_app and the first request
+
+Each measurement runs in a fresh interpreter so nothing is already imported.
+
+Usage:
+  python benchmarks/bench_startup.py [top_n]
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BOOT = "from app import create_app; create_app('testing')"
+
+FIRST_REQUEST = """
+import json, sys, time
+from app import create_app, db, startup
+app = create_app('testing')
+with app.app_context():
+    db.create_all()
+app.test_client().get('/login')
+json.dump(startup.phases(), sys.stderr)
+"""
+
+
+def run(code, *flags):
+    return subprocess.run([sys.executable, *flags, '-c', code], cwd=ROOT,
+                          capture_output=True, text=True, check=True).stderr
+
+
+def slowest_imports(top_n):
+    """(cumulative microseconds, module) for top-level imports, slowest first"""
+    modules = []
+    for line in run(BOOT, '-X', 'importtime').splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Modules imported by the app itself (nesting level 1 or 2), not
+        # their dependencies; the app package's own total is reported below
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 2 and name.strip() != 'app':
+            modules.append((int(cumulative), name.strip()))
+    return sorted(modules, reverse=True)[:top_n]
+
+
+def main():
+    top_n = int(sys.argv[1]) if len(sys.argv) > 1 else 15
+
+    print(f"Slowest imports during create_app (top {top_n})")
+    print("=" * 50)
+    for cumulative, name in slowest_imports(top_n):
+        print(f"{name:<36} {cumulative / 1000:8.1f} ms")
+
+    phases = json.loads(run(FIRST_REQUEST).strip().splitlines()[-1])
+    print("-" * 50)
+    for phase in ('import', 'create_app', 'first_request'):
+        print(f"{phase:<36} {phases.get(phase, 0) * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
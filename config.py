@@ -12,12 +12,25 @@ class Config:
         'pool_pre_ping': True,
         'pool_recycle': 300,
     }
+    # Pool sizing (PostgreSQL): DB_MAX_CONNECTIONS is shared by WEB_CONCURRENCY
+    # worker processes; see app/green.py. DB_POOL_SIZE overrides the split.
+    WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY') or 1)
+    DB_MAX_CONNECTIONS = int(os.environ.get('DB_MAX_CONNECTIONS') or 80)
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 0)
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 0)
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT') or 10)
     
     # Session configuration
     PERMANENT_SESSION_LIFETIME = timedelta(days=7)  # Remember me duration
     SESSION_COOKIE_SECURE = os.environ.get('FLASK_ENV') == 'production'
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = 'Lax'
+    # Where session data lives: 'memory' (this process), 'database' (the
+    # sessions table) or 'cookie' (Flask's signed cookie); see app/sessions.py.
+    # Non-permanent sessions expire after SESSION_IDLE_TIMEOUT seconds.
+    SESSION_BACKEND = os.environ.get('SESSION_BACKEND') or 'memory'
+    SESSION_IDLE_TIMEOUT = int(os.environ.get('SESSION_IDLE_TIMEOUT') or 86400)
+    SESSION_PURGE_INTERVAL = int(os.environ.get('SESSION_PURGE_INTERVAL') or 600)
     
     # Flask-Login configuration
     REMEMBER_COOKIE_DURATION = timedelta(days=7)
@@ -53,6 +66,113 @@ class Config:
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
     ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'doc', 'docx'}
     
+    # Image attachment thumbnails, made by a pool of worker processes (see app/thumbnails.py)
+    THUMBNAILS_ENABLED = os.environ.get('THUMBNAILS_ENABLED', 'true').lower() in ['true', 'on', '1']
+    THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS') or 2)
+    THUMBNAIL_SIZE = int(os.environ.get('THUMBNAIL_SIZE') or 320)
+    THUMBNAIL_WAIT = int(os.environ.get('THUMBNAIL_WAIT') or 5)  # seconds a thumbnail request waits for a pending job
+    
+    # Metrics endpoint: scrapes need "Authorization: Bearer <METRICS_TOKEN>"; without a
+    # token it only answers in debug and testing
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ['true', 'on', '1']
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    
+    # SQL query profiler
+    SQL_PROFILER_ENABLED = os.environ.get('SQL_PROFILER_ENABLED', 'true').lower() in ['true', 'on', '1']
+    SLOW_QUERY_THRESHOLD_MS = int(os.environ.get('SLOW_QUERY_THRESHOLD_MS') or 200)
+    N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD') or 5)
+    QUERY_BUDGET_STRICT = os.environ.get('QUERY_BUDGET_STRICT', 'false').lower() in ['true', 'on', '1']
+    
+    # Message partitioning and archival (PostgreSQL)
+    MESSAGE_PARTITIONS_AHEAD = int(os.environ.get('MESSAGE_PARTITIONS_AHEAD') or 3)
+    MESSAGE_RETENTION_MONTHS = int(os.environ.get('MESSAGE_RETENTION_MONTHS') or 12)
+    ARCHIVE_FOLDER = os.environ.get('ARCHIVE_FOLDER') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archives')
+    
+    # Private messages for offline users are pushed in batches of this size on join
+    PENDING_DELIVERY_BATCH = int(os.environ.get('PENDING_DELIVERY_BATCH') or 500)
+    
+    # History export (/api/export, export_history.py): rows per cursor fetch,
+    # bytes per response chunk, and a bearer token allowing any room or user
+    EXPORT_FETCH_SIZE = int(os.environ.get('EXPORT_FETCH_SIZE') or 5000)
+    EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE') or 65536)
+    EXPORT_TOKEN = os.environ.get('EXPORT_TOKEN')
+    
+    # Input lines per committed batch for import_history.py
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE') or 10000)
+    
+    # Rooms sending at least BROADCAST_BATCH_THRESHOLD messages per second
+    # (0 turns batching off) broadcast them in receive_messages frames, one per
+    # BROADCAST_BATCH_WINDOW_MS (see app/batching.py)
+    BROADCAST_BATCH_THRESHOLD = int(os.environ.get('BROADCAST_BATCH_THRESHOLD') or 20)
+    BROADCAST_BATCH_WINDOW_MS = int(os.environ.get('BROADCAST_BATCH_WINDOW_MS') or 20)
+    
+    # Lifetime in seconds of the signed tokens sockets authenticate with
+    SOCKET_TOKEN_TTL = int(os.environ.get('SOCKET_TOKEN_TTL') or 300)
+    
+    # Rows per batch for admin_users.py / verify_user.py (cursor fetches and UPDATEs)
+    ADMIN_BATCH_SIZE = int(os.environ.get('ADMIN_BATCH_SIZE') or 1000)
+    
+    # Reconnect resume: recent messages kept in memory per room, and the most
+    # messages replayed by one resume
+    RESUME_WINDOW_SIZE = int(os.environ.get('RESUME_WINDOW_SIZE') or 200)
+    RESUME_MAX_MESSAGES = int(os.environ.get('RESUME_MAX_MESSAGES') or 500)
+    
+    # Seconds between flushes of coalesced emoji reactions (see app/reactions.py)
+    REACTION_FLUSH_INTERVAL = int(os.environ.get('REACTION_FLUSH_INTERVAL') or 1)
+    
+    # Seconds between bulk writes of users' read markers (unread counters)
+    UNREAD_FLUSH_INTERVAL = int(os.environ.get('UNREAD_FLUSH_INTERVAL') or 10)
+    
+    # Room directory (/api/rooms): response cache TTL and how often the
+    # in-memory index re-reads the rooms table, in seconds
+    ROOM_DIRECTORY_TTL = int(os.environ.get('ROOM_DIRECTORY_TTL') or 5)
+    ROOM_DIRECTORY_REFRESH = int(os.environ.get('ROOM_DIRECTORY_REFRESH') or 60)
+    
+    # Hub stall detector: log the running stack when the eventlet hub is
+    # blocked for longer than WATCHDOG_THRESHOLD_MS (see app/watchdog.py)
+    WATCHDOG_ENABLED = os.environ.get('WATCHDOG_ENABLED', 'true').lower() in ['true', 'on', '1']
+    WATCHDOG_INTERVAL_MS = int(os.environ.get('WATCHDOG_INTERVAL_MS') or 100)
+    WATCHDOG_THRESHOLD_MS = int(os.environ.get('WATCHDOG_THRESHOLD_MS') or 250)
+    
+    # Admission control and load shedding (see app/admission.py); 0 disables
+    # the socket and join limits
+    ADMISSION_MAX_SOCKETS = int(os.environ.get('ADMISSION_MAX_SOCKETS') or 5000)
+    ADMISSION_JOINS_PER_SECOND = int(os.environ.get('ADMISSION_JOINS_PER_SECOND') or 50)
+    ADMISSION_MAX_PENDING_WRITES = int(os.environ.get('ADMISSION_MAX_PENDING_WRITES') or 200)
+    ADMISSION_SHED_LAG_MS = int(os.environ.get('ADMISSION_SHED_LAG_MS') or 100)
+    ADMISSION_REJECT_LAG_MS = int(os.environ.get('ADMISSION_REJECT_LAG_MS') or 1000)
+    ADMISSION_RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER') or 2)
+    ADMISSION_PRESENCE_INTERVAL = int(os.environ.get('ADMISSION_PRESENCE_INTERVAL') or 2)
+    
+    # End-to-end message latency tracing (see app/tracing.py); set TRACE_FILE
+    # to also write spans in the Chrome trace event format
+    TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE') or 0.1)
+    TRACE_RENDER_REPORTS = int(os.environ.get('TRACE_RENDER_REPORTS') or 3)
+    TRACE_FILE = os.environ.get('TRACE_FILE')
+    TRACE_FLUSH_INTERVAL = int(os.environ.get('TRACE_FLUSH_INTERVAL') or 2)
+    
+    # Record anonymized socket traffic for replay_traffic.py (see app/traffic.py);
+    # "{pid}" in the file name is replaced by the worker's process id
+    TRAFFIC_RECORD_FILE = os.environ.get('TRAFFIC_RECORD_FILE')
+    TRAFFIC_FLUSH_INTERVAL = int(os.environ.get('TRAFFIC_FLUSH_INTERVAL') or 2)
+    
+    # Replayed sends (same client_id) are dropped within this many seconds;
+    # the cache holds at most SEND_DEDUPE_MAX_ENTRIES ids
+    SEND_DEDUPE_WINDOW = int(os.environ.get('SEND_DEDUPE_WINDOW') or 300)
+    SEND_DEDUPE_MAX_ENTRIES = int(os.environ.get('SEND_DEDUPE_MAX_ENTRIES') or 50000)
+    
+    # Room-affinity sharding: each room is served by one worker process, which
+    # must be reachable by clients at SHARD_WORKER_URL (see app/sharding.py)
+    SHARDING_ENABLED = os.environ.get('SHARDING_ENABLED', 'false').lower() in ['true', 'on', '1']
+    SHARD_WORKER_ID = os.environ.get('SHARD_WORKER_ID')
+    SHARD_WORKER_URL = os.environ.get('SHARD_WORKER_URL')
+    SHARD_HEARTBEAT_INTERVAL = int(os.environ.get('SHARD_HEARTBEAT_INTERVAL') or 5)
+    SHARD_VIRTUAL_NODES = int(os.environ.get('SHARD_VIRTUAL_NODES') or 64)
+    # Socket.IO message queue (e.g. redis://localhost:6379/0) that carries emits
+    # between workers; sharded workers need it to deliver private messages to
+    # recipients connected elsewhere
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+    
     # Google OAuth configuration
     GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
     GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET')
@@ -62,6 +182,7 @@ class DevelopmentConfig(Config):
     
 class ProductionConfig(Config):
     DEBUG = False
+    SESSION_BACKEND = os.environ.get('SESSION_BACKEND') or 'database'
     SESSION_COOKIE_SECURE = True
     REMEMBER_COOKIE_SECURE = True
     
@@ -69,6 +190,10 @@ class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
     WTF_CSRF_ENABLED = False
+    # Over-budget routes and handlers fail the tests (see app/profiler.py)
+    QUERY_BUDGET_STRICT = True
+    SESSION_BACKEND = 'memory'
+    THUMBNAILS_ENABLED = False
 
 config = {
     'development': DevelopmentConfig,
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Export a room's or a user's full message history
+
+The format follows the output file's extension: .ndjson or .csv, with .gz
+added for gzip compression. Rows are streamed from the database and the
+archive files, so any amount of history can be exported.
+"""
+
+import os
+import sys
+from app import create_app, db
+from app import export
+
+PROGRESS_EVERY = 100000
+
+def _format_for(path):
+    """(format, compress) from an output file name"""
+    compress = path.endswith('.gz')
+    if compress:
+        path = path[:-3]
+    fmt = path.rsplit('.', 1)[-1].lower() if '.' in path else ''
+    return fmt, compress
+
+def _counted(rows, counter):
+    for row in rows:
+        counter[0] += 1
+        if counter[0] % PROGRESS_EVERY == 0:
+            print(f"  {counter[0]} messages exported...")
+        yield row
+
+def export_history(kind, name, path, since=None, until=None):
+    """Write the history of room or user `name` to `path`"""
+
+    fmt, compress = _format_for(path)
+    if fmt not in export.FORMATS:
+        print(f"ERROR: Unknown export format '.{fmt}'. Use .ndjson, .csv, .ndjson.gz or .csv.gz")
+        return False
+
+    app = create_app()
+
+    with app.app_context():
+        try:
+            since = export.parse_time(since)
+            until = export.parse_time(until)
+            target = export.room_target(name) if kind == 'room' else export.user_target(name)
+            if target is None:
+                print(f"ERROR: {kind.capitalize()} '{name}' not found.")
+                return False
+
+            counter = [0]
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as fh:
+                for chunk in export.stream(_counted(export.rows(target, since, until), counter), fmt, compress):
+                    fh.write(chunk)
+            os.replace(tmp_path, path)
+
+            print(f"✓ Exported {counter[0]} messages from {kind} '{name}' to {path}")
+            return True
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"ERROR: Failed to export {kind} '{name}': {str(e)}")
+            return False
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4 or sys.argv[1] not in ('--room', '--user'):
+        print("Usage:")
+        print("  python export_history.py --room <room> <output_file> [since] [until]      - Export a room")
+        print("  python export_history.py --user <username> <output_file> [since] [until]  - Export a user's messages")
+        print("")
+        print("The output file's extension picks the format: .ndjson, .csv, .ndjson.gz or .csv.gz")
+        print("since/until are ISO timestamps, e.g. 2026-01-01 or 2026-01-01T12:00:00")
+        print("")
+        print("Examples:")
+        print("  python export_history.py --room general general.ndjson.gz")
+        print("  python export_history.py --user alice alice.csv 2026-01-01 2026-07-01")
+        sys.exit(1)
+
+    kind = sys.argv[1][2:]
+    since = sys.argv[4] if len(sys.argv) > 4 else None
+    until = sys.argv[5] if len(sys.argv) > 5 else None
+    if not export_history(kind, sys.argv[2], sys.argv[3], since, until):
+        sys.exit(1)
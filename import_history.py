@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Bulk import of message history from NDJSON files
+
+Loads exported or converted history (one JSON message per line, see
+app/bulk_import.py) with COPY on PostgreSQL. Progress is checkpointed in the
+database after every batch: run the same command again to resume an
+interrupted import.
+"""
+
+import sys
+import time
+from app import create_app, db
+from app import bulk_import
+
+def _printer():
+    started = time.monotonic()
+
+    def progress(checkpoint, error=None):
+        if error:
+            print(f"  skipped {error}")
+            return
+        rate = checkpoint.row_count / max(time.monotonic() - started, 0.001)
+        print(f"  {checkpoint.line_count} lines read, {checkpoint.row_count} messages imported "
+              f"({rate:.0f}/s this run)")
+    return progress
+
+def import_history(path, defer_indexes=False, restart=False, batch_size=None):
+    """Import an NDJSON (or .ndjson.gz) file of messages"""
+
+    app = create_app()
+
+    with app.app_context():
+        try:
+            if defer_indexes:
+                print("Dropping message indexes until the import finishes...")
+            checkpoint = bulk_import.import_file(path, batch_size=batch_size, defer_indexes=defer_indexes,
+                                                 restart=restart, progress=_printer())
+            print(f"✓ Imported {checkpoint.row_count} messages from {path} "
+                  f"({checkpoint.skipped_count} lines skipped)")
+            return True
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"ERROR: Import of {path} failed: {str(e)}")
+            print("Run the same command again to resume from the last checkpoint.")
+            return False
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    flags = [arg for arg in sys.argv[1:] if arg.startswith('--')]
+    unknown = [flag for flag in flags if flag not in ('--defer-indexes', '--restart')]
+
+    if len(args) not in (1, 2) or unknown:
+        print("Usage:")
+        print("  python import_history.py <file.ndjson[.gz]> [batch_size] [--defer-indexes] [--restart]")
+        print("")
+        print("  --defer-indexes  drop message indexes during the load and rebuild them at the end")
+        print("                   (fastest; only before the app serves traffic)")
+        print("  --restart        discard the checkpoint and import the file from the start")
+        print("")
+        print("Examples:")
+        print("  python import_history.py history.ndjson.gz --defer-indexes")
+        print("  python import_history.py history.ndjson 50000")
+        sys.exit(1)
+
+    batch_size = int(args[1]) if len(args) > 1 else None
+    if not import_history(args[0], '--defer-indexes' in flags, '--restart' in flags, batch_size):
+        sys.exit(1)
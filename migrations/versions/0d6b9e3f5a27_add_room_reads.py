@@ -0,0 +1,32 @@
+"""Add room_reads table for per-user unread counters
+
+Revision ID: 0d6b9e3f5a27
+Revises: e83a5c7d2f19
+Create Date: 2026-10-19 14:31:57.240118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0d6b9e3f5a27'
+down_revision = 'e83a5c7d2f19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('room_reads',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('room_id', sa.Integer(), nullable=False),
+    sa.Column('last_read_seq', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['room_id'], ['rooms.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'room_id')
+    )
+
+
+def downgrade():
+    op.drop_table('room_reads')
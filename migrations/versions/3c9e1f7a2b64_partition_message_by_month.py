@@ -0,0 +1,114 @@
+"""Partition message table by month
+
+Revision ID: 3c9e1f7a2b64
+Revises: fd02739754a2
+Create Date: 2026-10-19 09:12:41.118204
+
+On PostgreSQL the existing `message` table becomes the `message_legacy`
+partition covering everything before the start of next month; new months get
+their own partitions (see app/partitions.py). The expensive steps (unique
+index build, constraint validation) run before the swap and do not block
+writers; the swap itself only takes brief metadata locks.
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9e1f7a2b64'
+down_revision = 'fd02739754a2'
+branch_labels = None
+depends_on = None
+
+
+def _next_month(dt, months=1):
+    years, month_index = divmod(dt.month - 1 + months, 12)
+    return datetime(dt.year + years, month_index + 1, 1)
+
+
+def upgrade():
+    op.create_table('message_archive',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('partition_name', sa.String(length=64), nullable=False),
+    sa.Column('range_start', sa.DateTime(), nullable=False),
+    sa.Column('range_end', sa.DateTime(), nullable=False),
+    sa.Column('path', sa.String(length=255), nullable=False),
+    sa.Column('row_count', sa.Integer(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('partition_name')
+    )
+    with op.batch_alter_table('message_archive', schema=None) as batch_op:
+        batch_op.create_index('ix_message_archive_range_start', ['range_start'], unique=False)
+        batch_op.create_index('ix_message_archive_range_end', ['range_end'], unique=False)
+
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        op.execute("UPDATE message SET timestamp = CURRENT_TIMESTAMP WHERE timestamp IS NULL")
+        with op.batch_alter_table('message', schema=None) as batch_op:
+            batch_op.alter_column('timestamp', existing_type=sa.DateTime(), nullable=False)
+            batch_op.create_index('ix_message_room_timestamp', ['room', 'timestamp'], unique=False)
+        return
+
+    now = datetime.utcnow()
+    cutover = _next_month(now)
+
+    op.execute("UPDATE message SET timestamp = now() AT TIME ZONE 'utc' WHERE timestamp IS NULL")
+
+    # Build the indexes the partitioned parent needs without blocking writers
+    with op.get_context().autocommit_block():
+        op.execute("CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS message_legacy_id_timestamp_key "
+                   "ON message (id, timestamp)")
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS message_legacy_room_timestamp_idx "
+                   "ON message (room, timestamp)")
+
+    # A validated CHECK lets SET NOT NULL and ATTACH PARTITION skip their full scans
+    op.execute(f"ALTER TABLE message ADD CONSTRAINT message_legacy_bounds "
+               f"CHECK (timestamp IS NOT NULL AND timestamp < '{cutover.isoformat(' ')}') NOT VALID")
+    op.execute("ALTER TABLE message VALIDATE CONSTRAINT message_legacy_bounds")
+    op.execute("ALTER TABLE message ALTER COLUMN timestamp SET NOT NULL")
+
+    # The partitioned primary key (id, timestamp) replaces the old one on id;
+    # ids stay unique because they all come from message_id_seq
+    op.execute("ALTER TABLE message DROP CONSTRAINT message_pkey, "
+               "ADD CONSTRAINT message_legacy_pkey PRIMARY KEY USING INDEX message_legacy_id_timestamp_key")
+    op.execute("ALTER TABLE message RENAME TO message_legacy")
+    op.execute("CREATE TABLE message (LIKE message_legacy INCLUDING DEFAULTS, "
+               "PRIMARY KEY (id, timestamp)) PARTITION BY RANGE (timestamp)")
+    # ATTACH PARTITION adopts the matching indexes built above instead of rebuilding them
+    op.execute("CREATE INDEX ix_message_room_timestamp ON ONLY message (room, timestamp)")
+    op.execute("ALTER SEQUENCE message_id_seq OWNED BY message.id")
+    op.execute(f"ALTER TABLE message ATTACH PARTITION message_legacy "
+               f"FOR VALUES FROM (MINVALUE) TO ('{cutover.isoformat(' ')}')")
+    op.execute("CREATE TABLE message_default PARTITION OF message DEFAULT")
+
+    for offset in range(3):
+        lower = _next_month(cutover, offset)
+        upper = _next_month(cutover, offset + 1)
+        op.execute(f"CREATE TABLE message_y{lower.year:04d}m{lower.month:02d} PARTITION OF message "
+                   f"FOR VALUES FROM ('{lower.isoformat(' ')}') TO ('{upper.isoformat(' ')}')")
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        # Copy every partition back into a plain table
+        op.execute("ALTER TABLE message RENAME TO message_partitioned")
+        op.execute("CREATE TABLE message (LIKE message_partitioned INCLUDING DEFAULTS)")
+        op.execute("INSERT INTO message SELECT * FROM message_partitioned")
+        op.execute("ALTER SEQUENCE message_id_seq OWNED BY message.id")
+        op.execute("DROP TABLE message_partitioned CASCADE")
+        op.execute("ALTER TABLE message ADD PRIMARY KEY (id)")
+        op.execute("ALTER TABLE message ALTER COLUMN timestamp DROP NOT NULL")
+    else:
+        with op.batch_alter_table('message', schema=None) as batch_op:
+            batch_op.drop_index('ix_message_room_timestamp')
+            batch_op.alter_column('timestamp', existing_type=sa.DateTime(), nullable=True)
+
+    with op.batch_alter_table('message_archive', schema=None) as batch_op:
+        batch_op.drop_index('ix_message_archive_range_end')
+        batch_op.drop_index('ix_message_archive_range_start')
+
+    op.drop_table('message_archive')
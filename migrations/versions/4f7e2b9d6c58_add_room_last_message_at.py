@@ -0,0 +1,30 @@
+"""Add rooms.last_message_at for the room directory
+
+Revision ID: 4f7e2b9d6c58
+Revises: 0d6b9e3f5a27
+Create Date: 2026-10-19 15:06:33.518940
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f7e2b9d6c58'
+down_revision = '0d6b9e3f5a27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('rooms', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('last_message_at', sa.DateTime(), nullable=True))
+
+    # One index probe per room on (room_id, timestamp); rooms is small
+    op.execute("UPDATE rooms SET last_message_at = "
+               "(SELECT MAX(timestamp) FROM message WHERE message.room_id = rooms.id)")
+
+
+def downgrade():
+    with op.batch_alter_table('rooms', schema=None) as batch_op:
+        batch_op.drop_column('last_message_at')
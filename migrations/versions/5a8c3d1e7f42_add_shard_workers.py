@@ -0,0 +1,34 @@
+"""Add shard_workers table for room-affinity sharding
+
+Revision ID: 5a8c3d1e7f42
+Revises: 9e4f2a6b8c17
+Create Date: 2026-10-19 12:21:08.114520
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a8c3d1e7f42'
+down_revision = '9e4f2a6b8c17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('shard_workers',
+    sa.Column('worker_id', sa.String(length=128), nullable=False),
+    sa.Column('url', sa.String(length=255), nullable=False),
+    sa.Column('heartbeat_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('worker_id')
+    )
+    with op.batch_alter_table('shard_workers', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_shard_workers_heartbeat_at'), ['heartbeat_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('shard_workers', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_shard_workers_heartbeat_at'))
+
+    op.drop_table('shard_workers')
@@ -0,0 +1,154 @@
+"""Add rooms table and user/room/recipient id columns to message
+
+Revision ID: 7b2d4e9c1a35
+Revises: 3c9e1f7a2b64
+Create Date: 2026-10-19 11:02:17.530941
+
+Expand phase of replacing the repeated username/room/recipient strings with
+integer foreign keys. New columns are nullable (a metadata-only change), the
+backfill runs in id-range batches that each commit on their own, and indexes
+and foreign keys are built without blocking writers. The string columns are
+dropped by the follow-up revision 9e4f2a6b8c17 once every app instance writes
+ids.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b2d4e9c1a35'
+down_revision = '3c9e1f7a2b64'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000
+
+INDEXES = [
+    ('ix_message_room_id_timestamp', 'room_id, timestamp'),
+    ('ix_message_recipient_id_timestamp', 'recipient_id, timestamp'),
+    ('ix_message_user_id_timestamp', 'user_id, timestamp'),
+]
+
+FOREIGN_KEYS = [
+    ('message_user_id_fkey', 'user_id', 'users', 'ON DELETE SET NULL'),
+    ('message_room_id_fkey', 'room_id', 'rooms', ''),
+    ('message_recipient_id_fkey', 'recipient_id', 'users', 'ON DELETE SET NULL'),
+]
+
+
+def message_partitions(bind):
+    """Names of the partitions of message (empty if it is not partitioned)"""
+    return [row[0] for row in bind.execute(sa.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass('message')"
+    ))]
+
+
+def backfill_message_ids(bind, batch_size=BATCH_SIZE, autocommit=True):
+    """Fill user_id/room_id/recipient_id from the name columns, one id range at a time"""
+    op.execute("INSERT INTO rooms (name, created_at) "
+               "SELECT room, MIN(timestamp) FROM message m "
+               "WHERE room IS NOT NULL AND NOT EXISTS (SELECT 1 FROM rooms r WHERE r.name = m.room) "
+               "GROUP BY room")
+
+    bounds = bind.execute(sa.text("SELECT MIN(id), MAX(id) FROM message")).first()
+    if bounds[0] is None:
+        return
+    update = sa.text(
+        "UPDATE message SET "
+        "user_id = (SELECT id FROM users WHERE users.username = message.username), "
+        "room_id = (SELECT id FROM rooms WHERE rooms.name = message.room), "
+        "recipient_id = (SELECT id FROM users WHERE users.username = message.recipient) "
+        "WHERE id >= :lo AND id < :hi AND user_id IS NULL AND room_id IS NULL AND recipient_id IS NULL"
+    )
+
+    def run_batches():
+        for lo in range(bounds[0], bounds[1] + 1, batch_size):
+            op.execute(update.bindparams(lo=lo, hi=lo + batch_size))
+
+    if autocommit:
+        # Each batch commits by itself so row locks are held only briefly
+        with op.get_context().autocommit_block():
+            run_batches()
+    else:
+        run_batches()
+
+
+def upgrade():
+    op.create_table('rooms',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('rooms', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_rooms_name'), ['name'], unique=True)
+
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        with op.batch_alter_table('message', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('user_id', sa.Integer(), nullable=True))
+            batch_op.add_column(sa.Column('room_id', sa.Integer(), nullable=True))
+            batch_op.add_column(sa.Column('recipient_id', sa.Integer(), nullable=True))
+        backfill_message_ids(bind, autocommit=False)
+        with op.batch_alter_table('message', schema=None) as batch_op:
+            for name, column, table, _ in FOREIGN_KEYS:
+                batch_op.create_foreign_key(name, table, [column], ['id'])
+            for name, columns in INDEXES:
+                batch_op.create_index(name, [c.strip() for c in columns.split(',')], unique=False)
+        return
+
+    op.execute("ALTER TABLE message ADD COLUMN user_id INTEGER, "
+               "ADD COLUMN room_id INTEGER, ADD COLUMN recipient_id INTEGER")
+    backfill_message_ids(bind)
+
+    partitions = message_partitions(bind)
+    if partitions:
+        # CREATE INDEX CONCURRENTLY is not available on a partitioned parent:
+        # build each partition's index concurrently, then attach them
+        for name, columns in INDEXES:
+            op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY message ({columns})")
+        with op.get_context().autocommit_block():
+            for partition in partitions:
+                for name, columns in INDEXES:
+                    op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition}_{name[len('ix_message_'):]}_idx "
+                               f"ON {partition} ({columns})")
+        for partition in partitions:
+            for name, _ in INDEXES:
+                op.execute(f"ALTER INDEX {name} ATTACH PARTITION {partition}_{name[len('ix_message_'):]}_idx")
+
+        # NOT VALID foreign keys are not supported on partitioned tables either:
+        # validate them per partition (which doesn't block writes), after which
+        # the parent constraint adopts them without another scan
+        for partition in partitions:
+            for name, column, table, on_delete in FOREIGN_KEYS:
+                op.execute(f"ALTER TABLE {partition} ADD CONSTRAINT {name} FOREIGN KEY ({column}) "
+                           f"REFERENCES {table} (id) {on_delete} NOT VALID")
+                op.execute(f"ALTER TABLE {partition} VALIDATE CONSTRAINT {name}")
+        for name, column, table, on_delete in FOREIGN_KEYS:
+            op.execute(f"ALTER TABLE message ADD CONSTRAINT {name} FOREIGN KEY ({column}) "
+                       f"REFERENCES {table} (id) {on_delete}")
+    else:
+        with op.get_context().autocommit_block():
+            for name, columns in INDEXES:
+                op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON message ({columns})")
+        for name, column, table, on_delete in FOREIGN_KEYS:
+            op.execute(f"ALTER TABLE message ADD CONSTRAINT {name} FOREIGN KEY ({column}) "
+                       f"REFERENCES {table} (id) {on_delete} NOT VALID")
+            op.execute(f"ALTER TABLE message VALIDATE CONSTRAINT {name}")
+
+
+def downgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        for name, _ in INDEXES:
+            batch_op.drop_index(name)
+        for name, _, _, _ in FOREIGN_KEYS:
+            batch_op.drop_constraint(name, type_='foreignkey')
+        batch_op.drop_column('recipient_id')
+        batch_op.drop_column('room_id')
+        batch_op.drop_column('user_id')
+
+    with op.batch_alter_table('rooms', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_rooms_name'))
+
+    op.drop_table('rooms')
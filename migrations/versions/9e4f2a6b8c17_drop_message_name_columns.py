@@ -0,0 +1,103 @@
+"""Drop username/room/recipient string columns from message
+
+Revision ID: 9e4f2a6b8c17
+Revises: 7b2d4e9c1a35
+Create Date: 2026-10-19 11:04:52.208113
+
+Contract phase: run once every app instance writes user_id/room_id/
+recipient_id. Rows written by old instances since the expand migration are
+backfilled first; dropping a column is a metadata-only change on PostgreSQL.
+
+Names without a users row (messages of users deleted before the expand
+migration) get placeholder accounts, like the bulk importer creates, so no
+message loses its sender or recipient. The upgrade stops before dropping
+anything if a row with a name is still without its id.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4f2a6b8c17'
+down_revision = '7b2d4e9c1a35'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000
+PLACEHOLDER_EMAIL_DOMAIN = 'deleted.invalid'
+
+UNMAPPED = ("(user_id IS NULL AND username IS NOT NULL) "
+            "OR (room_id IS NULL AND room IS NOT NULL) "
+            "OR (recipient_id IS NULL AND recipient IS NOT NULL)")
+
+
+def upgrade():
+    bind = op.get_bind()
+    postgresql = bind.dialect.name == 'postgresql'
+
+    _catch_up(bind, autocommit=postgresql)
+
+    unmapped = bind.execute(sa.text(f"SELECT COUNT(*) FROM message WHERE {UNMAPPED}")).scalar()
+    if unmapped:
+        raise RuntimeError(f"{unmapped} message rows still have a name without its id; "
+                           f"not dropping the name columns")
+
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_index('ix_message_room_timestamp')
+        batch_op.drop_column('recipient')
+        batch_op.drop_column('room')
+        batch_op.drop_column('username')
+
+
+def _catch_up(bind, autocommit):
+    """Backfill the ids still missing: rows written by old app instances after
+    7b2d4e9c1a35 and rows whose user didn't exist at the expand migration"""
+    op.execute("INSERT INTO rooms (name, created_at) "
+               "SELECT room, MIN(timestamp) FROM message m "
+               "WHERE room IS NOT NULL AND NOT EXISTS (SELECT 1 FROM rooms r WHERE r.name = m.room) "
+               "GROUP BY room")
+    op.execute(f"INSERT INTO users (username, email, email_verified, is_active, created_at) "
+               f"SELECT name, name || '@{PLACEHOLDER_EMAIL_DOMAIN}', FALSE, FALSE, MIN(timestamp) FROM ("
+               f"  SELECT username AS name, timestamp FROM message WHERE username IS NOT NULL "
+               f"  UNION ALL "
+               f"  SELECT recipient, timestamp FROM message WHERE recipient IS NOT NULL"
+               f") names "
+               f"WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.username = names.name) "
+               f"GROUP BY name")
+
+    bounds = bind.execute(sa.text(f"SELECT MIN(id), MAX(id) FROM message WHERE {UNMAPPED}")).first()
+    if bounds[0] is None:
+        return
+    update = sa.text(
+        "UPDATE message SET "
+        "user_id = COALESCE(user_id, (SELECT id FROM users WHERE users.username = message.username)), "
+        "room_id = COALESCE(room_id, (SELECT id FROM rooms WHERE rooms.name = message.room)), "
+        "recipient_id = COALESCE(recipient_id, "
+        "(SELECT id FROM users WHERE users.username = message.recipient)) "
+        f"WHERE id >= :lo AND id < :hi AND ({UNMAPPED})"
+    )
+
+    def run_batches():
+        for lo in range(bounds[0], bounds[1] + 1, BATCH_SIZE):
+            op.execute(update.bindparams(lo=lo, hi=lo + BATCH_SIZE))
+
+    if autocommit:
+        with op.get_context().autocommit_block():
+            run_batches()
+    else:
+        run_batches()
+
+
+def downgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('username', sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column('room', sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column('recipient', sa.String(length=100), nullable=True))
+
+    op.execute("UPDATE message SET "
+               "username = (SELECT username FROM users WHERE users.id = message.user_id), "
+               "room = (SELECT name FROM rooms WHERE rooms.id = message.room_id), "
+               "recipient = (SELECT username FROM users WHERE users.id = message.recipient_id)")
+
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.create_index('ix_message_room_timestamp', ['room', 'timestamp'], unique=False)
@@ -0,0 +1,29 @@
+"""Add message.content_html, rendered at write time
+
+Revision ID: a6d3f8c2e491
+Revises: 4f7e2b9d6c58
+Create Date: 2026-10-19 16:12:47.203118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d3f8c2e491'
+down_revision = '4f7e2b9d6c58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Nullable without a default, so this is a catalog-only change on every
+    # partition. Existing rows stay NULL and are rendered on read (see
+    # app/rendering.py); they age out with the partitions that hold them.
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content_html', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_column('content_html')
@@ -0,0 +1,35 @@
+"""Add import_checkpoints table for resumable bulk imports
+
+Revision ID: b7e1c9d4f035
+Revises: a6d3f8c2e491
+Create Date: 2026-10-19 18:05:12.418306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e1c9d4f035'
+down_revision = 'a6d3f8c2e491'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('import_checkpoints',
+    sa.Column('source', sa.String(length=255), nullable=False),
+    sa.Column('byte_offset', sa.BigInteger(), nullable=False),
+    sa.Column('line_count', sa.BigInteger(), nullable=False),
+    sa.Column('row_count', sa.BigInteger(), nullable=False),
+    sa.Column('skipped_count', sa.BigInteger(), nullable=False),
+    sa.Column('indexes_deferred', sa.Boolean(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('source')
+    )
+
+
+def downgrade():
+    op.drop_table('import_checkpoints')
@@ -0,0 +1,86 @@
+"""Add delivered_at to message for store-and-forward private messages
+
+Revision ID: c41f6d2a9b83
+Revises: 5a8c3d1e7f42
+Create Date: 2026-10-19 13:02:44.671305
+
+Private messages with delivered_at NULL are waiting for their recipient. The
+partial index only contains those rows, so it stays small no matter how much
+history accumulates. Existing private messages are marked delivered (at their
+send time) in id-range batches so nobody gets their whole history replayed.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41f6d2a9b83'
+down_revision = '5a8c3d1e7f42'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000
+
+INDEX = 'ix_message_pending_delivery'
+INDEX_WHERE = 'delivered_at IS NULL AND is_private'
+
+
+def message_partitions(bind):
+    """Names of the partitions of message (empty if it is not partitioned)"""
+    return [row[0] for row in bind.execute(sa.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass('message')"
+    ))]
+
+
+def mark_existing_delivered(bind, autocommit=True):
+    """Treat private messages sent before this revision as delivered"""
+    bounds = bind.execute(sa.text("SELECT MIN(id), MAX(id) FROM message WHERE is_private")).first()
+    if bounds[0] is None:
+        return
+    update = sa.text("UPDATE message SET delivered_at = timestamp "
+                     "WHERE is_private AND delivered_at IS NULL AND id >= :lo AND id < :hi")
+
+    def run_batches():
+        for lo in range(bounds[0], bounds[1] + 1, BATCH_SIZE):
+            op.execute(update.bindparams(lo=lo, hi=lo + BATCH_SIZE))
+
+    if autocommit:
+        with op.get_context().autocommit_block():
+            run_batches()
+    else:
+        run_batches()
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        with op.batch_alter_table('message', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('delivered_at', sa.DateTime(), nullable=True))
+        mark_existing_delivered(bind, autocommit=False)
+        op.create_index(INDEX, 'message', ['recipient_id', 'id'], unique=False,
+                        sqlite_where=sa.text(INDEX_WHERE))
+        return
+
+    op.execute("ALTER TABLE message ADD COLUMN delivered_at TIMESTAMP WITHOUT TIME ZONE")
+    mark_existing_delivered(bind)
+
+    partitions = message_partitions(bind)
+    if partitions:
+        op.execute(f"CREATE INDEX IF NOT EXISTS {INDEX} ON ONLY message (recipient_id, id) WHERE {INDEX_WHERE}")
+        with op.get_context().autocommit_block():
+            for partition in partitions:
+                op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition}_pending_delivery_idx "
+                           f"ON {partition} (recipient_id, id) WHERE {INDEX_WHERE}")
+        for partition in partitions:
+            op.execute(f"ALTER INDEX {INDEX} ATTACH PARTITION {partition}_pending_delivery_idx")
+    else:
+        with op.get_context().autocommit_block():
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX} "
+                       f"ON message (recipient_id, id) WHERE {INDEX_WHERE}")
+
+
+def downgrade():
+    op.drop_index(INDEX, table_name='message')
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_column('delivered_at')
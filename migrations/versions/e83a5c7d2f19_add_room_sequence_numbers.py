@@ -0,0 +1,64 @@
+"""Add per-room sequence numbers to message
+
+Revision ID: e83a5c7d2f19
+Revises: c41f6d2a9b83
+Create Date: 2026-10-19 13:48:10.903266
+
+rooms.last_seq is the counter; new room messages take the next value. Existing
+messages are left with seq NULL: clients start from the room's current
+last_seq when the page loads, so history never needs numbering.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e83a5c7d2f19'
+down_revision = 'c41f6d2a9b83'
+branch_labels = None
+depends_on = None
+
+INDEX = 'ix_message_room_id_seq'
+
+
+def message_partitions(bind):
+    """Names of the partitions of message (empty if it is not partitioned)"""
+    return [row[0] for row in bind.execute(sa.text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass('message')"
+    ))]
+
+
+def upgrade():
+    with op.batch_alter_table('rooms', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('last_seq', sa.Integer(), server_default='0', nullable=False))
+
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        with op.batch_alter_table('message', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('seq', sa.Integer(), nullable=True))
+            batch_op.create_index(INDEX, ['room_id', 'seq'], unique=False)
+        return
+
+    op.execute("ALTER TABLE message ADD COLUMN seq INTEGER")
+    partitions = message_partitions(bind)
+    if partitions:
+        op.execute(f"CREATE INDEX IF NOT EXISTS {INDEX} ON ONLY message (room_id, seq)")
+        with op.get_context().autocommit_block():
+            for partition in partitions:
+                op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition}_room_id_seq_idx "
+                           f"ON {partition} (room_id, seq)")
+        for partition in partitions:
+            op.execute(f"ALTER INDEX {INDEX} ATTACH PARTITION {partition}_room_id_seq_idx")
+    else:
+        with op.get_context().autocommit_block():
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX} ON message (room_id, seq)")
+
+
+def downgrade():
+    op.drop_index(INDEX, table_name='message')
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_column('seq')
+
+    with op.batch_alter_table('rooms', schema=None) as batch_op:
+        batch_op.drop_column('last_seq')
@@ -0,0 +1,41 @@
+"""Add message_reactions and message_reactors tables for aggregated reactions
+
+Revision ID: f29b6c1d8e53
+Revises: d58a2e7c4b91
+Create Date: 2026-10-19 22:14:08.531760
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f29b6c1d8e53'
+down_revision = 'd58a2e7c4b91'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('message_reactions',
+    sa.Column('room_id', sa.Integer(), nullable=False),
+    sa.Column('seq', sa.Integer(), nullable=False),
+    sa.Column('emoji', sa.String(length=16), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['room_id'], ['rooms.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('room_id', 'seq', 'emoji')
+    )
+    op.create_table('message_reactors',
+    sa.Column('room_id', sa.Integer(), nullable=False),
+    sa.Column('seq', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('mask', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['room_id'], ['rooms.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('room_id', 'seq', 'user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('message_reactors')
+    op.drop_table('message_reactions')
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Replay recorded socket traffic against a running server
+
+Record traffic with TRAFFIC_RECORD_FILE set (see app/traffic.py), then point
+this script at a test server that shares this configuration's database and
+SECRET_KEY: it creates the recorded (anonymized) users and rooms, sends every
+event at its recorded time and reports ack latency per event and overall
+throughput. Save the report of one build with --report and pass it to the run
+of another with --baseline to see the differences.
+"""
+
+import json
+import sys
+from app import create_app, db, replay, socket_auth, traffic
+
+def _print_report(report, changes=None):
+    print(f"Replayed at {report['speed']}x in {report['duration_s']}s: "
+          f"{report['events']} events answered, {report['throughput']} events/s")
+    print(f"  lost (no ack): {report['lost']}, skipped (no connection): {report['skipped']}, "
+          f"sent late: {report['late_sends']} (max {report['max_lag_ms']} ms)")
+    if changes and changes['throughput'] is not None:
+        print(f"  throughput vs baseline: {changes['throughput']:+.1f}%")
+    print("")
+    header = f"{'event':<16}{'count':>8}{'errors':>8}{'rejected':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    if changes:
+        header += f"{'p50 Δ':>9}{'p95 Δ':>9}{'p99 Δ':>9}"
+    print(header)
+    print("-" * len(header))
+    for event, stats in report['by_event'].items():
+        line = (f"{event:<16}{stats['count']:>8}{stats['errors']:>8}{stats['rejected']:>10}"
+                + ''.join(f"{'-' if stats[key] is None else round(stats[key], 2):>10}"
+                          for key in ('p50_ms', 'p95_ms', 'p99_ms')))
+        if changes:
+            deltas = changes['by_event'].get(event, {})
+            line += ''.join(f"{'-' if deltas.get(p) is None else format(deltas[p], '+.1f') + '%':>9}"
+                            for p in ('p50', 'p95', 'p99'))
+        print(line)
+
+def replay_traffic(source, url, speed=1.0, report_path=None, baseline_path=None):
+    """Replay the recording `source` against the server at `url`"""
+
+    app = create_app()
+
+    with app.app_context():
+        try:
+            baseline = None
+            if baseline_path:
+                with open(baseline_path) as fh:
+                    baseline = json.load(fh)
+
+            header, records = traffic.read(source)
+            if not records:
+                print(f"No events in {source}.")
+                return False
+            print(f"Loaded {len(records)} events recorded since {header.get('started_at')} "
+                  f"({records[-1][0] / 1000:.1f}s of traffic).")
+
+            users = replay.prepare(records)
+            print(f"Prepared {len(users)} users. Replaying against {url} at {speed}x...")
+
+            def token_for(alias):
+                return socket_auth.issue_token(users[alias])[0]
+
+            report = replay.replay(records, url, token_for, speed,
+                                   progress=lambda done: print(f"  {done}/{len(records)} events sent..."),
+                                   heads=replay.room_heads(records))
+            changes = replay.compare(report, baseline) if baseline else None
+            print("")
+            _print_report(report, changes)
+
+            if report_path:
+                with open(report_path, 'w') as fh:
+                    json.dump(report, fh, indent=2)
+                print(f"\n✓ Report written to {report_path}")
+            return True
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"ERROR: Failed to replay {source}: {str(e)}")
+            return False
+
+def _option(name, default=None):
+    if name in sys.argv:
+        index = sys.argv.index(name)
+        if index + 1 < len(sys.argv):
+            value = sys.argv[index + 1]
+            del sys.argv[index:index + 2]
+            return value
+    return default
+
+if __name__ == '__main__':
+    speed = _option('--speed', '1')
+    report_path = _option('--report')
+    baseline_path = _option('--baseline')
+
+    if len(sys.argv) < 3:
+        print("Usage:")
+        print("  python replay_traffic.py <recording> <server_url> [--speed N] [--report report.json] [--baseline report.json]")
+        print("")
+        print("--speed N      replay N times faster than recorded (default 1)")
+        print("--report F     save the results as JSON")
+        print("--baseline F   show latency and throughput changes against a saved report")
+        print("")
+        print("Examples:")
+        print("  python replay_traffic.py traffic.ndjson.gz http://localhost:5000 --report before.json")
+        print("  python replay_traffic.py traffic.ndjson.gz http://localhost:5000 --speed 4 --baseline before.json")
+        sys.exit(1)
+
+    try:
+        speed = float(speed.rstrip('xX'))
+        if speed <= 0:
+            raise ValueError
+    except ValueError:
+        print("ERROR: --speed must be a positive number")
+        sys.exit(1)
+
+    if not replay_traffic(sys.argv[1], sys.argv[2], speed, report_path, baseline_path):
+        sys.exit(1)
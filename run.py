@@ -1,11 +1,47 @@
-import eventlet
-eventlet.monkey_patch()
-from flask import Flask, render_template, request, redirect
-from flask_socketio import SocketIO
+# Thumbnail worker processes (app/thumbnails.py) are spawned with this file
+# imported as __mp_main__. They only run render_thumbnail, so they skip all
+# of the setup below: no monkey-patching, no app and no background services.
+if __name__ != '__mp_main__':
+    import eventlet
+    eventlet.monkey_patch()
 
-from app import create_app, socketio
+    # psycopg2 is a C driver eventlet can't patch; make its I/O yield to the hub
+    from app import green
+    green.patch_psycopg()
 
-app = create_app()
+    from flask import Flask, render_template, request, redirect
+    from flask_socketio import SocketIO
+
+    from app import create_app, socketio, sharding, unread, reactions, watchdog, tracing, traffic, admission, sessions
+
+    app = create_app()
+
+    from app.socket_events import online_users_per_room, refresh_presence
+
+    # Join the room ownership ring (no-op unless SHARDING_ENABLED)
+    sharding.start(app, lambda: list(online_users_per_room))
+
+    # Persist unread read-markers in the background
+    unread.start(app)
+
+    # Write coalesced reactions and broadcast their deltas
+    reactions.start(app)
+
+    # Log and count anything that blocks the eventlet hub
+    watchdog.start(app)
+
+    # Write message latency traces to TRACE_FILE (no-op when unset)
+    tracing.start(app)
+
+    # Record socket traffic to TRAFFIC_RECORD_FILE (no-op when unset)
+    traffic.start(app)
+
+    # Presence lists coalesced while shedding load are sent from here
+    admission.start(app, refresh_presence)
+
+    # Drop expired server-side sessions
+    sessions.start(app)
 
 if __name__ == '__main__':
-    socketio.run(app, debug=True)
+    # The reloader's parent process would join the ring too; keep one process per worker
+    socketio.run(app, debug=True, use_reloader=not sharding.is_enabled())
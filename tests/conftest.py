@@ -0,0 +1,72 @@
+import pytest
+
+from app import create_app, db, socketio, socket_auth
+from app.models import User
+
+
+def _reset_state():
+    """Forget the per-process caches and counters left over from other tests"""
+    from app import batching, name_cache, reactions, room_directory, room_log, socket_events, unread
+
+    for mapping in (name_cache._user_ids, name_cache._usernames, name_cache._room_ids, name_cache._room_names,
+                    unread._heads, unread._read_seqs, unread._user_rooms, room_log._windows,
+                    reactions._pending, reactions._room_names, room_directory._rooms, room_directory._cache,
+                    batching._rates, batching._pending, socket_events.online_users_per_room,
+                    socket_events.user_sid_map, socket_events.recent_sends._entries):
+        mapping.clear()
+    unread._dirty.clear()
+    unread._released.clear()
+    room_directory._seeded_at = 0.0
+
+
+@pytest.fixture(scope='session')
+def _app():
+    # Socket handlers register on the first app's server only: one app per run
+    return create_app('testing')
+
+
+@pytest.fixture
+def app(_app, tmp_path):
+    _app.config['UPLOAD_FOLDER'] = str(tmp_path)
+    _reset_state()
+    with _app.app_context():
+        db.create_all()
+    yield _app
+    with _app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def make_user(app, username, password='Passw0rd!'):
+    with app.app_context():
+        user = User(username=username, email=f'{username}@example.com', email_verified=True)
+        user.set_password(password)
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+@pytest.fixture
+def alice(app):
+    return make_user(app, 'alice')
+
+
+@pytest.fixture
+def bob(app):
+    return make_user(app, 'bob')
+
+
+def login(app, username, password='Passw0rd!'):
+    client = app.test_client()
+    client.post('/login', data={'username': username, 'password': password})
+    return client
+
+
+def socket_client(app, username, **kwargs):
+    with app.app_context():
+        token, _ = socket_auth.issue_token(User.query.filter_by(username=username).one())
+    return socketio.test_client(app, auth={'token': token}, **kwargs)
+
+
+def received(client, name):
+    return [message['args'][0] for message in client.get_received() if message['name'] == name]
@@ -0,0 +1,59 @@
+"""Room history pages from live rows into archived months"""
+
+import gzip
+import json
+from datetime import datetime
+
+from app import db, reactions
+from app.models import Message, MessageArchive, Room
+from tests.conftest import login
+
+KEYS = {'id', 'username', 'content', 'content_html', 'timestamp', 'room', 'seq', 'recipient',
+        'is_private', 'reactions', 'my_reactions'}
+
+
+def _archive(path, room_id, user_id):
+    # As archive_partition() writes them: SELECT m.* plus the names
+    with gzip.open(path, 'wt', encoding='utf-8') as fh:
+        for i, day in enumerate([5, 5, 5, 6, 6], 1):
+            fh.write(json.dumps({
+                'id': i, 'user_id': user_id, 'room_id': room_id, 'recipient_id': None,
+                'content': f'**a{i}**', 'content_html': None if i == 1 else f'<b>a{i}</b>',
+                'timestamp': datetime(2020, 1, day, 12).isoformat(), 'is_private': False,
+                'seq': i, 'delivered_at': None, 'username': 'alice', 'room': 'general',
+                'recipient': None,
+            }) + '\n')
+
+
+def test_pages_run_through_the_archive_in_one_shape(app, alice, tmp_path):
+    path = str(tmp_path / 'message_y2020m01.ndjson.gz')
+    with app.app_context():
+        room = Room(name='general', last_seq=8)
+        db.session.add(room)
+        db.session.commit()
+        room_id = room.id
+        _archive(path, room_id, alice)
+        db.session.add(MessageArchive(partition_name='message_y2020m01', range_start=datetime(2020, 1, 1),
+                                      range_end=datetime(2020, 2, 1), path=path, row_count=5))
+        for seq in (6, 7, 8):
+            db.session.add(Message(user_id=alice, room_id=room_id, content=f'l{seq}',
+                                   timestamp=datetime(2026, 1, 5, 12), seq=seq))
+        db.session.commit()
+    reactions.react(room_id, 'general', 2, alice, '👍', True)
+    with app.app_context():
+        reactions.flush()
+
+    client = login(app, 'alice')
+    pages, params = [], {'limit': 3}
+    while True:
+        body = client.get('/api/rooms/general/messages', query_string=params).get_json()
+        pages = body['messages'] + pages
+        if not body['next_before']:
+            break
+        params = {'limit': 3, 'before': body['next_before'], 'before_id': body['next_before_id']}
+
+    assert [item['seq'] for item in pages] == [1, 2, 3, 4, 5, 6, 7, 8]
+    assert all(set(item) == KEYS for item in pages)
+    assert pages[0]['content_html'] == '<strong>a1</strong>'
+    assert pages[1]['reactions'] == {'👍': 1} and pages[1]['my_reactions'] == ['👍']
+    assert pages[0]['username'] == 'alice' and pages[0]['is_private'] is False
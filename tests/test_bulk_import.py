@@ -0,0 +1,73 @@
+"""Resumable NDJSON import"""
+
+import gzip
+import json
+import os
+
+import pytest
+
+from app import bulk_import, db
+from app.models import ImportCheckpoint, Message, Room, User
+
+
+class Interrupted(Exception):
+    pass
+
+
+def _write(path, count):
+    with gzip.open(path, 'wt', encoding='utf-8') as fh:
+        for i in range(count):
+            if i == 3:
+                fh.write('not json\n')
+                continue
+            if i % 5 == 0:
+                item = {'timestamp': f'2019-03-01T10:00:{i:02d}Z', 'username': f'u{i % 3}',
+                        'recipient': 'u1', 'is_private': True, 'content': f'dm {i}'}
+            else:
+                item = {'timestamp': f'2019-03-01T10:00:{i:02d}', 'room': f'room{i % 2}',
+                        'username': f'u{i % 3}', 'content': f'**{i}**'}
+            fh.write(json.dumps(item) + '\n')
+
+
+def test_interrupted_import_resumes_without_duplicates(app, tmp_path):
+    path = str(tmp_path / 'history.ndjson.gz')
+    _write(path, 20)
+    batches = []
+
+    def crash_after_two_batches(checkpoint, error=None):
+        if error is None:
+            batches.append(checkpoint.line_count)
+            if len(batches) == 2:
+                raise Interrupted()
+
+    with app.app_context():
+        with pytest.raises(Interrupted):
+            bulk_import.import_file(path, batch_size=6, progress=crash_after_two_batches)
+        db.session.rollback()
+        checkpoint = db.session.get(ImportCheckpoint, os.path.abspath(path))
+        assert (checkpoint.line_count, checkpoint.finished_at) == (12, None)
+        assert db.session.query(Message).count() == 11
+
+        checkpoint = bulk_import.import_file(path, batch_size=6)
+        assert checkpoint.finished_at is not None
+        assert (checkpoint.line_count, checkpoint.row_count, checkpoint.skipped_count) == (20, 19, 1)
+        assert db.session.query(Message).count() == 19
+
+        # A finished import is not loaded again, unless restarted
+        assert bulk_import.import_file(path).row_count == 19
+        assert db.session.query(Message).count() == 19
+
+
+def test_imported_rows(app, tmp_path):
+    path = str(tmp_path / 'history.ndjson.gz')
+    _write(path, 6)
+    with app.app_context():
+        bulk_import.import_file(path)
+        assert sorted(db.session.scalars(db.select(Room.name))) == ['room0', 'room1']
+        placeholder = User.query.filter_by(username='u2').one()
+        assert placeholder.email == f'u2@{bulk_import.PLACEHOLDER_EMAIL_DOMAIN}'
+
+        message = Message.query.filter(Message.content == '**1**').one()
+        assert message.content_html == '<strong>1</strong>' and message.seq is None
+        private = Message.query.filter(Message.is_private.is_(True)).first()
+        assert private.delivered_at == private.timestamp
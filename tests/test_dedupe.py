@@ -0,0 +1,50 @@
+"""Idempotent sends on client message ids"""
+
+from app import db
+from app.models import Message
+from app.socket_events import SendDedupeCache
+from tests.conftest import received, socket_client
+
+
+def test_replayed_send_is_stored_and_broadcast_once(app, alice):
+    client = socket_client(app, 'alice')
+    client.emit('join_room', {'room': 'general'})
+    client.get_received()
+
+    payload = {'room': 'general', 'message': 'hello', 'client_id': 'c-1'}
+    first = client.emit('send_message', payload, callback=True)
+    second = client.emit('send_message', payload, callback=True)
+
+    assert first == second
+    assert first['status'] == 'ok' and first['client_id'] == 'c-1'
+    assert len(received(client, 'receive_message')) == 1
+    with app.app_context():
+        assert db.session.query(Message).count() == 1
+
+
+def test_client_ids_are_per_user(app, alice, bob):
+    alice_socket = socket_client(app, 'alice')
+    bob_socket = socket_client(app, 'bob')
+    for client in (alice_socket, bob_socket):
+        client.emit('send_message', {'room': 'general', 'message': 'hi', 'client_id': 'same'}, callback=True)
+    with app.app_context():
+        assert db.session.query(Message).count() == 2
+
+
+def test_cache_is_bounded_and_releases_failed_sends(app):
+    cache = SendDedupeCache()
+    with app.app_context():
+        app.config['SEND_DEDUPE_MAX_ENTRIES'] = 2
+        try:
+            for key in ('a', 'b', 'c'):
+                assert cache.claim(key) == (True, None)
+            assert len(cache._entries) == 2
+            assert cache.claim('a') == (True, None)  # evicted, so new again
+
+            cache.complete('c', {'status': 'ok'})
+            assert cache.claim('c') == (False, {'status': 'ok'})
+
+            cache.release('a')
+            assert cache.claim('a') == (True, None)
+        finally:
+            app.config['SEND_DEDUPE_MAX_ENTRIES'] = 50000
@@ -0,0 +1,25 @@
+"""The metrics endpoint is never public outside debugging"""
+
+import pytest
+
+
+@pytest.fixture
+def metrics_config(app):
+    saved = app.config.get('METRICS_TOKEN'), app.testing
+    yield app.config
+    app.config['METRICS_TOKEN'], app.testing = saved
+
+
+def test_refused_without_a_token_outside_debug(app, metrics_config):
+    metrics_config['METRICS_TOKEN'] = None
+    app.testing = False
+    assert app.test_client().get('/metrics').status_code == 403
+
+
+def test_token_is_required_when_set(app, metrics_config):
+    metrics_config['METRICS_TOKEN'] = 's3cret'
+    client = app.test_client()
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer nope'}).status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+    assert response.status_code == 200 and b'socketio_connected_clients' in response.data
@@ -0,0 +1,47 @@
+"""Private messages reach recipients that aren't focused on this worker"""
+
+from app import db
+from app.models import Message
+from tests.conftest import login, received, socket_client
+
+
+def _delivered_at(app, message_id):
+    with app.app_context():
+        return db.session.get(Message, message_id).delivered_at
+
+
+def test_recipient_elsewhere_gets_it_and_confirms(app, alice, bob):
+    # Connected but not in this worker's user_sid_map, as if served by another worker
+    alice_socket = socket_client(app, 'alice')
+    bob_socket = socket_client(app, 'bob')
+    bob_socket.emit('join_room', {'room': 'general'})
+    alice_socket.get_received()
+
+    ack = bob_socket.emit('private_message', {'recipient': 'alice', 'message': 'psst'}, callback=True)
+    assert ack['status'] == 'queued'
+    [message] = received(alice_socket, 'receive_private_message')
+    assert message['confirm'] is True and message['message'] == 'psst'
+    assert _delivered_at(app, ack['id']) is None
+
+    assert alice_socket.emit('private_received', {'id': message['id']}, callback=True) == {'status': 'ok'}
+    assert _delivered_at(app, ack['id']) is not None
+
+    # Not pushed again from the pending queue
+    alice_socket.emit('join_room', {'room': 'general'})
+    assert received(alice_socket, 'receive_private_messages') == []
+
+
+def test_only_the_recipient_can_confirm(app, alice, bob):
+    alice_socket = socket_client(app, 'alice')
+    bob_socket = socket_client(app, 'bob')
+    ack = bob_socket.emit('private_message', {'recipient': 'alice', 'message': 'psst'}, callback=True)
+
+    assert bob_socket.emit('private_received', {'id': ack['id']}, callback=True) == {'status': 'ok'}
+    assert _delivered_at(app, ack['id']) is None
+    assert bob_socket.emit('private_received', {'id': 'x'}, callback=True) == {'status': 'invalid'}
+    assert received(alice_socket, 'receive_private_message')
+
+
+def test_room_owner_requires_login(app, alice):
+    assert app.test_client().get('/api/rooms/general/owner').status_code == 302
+    assert login(app, 'alice').get('/api/rooms/general/owner').status_code == 200
@@ -0,0 +1,68 @@
+"""Budgeted routes and socket handlers stay within @query_budget (strict in TestingConfig)"""
+
+import pytest
+
+from app.profiler import QueryBudgetExceeded, query_budget
+from tests.conftest import login, received, socket_client
+
+
+def test_strict_mode_raises_over_budget(app, alice):
+    from app.models import User
+
+    @query_budget(1)
+    def two_queries():
+        User.query.count()
+        User.query.count()
+
+    with app.test_request_context('/'):
+        with pytest.raises(QueryBudgetExceeded):
+            two_queries()
+
+
+def test_budgeted_routes(app, alice, bob):
+    client = login(app, 'alice')
+    sender = socket_client(app, 'bob')
+    sender.emit('join_room', {'room': 'general'})
+    for i in range(3):
+        sender.emit('send_message', {'room': 'general', 'message': f'hi {i}'})
+
+    assert client.get('/chat/general').status_code == 200
+    assert client.get('/chat/brand-new-room').status_code == 200
+    history = client.get('/api/rooms/general/messages?limit=2')
+    assert history.status_code == 200
+    assert [m['content'] for m in history.get_json()['messages']] == ['hi 1', 'hi 2']
+    assert client.get('/api/rooms').status_code == 200
+    assert client.get('/api/check-username?username=carol').status_code == 200
+    assert client.get('/api/check-email?email=carol@example.com').status_code == 200
+
+
+def test_budgeted_socket_handlers(app, alice, bob):
+    alice_socket = socket_client(app, 'alice')
+    bob_socket = socket_client(app, 'bob')
+
+    alice_socket.emit('join_room', {'room': 'general'})
+    ack = alice_socket.emit('send_message', {'room': 'general', 'message': 'hello', 'client_id': 'm1'},
+                            callback=True)
+    assert ack['status'] == 'ok'
+    # A room the user never read starts out read
+    bob_socket.emit('subscribe', {'rooms': ['general']})
+    alice_socket.emit('send_message', {'room': 'general', 'message': 'again'})
+    alice_socket.emit('send_message', {'room': 'brand-new-room', 'message': 'first'})
+
+    bob_socket.get_received()
+    bob_socket.emit('subscribe', {'rooms': ['general', 'brand-new-room', 'nowhere']})
+    states = received(bob_socket, 'subscribed')[0]['rooms']
+    assert states['general'] == {'seq': 2, 'unread': 1}
+    bob_socket.emit('focus', {'room': 'general'})
+    assert received(bob_socket, 'focused') == [{'room': 'general', 'seq': 2}]
+
+    ack = bob_socket.emit('private_message', {'recipient': 'alice', 'message': 'psst'}, callback=True)
+    assert ack['status'] == 'ok'
+    assert [m['message'] for m in received(alice_socket, 'receive_private_message')] == ['psst']
+
+    ack = bob_socket.emit('react', {'room': 'general', 'seq': 1, 'emoji': '👍', 'on': True}, callback=True)
+    assert ack['status'] == 'queued'
+
+    bob_socket.emit('resume', {'rooms': {'general': 0}})
+    resumed = received(bob_socket, 'resumed')
+    assert [m['seq'] for m in resumed[0]['messages']] == [1, 2]
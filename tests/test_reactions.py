@@ -0,0 +1,90 @@
+"""Coalesced reaction toggles and the counters written by flush()"""
+
+from app import db, reactions
+from app.models import MessageReaction, MessageReactor, Room
+from tests.conftest import make_user, received, socket_client
+
+
+def _room(app, name='general'):
+    with app.app_context():
+        room = Room(name=name)
+        db.session.add(room)
+        db.session.commit()
+        return room.id
+
+
+def _flush(app):
+    with app.app_context():
+        return reactions.flush()
+
+
+def _snapshot(app, room_id, user_id):
+    with app.app_context():
+        return reactions.snapshot(room_id, user_id)
+
+
+def test_toggles_within_one_window_coalesce(app, alice, bob):
+    room_id = _room(app)
+    reactions.react(room_id, 'general', 1, alice, '👍', True)
+    reactions.react(room_id, 'general', 1, alice, '👍', False)
+    reactions.react(room_id, 'general', 1, alice, '👍', True)
+    reactions.react(room_id, 'general', 1, bob, '👍', True)
+    reactions.react(room_id, 'general', 1, bob, '🎉', True)
+    reactions.react(room_id, 'general', 1, bob, '🎉', False)
+
+    assert _flush(app) == 2
+    counts, mine = _snapshot(app, room_id, alice)
+    assert counts == {1: {'👍': 2}}
+    assert mine == {1: ['👍']}
+
+
+def test_repeated_and_reverted_reactions_change_nothing(app, alice):
+    room_id = _room(app)
+    reactions.react(room_id, 'general', 1, alice, '👍', True)
+    assert _flush(app) == 1
+
+    reactions.react(room_id, 'general', 1, alice, '👍', True)
+    assert _flush(app) == 0
+    assert _snapshot(app, room_id, alice)[0] == {1: {'👍': 1}}
+
+
+def test_removing_the_last_reaction_deletes_the_rows(app, alice, bob):
+    room_id = _room(app)
+    reactions.react(room_id, 'general', 3, alice, '❤️', True)
+    reactions.react(room_id, 'general', 3, bob, '❤️', True)
+    reactions.react(room_id, 'general', 3, bob, '😂', True)
+    _flush(app)
+
+    reactions.react(room_id, 'general', 3, alice, '❤️', False)
+    reactions.react(room_id, 'general', 3, bob, '😂', False)
+    assert _flush(app) == 2
+    assert _snapshot(app, room_id, bob) == ({3: {'❤️': 1}}, {3: ['❤️']})
+
+    reactions.react(room_id, 'general', 3, bob, '❤️', False)
+    _flush(app)
+    with app.app_context():
+        assert db.session.query(MessageReaction).count() == 0
+        assert db.session.query(MessageReactor).count() == 0
+
+
+def test_flush_broadcasts_one_delta_frame_per_room(app, alice, bob):
+    room_id = _room(app)
+    carol = make_user(app, 'carol')
+    listener = socket_client(app, 'carol')
+    listener.emit('join_room', {'room': 'general'})
+    listener.get_received()
+
+    reactions.react(room_id, 'general', 1, alice, '👍', True)
+    reactions.react(room_id, 'general', 1, bob, '👍', True)
+    reactions.react(room_id, 'general', 2, carol, '🔥', True)
+    _flush(app)
+
+    frames = received(listener, 'reaction_deltas')
+    assert len(frames) == 1
+    assert frames[0]['room'] == 'general'
+    assert sorted(frames[0]['deltas']) == [[1, '👍', 2], [2, '🔥', 1]]
+
+
+def test_unknown_emoji_is_rejected(app, alice):
+    assert reactions.react(_room(app), 'general', 1, alice, '🦄', True) is False
+    assert reactions._pending == {}
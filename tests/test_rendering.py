@@ -0,0 +1,50 @@
+"""Message HTML is escaped, with only our own markup added"""
+
+from app.rendering import MAX_URL_DISPLAY, render_attachment, render_text
+
+
+def test_tags_and_quotes_are_escaped():
+    html = render_text('<script>alert("x")</script> <img src=x onerror=y>')
+    assert '<script>' not in html and '<img' not in html
+    assert '&lt;script&gt;' in html and '&#34;x&#34;' in html
+
+
+def test_formatting():
+    assert render_text('**bold** and _it_') == '<strong>bold</strong> and <em>it</em>'
+    assert render_text('`<b>` **x**') == '<code>&lt;b&gt;</code> <strong>x</strong>'
+    assert render_text('a\nb') == 'a<br>b'
+
+
+def test_links_are_escaped_after_matching():
+    html = render_text('see http://x.io/?q="a" ok')
+    assert html.startswith('see <a href="http://x.io/?q="')
+    assert html.endswith('</a>&#34;a&#34; ok')
+
+    html = render_text('http://x.io/a?b=1&c=2; done')
+    assert 'href="http://x.io/a?b=1&amp;c=2"' in html
+    assert html.endswith('</a>; done')
+
+
+def test_link_cannot_break_out_of_attribute():
+    html = render_text("http://x.io/'onmouseover=alert(1)")
+    assert "onmouseover" not in html.split('</a>')[0]
+
+
+def test_long_link_label_is_cut_between_entities():
+    url = 'http://example.com/' + '&' * 80
+    html = render_text(url)
+    label = html.split('>', 1)[1].split('</a>')[0]
+    assert label.endswith('&amp;…')
+    assert label.count('&amp;') == MAX_URL_DISPLAY - 1 - len('http://example.com/')
+
+
+def test_emphasis_inside_urls_is_left_alone():
+    html = render_text('http://x.io/a_b_c_ *ok*')
+    assert 'href="http://x.io/a_b_c_"' in html and html.endswith('<em>ok</em>')
+
+
+def test_attachment_urls_are_checked():
+    assert render_attachment('javascript:alert(1)', 'x.png') == '📎 x.png'
+    assert render_attachment('data:text/html,<b>', 'x.html') == '📎 x.html'
+    html = render_attachment('/uploads/a.pdf', '<b>.pdf')
+    assert 'href="/uploads/a.pdf"' in html and '&lt;b&gt;.pdf' in html
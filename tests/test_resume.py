@@ -0,0 +1,23 @@
+"""Resuming after a reconnect replays only the missed room messages"""
+
+from tests.conftest import received, socket_client
+
+
+def test_malformed_seqs_are_skipped(app, alice):
+    client = socket_client(app, 'alice')
+    client.emit('join_room', {'room': 'general'})
+    for text in ('one', 'two'):
+        client.emit('send_message', {'room': 'general', 'message': text})
+    client.get_received()
+
+    client.emit('resume', {'rooms': {'general': 'abc', 'other': [1], 'typo': True}})
+    assert received(client, 'resumed') == []
+
+    client.emit('resume', {'rooms': {'general': None, 'other': '1'}})
+    [resumed] = received(client, 'resumed')
+    assert [m['message'] for m in resumed['messages']] == ['one', 'two']
+
+    client.emit('resume', {'rooms': ['general']})
+    client.emit('resume', {'rooms': {'general': 1}})
+    [resumed] = received(client, 'resumed')
+    assert [m['seq'] for m in resumed['messages']] == [2]
@@ -0,0 +1,66 @@
+"""Server-side sessions: id rotation at login and expiry"""
+
+from datetime import datetime, timedelta
+
+from app import sessions
+from tests.conftest import login
+
+
+def _sid(app, client):
+    cookie = client.get_cookie(app.config.get('SESSION_COOKIE_NAME', 'session'))
+    return cookie.value if cookie else None
+
+
+def test_cookie_only_carries_the_id(app, alice):
+    client = login(app, 'alice')
+    sid = _sid(app, client)
+    assert sid and len(sid) >= 32
+    expires_at, blob = app.session_interface.store.load(sid, datetime.utcnow())
+    assert sessions.loads(blob)['_user_id'] == str(alice)
+
+
+def test_login_rotates_the_session_id(app, alice):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['planted'] = 'yes'
+    before = _sid(app, client)
+
+    client.post('/login', data={'username': 'alice', 'password': 'Passw0rd!'})
+    after = _sid(app, client)
+
+    store = app.session_interface.store
+    assert after and after != before
+    assert store.load(before, datetime.utcnow()) is None
+    assert sessions.loads(store.load(after, datetime.utcnow())[1])['planted'] == 'yes'
+
+
+def test_expired_sessions_are_ignored_and_purged(app, alice):
+    client = login(app, 'alice')
+    assert client.get('/chat/general').status_code == 200
+
+    sid = _sid(app, client)
+    store = app.session_interface.store
+    store.touch(sid, datetime.utcnow() - timedelta(seconds=1))
+
+    assert client.get('/chat/general').status_code == 302
+    with app.app_context():
+        assert sessions.purge() == 1
+    assert sid not in store._entries
+
+
+def test_unmodified_sessions_are_not_rewritten(app, alice):
+    client = login(app, 'alice')
+    sid = _sid(app, client)
+    store = app.session_interface.store
+    saved = store._entries[sid]
+
+    client.get('/api/rooms')
+    assert store._entries[sid] is saved
+
+
+def test_compression_round_trip():
+    data = {'text': 'x' * 1000, 'pair': (1, b'raw')}
+    blob = sessions.dumps(data)
+    assert blob[:1] == b'z' and len(blob) < 200
+    assert sessions.loads(blob) == data
+    assert sessions.dumps({'a': 1})[:1] == b'j'
@@ -0,0 +1,39 @@
+"""Thumbnail worker pool"""
+
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+pytest.importorskip('PIL')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Like run.py: a monkey-patched server process that made one thumbnail
+SERVER = textwrap.dedent("""
+    import eventlet
+    eventlet.monkey_patch()
+    import sys, tempfile
+    from PIL import Image
+    from app import create_app, thumbnails
+
+    app = create_app('testing')
+    app.config.update(UPLOAD_FOLDER=tempfile.mkdtemp(), THUMBNAILS_ENABLED=True)
+    with app.app_context():
+        Image.new('RGB', (640, 480)).save(app.config['UPLOAD_FOLDER'] + '/a.png')
+        name = thumbnails.submit('a.png')
+        sys.exit(0 if thumbnails.wait(name, 30) else 3)
+""")
+
+
+def test_server_exits_after_making_thumbnails():
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    env.pop('DATABASE_URL', None)
+    try:
+        result = subprocess.run([sys.executable, '-c', SERVER], cwd=ROOT, env=env,
+                                capture_output=True, text=True, timeout=60)
+    except subprocess.TimeoutExpired:
+        pytest.fail('the interpreter did not exit: thumbnail workers kept it alive')
+    assert result.returncode == 0, result.stderr
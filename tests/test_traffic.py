@@ -0,0 +1,42 @@
+"""Recorded traffic stays replayable after anonymizing"""
+
+from app import db, replay, traffic
+from app.models import Room
+from tests.conftest import socket_client
+
+
+def test_reaction_emoji_are_kept(app):
+    with app.app_context():
+        clean = traffic.anonymize({'room': 'general', 'seq': 3, 'emoji': '👍', 'on': False})
+        assert clean == {'room': traffic.alias('r', 'general'), 'seq': 3, 'emoji': '👍', 'on': False}
+        assert 'emoji' not in traffic.anonymize({'emoji': 'secret text'})
+
+
+def test_replayed_reaction_is_accepted(app, alice):
+    with app.app_context():
+        room = traffic.alias('r', 'general')
+        recorded = traffic.anonymize({'room': 'general', 'seq': 7, 'emoji': '🎉'})
+    client = socket_client(app, 'alice')
+    client.emit('join_room', {'room': room})
+    client.emit('send_message', {'room': room, 'message': 'hi'})
+
+    records = [[0, 1, 'react', recorded]]
+    with app.app_context():
+        heads = replay.room_heads(records)
+    assert heads == {room: 1}
+    payload = replay._on_target(recorded, heads[room])
+    assert payload['seq'] == 1
+    assert client.emit('react', payload, callback=True) == {'status': 'queued'}
+
+
+def test_reactions_wait_for_a_message_on_the_target(app):
+    with app.app_context():
+        db.session.add(Room(name='r-empty'))
+        db.session.commit()
+        assert replay.room_heads([[0, 1, 'react', {'room': 'r-empty', 'seq': 2}]]) == {'r-empty': 0}
+    assert replay._on_target({'room': 'r-empty', 'seq': 2}, 0) is None
+
+    results = replay._Results({'r-empty': 0})
+    results.sent(1)
+    results.acked(1, 'send_message', 0, ({'status': 'ok', 'seq': 4},), 'r-empty')
+    assert results.head('r-empty') == 4
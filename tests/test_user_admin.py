@@ -0,0 +1,36 @@
+"""Deleting users keeps the message history attributed"""
+
+from app import db, user_admin
+from app.models import Message, User
+
+
+def _delete(app, username):
+    with app.app_context():
+        return user_admin.delete_user(User.query.filter_by(username=username).one())
+
+
+def test_users_without_messages_are_deleted(app, alice):
+    assert _delete(app, 'alice') == 'deleted'
+    with app.app_context():
+        assert db.session.get(User, alice) is None
+
+
+def test_users_in_the_history_are_retired(app, alice, bob):
+    with app.app_context():
+        db.session.add(Message(user_id=bob, recipient_id=alice, content='hi', is_private=True))
+        db.session.commit()
+
+    assert _delete(app, 'alice') == 'retired'
+    assert _delete(app, 'bob') == 'retired'
+    with app.app_context():
+        user = db.session.get(User, alice)
+        assert user.email == f'alice@{user_admin.RETIRED_EMAIL_DOMAIN}'
+        assert user.password_hash is None and not user.is_active
+        message = Message.query.one()
+        assert message.to_dict()['username'] == 'bob'
+        assert message.to_dict()['recipient'] == 'alice'
+
+    client = app.test_client()
+    response = client.post('/login', data={'username': 'alice', 'password': 'Passw0rd!'})
+    assert response.status_code != 302
+
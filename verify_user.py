@@ -4,7 +4,7 @@ Script to manually verify a user's email for testing purposes
 """
 
 import sys
-from app import create_app, db
+from app import create_app, db, user_admin
 from app.models import User
 
 def verify_user_email(username_or_email):
@@ -30,7 +30,6 @@ def verify_user_email(username_or_email):
             # Manually verify the user
             user.email_verified = True
             user.email_verification_token = None
-            user.email_verification_token_expires = None
             
             db.session.commit()
             
@@ -50,15 +49,15 @@ def list_users():
     
     with app.app_context():
         try:
-            users = User.query.all()
+            total = user_admin.count_users()
             
-            if not users:
+            if not total:
                 print("No users found in the database.")
                 return
             
-            print("Users in database:")
+            print(f"Users in database ({total}):")
             print("-" * 60)
-            for user in users:
+            for user in user_admin.stream_users():
                 status = "✓ Verified" if user.email_verified else "✗ Not Verified"
                 print(f"Username: {user.username}")
                 print(f"Email: {user.email}")